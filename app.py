@@ -1,12 +1,10 @@
 # main.py
-import asyncio
 import os
 import sys
 if sys.platform == "win32":
     import winreg
 else:
     winreg = None
-from ui.main_window import MainWindow
 
 def add_to_startup(file_path=None):
     """Thêm app vào startup Windows (tự chạy khi khởi động)"""
@@ -23,6 +21,14 @@ def add_to_startup(file_path=None):
         print(f"⚠️ Failed to add to startup: {e}")
         
 if __name__ == "__main__":
+    if "--headless" in sys.argv[1:]:
+        # không import ui.* — xem core/agent.py
+        from core.agent import main
+        args = [arg for arg in sys.argv[1:] if arg != "--headless"]
+        add_to_startup(f'"{os.path.realpath(sys.argv[0])}" --headless')
+        sys.exit(main(args))
+
+    from ui.main_window import MainWindow
     add_to_startup()
     app = MainWindow()
     app.mainloop()
@@ -0,0 +1,224 @@
+# bench/bench_e2e.py
+"""
+Benchmark end-to-end với relay, Telegram và TTS giả lập chạy local:
+
+  - get_list_process / shell / screenshot: round-trip từ lúc relay gửi
+    command tới lúc nhận kết quả cuối (p50/p99), và throughput khi có
+    --concurrency lệnh cùng bay.
+  - chat: từ lúc relay gửi frame chat tới lúc TTS stub nhận request tổng hợp
+    giọng nói (đường GUI: chat -> TTS).
+
+Agent chạy trong process này với HOME tạm (config.json trỏ mọi endpoint về
+stub), nên không đụng tới cấu hình thật. Screenshot cần màn hình: nếu không
+có DISPLAY mà có Xvfb thì tự mở một display ảo, không thì bỏ qua.
+
+    python -m bench.bench_e2e [--iterations 50] [--concurrency 8] [--duration 5] [--output result.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stubs import ControllerRelay, TelegramStub, TTSStub  # noqa: E402
+
+SCENARIOS = {
+    "get_list_process": {"type": "get_list_process", "top": 10, "limit": 50},
+    "shell": {"type": "shell", "command": "echo bench"},
+    "screenshot": {"type": "screenshot", "format": "jpeg", "quality": 70, "binary": True,
+                   "save": False, "telegram": False},
+}
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies, failures, throughput=None):
+    ms = [s * 1000 for s in latencies]
+    return {
+        "samples": len(ms),
+        "failures": failures,
+        "p50_ms": round(percentile(ms, 0.5), 2) if ms else None,
+        "p99_ms": round(percentile(ms, 0.99), 2) if ms else None,
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else None,
+        "throughput_per_s": throughput,
+    }
+
+
+def start_virtual_display():
+    """Trả về (process Xvfb hoặc None, lý do bỏ qua hoặc None)."""
+    if platform.system() != "Linux" or os.environ.get("DISPLAY"):
+        return None, None
+    if not shutil.which("Xvfb"):
+        return None, "no DISPLAY and Xvfb not installed"
+    display = f":{90 + os.getpid() % 100}"
+    proc = subprocess.Popen(["Xvfb", display, "-screen", "0", "1920x1080x24", "-nolisten", "tcp"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0)
+    if proc.poll() is not None:
+        return None, "Xvfb failed to start"
+    os.environ["DISPLAY"] = display
+    return proc, None
+
+
+def screenshot_available():
+    try:
+        import pyautogui  # noqa: F401
+        import PIL  # noqa: F401
+        return None
+    except Exception as e:
+        return f"screenshot unavailable: {e}"
+
+
+def bench_command(relay, data, iterations, concurrency, duration, warmup=3):
+    for _ in range(warmup):
+        relay.request(data)
+
+    latencies, failures = [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = relay.request(data)
+        if result is None or result.get("status") not in ("success", None):
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+    # throughput: giữ `concurrency` lệnh cùng bay trong `duration` giây
+    completed = [0]
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            result = relay.request(data)
+            if result is not None and result.get("status") in ("success", None):
+                completed[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    throughput = round(completed[0] / (time.perf_counter() - started), 1)
+    return summarize(latencies, failures, throughput)
+
+
+def bench_chat(relay, tts, iterations):
+    latencies, failures = [], 0
+    for i in range(iterations):
+        text = f"bench chat {i} {uuid.uuid4().hex[:8]}"   # text mới -> luôn miss cache TTS
+        started = time.perf_counter()
+        relay.send({"type": "chat", "from": "bench", "message": text})
+        arrived = tts.wait_for(f"bench: {text}")
+        if arrived is None:
+            failures += 1
+            continue
+        latencies.append(arrived - started)
+    return summarize(latencies, failures)
+
+
+def run(args):
+    home = tempfile.mkdtemp(prefix="agent-bench-")
+    os.environ["HOME"] = os.environ["USERPROFILE"] = home   # Config / cache / outbox nằm trong HOME tạm
+
+    relay = ControllerRelay().start()
+    telegram = TelegramStub().start()
+    tts = TTSStub().start()
+    xvfb, display_skip = start_virtual_display()
+
+    os.makedirs(os.path.join(home, ".window_manager_agent"), exist_ok=True)
+    with open(os.path.join(home, ".window_manager_agent", "config.json"), "w") as f:
+        json.dump({
+            "server_url": relay.url,
+            "telegram_api_base": telegram.url,
+            "telegram_token": "bench",
+            "telegram_chat_id": "bench",
+            "tts_base_url": tts.url,
+            "tts_api_key": "bench",
+            # tắt cache / coalescing: bench đo lệnh chạy thật, không đo cache hit
+            "command_cache_ttl": {name: None for name in SCENARIOS},
+        }, f)
+
+    from core import tts_service
+    from core.websocket_client import WebSocketClient
+
+    speech = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bench-tts")
+    client = WebSocketClient(on_chat_callback=lambda msg: speech.submit(tts_service.synthesize, msg))
+    connect_started = time.perf_counter()
+    client.connect()
+    if not relay.connected.wait(30):
+        raise RuntimeError("agent did not connect to the local relay")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "connect_ms": round((time.perf_counter() - connect_started) * 1000, 2),
+        "results": {},
+    }
+    try:
+        for name in args.scenarios:
+            if name == "chat":
+                report["results"][name] = bench_chat(relay, tts, args.iterations)
+                continue
+            if name == "screenshot":
+                skip = display_skip or screenshot_available()
+                if skip:
+                    report["results"][name] = {"skipped": skip}
+                    continue
+            report["results"][name] = bench_command(
+                relay, SCENARIOS[name], args.iterations, args.concurrency, args.duration)
+        report["telegram_requests"] = len(telegram.messages)
+    finally:
+        client.stop()
+        relay.stop()
+        telegram.stop()
+        tts.stop()
+        speech.shutdown(wait=False)
+        if xvfb:
+            xvfb.terminate()
+        shutil.rmtree(home, ignore_errors=True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50, help="số lần đo latency tuần tự mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=8, help="số lệnh cùng bay khi đo throughput")
+    parser.add_argument("--duration", type=float, default=5.0, help="giây đo throughput mỗi kịch bản")
+    parser.add_argument("--scenarios", nargs="+", default=[*SCENARIOS, "chat"],
+                        choices=[*SCENARIOS, "chat"])
+    parser.add_argument("--output", help="ghi JSON vào file thay vì stdout")
+    args = parser.parse_args(argv)
+
+    # log của agent ra stderr để stdout chỉ còn JSON
+    real_stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        report = run(args)
+    finally:
+        sys.stdout = real_stdout
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if all(r.get("failures", 0) == 0 for r in report["results"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
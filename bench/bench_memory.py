@@ -0,0 +1,81 @@
+# bench/bench_memory.py
+"""
+Kiểm tra ngân sách bộ nhớ của agent headless (core.agent.RSS_BUDGET_MB):
+khởi chạy `python -m core.agent` trỏ tới relay giả lập, chờ kết nối, đợi
+agent ổn định rồi đo RSS. Đồng thời kiểm tra không có thư viện GUI nào bị
+import. Exit code 1 nếu vượt ngân sách hoặc có module GUI.
+
+    python -m bench.bench_memory [--settle 2] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stubs import ConnectRecorder  # noqa: E402
+from core.agent import GUI_MODULES, RSS_BUDGET_MB  # noqa: E402
+
+GUI_CHECK_SCRIPT = (
+    "import sys, core.agent, core.websocket_client; "
+    "print(','.join(m for m in {modules!r} if m in sys.modules))"
+)
+
+
+def rss_mb(pid):
+    import psutil
+    return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+
+
+def run(settle):
+    server = ConnectRecorder().start()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "core.agent", "--server-url", f"{server.url}/ws"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not server.connected.wait(30):
+            return {"error": "agent did not connect"}
+        time.sleep(settle)
+        rss = rss_mb(proc.pid)
+    finally:
+        proc.kill()
+        proc.wait()
+        server.stop()
+
+    gui = subprocess.run(
+        [sys.executable, "-c", GUI_CHECK_SCRIPT.format(modules=GUI_MODULES)],
+        cwd=ROOT, capture_output=True, text=True,
+    ).stdout.strip()
+    return {
+        "rss_mb": round(rss, 1),
+        "budget_mb": RSS_BUDGET_MB,
+        "within_budget": rss <= RSS_BUDGET_MB,
+        "gui_modules_loaded": [m for m in gui.split(",") if m],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settle", type=float, default=2.0, help="giây chờ sau khi kết nối trước khi đo")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    result = run(args.settle)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif "error" in result:
+        print(result["error"])
+    else:
+        print(f"headless RSS: {result['rss_mb']} MB (budget {result['budget_mb']} MB)")
+        print(f"GUI modules loaded: {', '.join(result['gui_modules_loaded']) or 'none'}")
+    ok = result.get("within_budget") and not result.get("gui_modules_loaded")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
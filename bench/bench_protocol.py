@@ -0,0 +1,102 @@
+# bench/bench_protocol.py
+"""
+So sánh thời gian encode và số byte trên dây giữa các codec của core.protocol
+cho hai loại payload nặng nhất: danh sách process và screenshot.
+
+    python -m bench.bench_protocol [--repeat 50] [--json]
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.protocol import Codec, msgpack  # noqa: E402
+
+
+def process_list_payload(count=2000):
+    try:
+        import psutil
+        procs = [p.info for p in psutil.process_iter(["pid", "name", "username", "cpu_percent", "memory_percent"])]
+    except ImportError:
+        procs = []
+    rnd = random.Random(42)
+    while len(procs) < count:  # bổ sung process giả cho đủ cỡ máy bận
+        procs.append({"pid": rnd.randint(100, 60000), "name": f"worker-{rnd.randint(0, 500)}.exe",
+                      "username": "DESKTOP\\user", "cpu_percent": rnd.random() * 10,
+                      "memory_percent": rnd.random() * 5})
+    data = [{"pid": p["pid"], "name": p["name"], "user": p["username"],
+             "cpu": round(p["cpu_percent"] or 0.0, 2), "memory": round(p["memory_percent"] or 0.0, 2)}
+            for p in procs[:count]]
+    return {"type": "forward_list_running_process", "status": "success",
+            "data": {"total": len(data), "top_processes": data[:30], "data": data}}
+
+
+def screenshot_bytes(width=1920, height=1080):
+    from PIL import Image, ImageDraw
+    rnd = random.Random(7)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(400):  # giả lập cửa sổ / chữ trên desktop
+        x, y = rnd.randint(0, width), rnd.randint(0, height)
+        draw.rectangle((x, y, x + rnd.randint(10, 300), y + rnd.randint(5, 80)),
+                       fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def measure(encode, repeat):
+    data = encode()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        encode()
+    elapsed = (time.perf_counter() - started) / repeat
+    return {"encode_ms": round(elapsed * 1000, 3), "bytes": len(data)}
+
+
+def run(repeat):
+    png = screenshot_bytes()
+    payloads = {
+        "process_list": (process_list_payload(), None),
+        "screenshot": ({"type": "show_screenshot", "status": "success",
+                        "file": base64.b64encode(png).decode("ascii")},
+                       {"type": "show_screenshot", "status": "success", "file": png}),
+    }
+    codecs = [("json", Codec("json"))]
+    if msgpack:
+        codecs += [("msgpack", Codec("msgpack")), ("msgpack+deflate", Codec("msgpack", compress=True))]
+
+    results = []
+    for name, (text_payload, binary_payload) in payloads.items():
+        results.append({"payload": name, "codec": "json(v1)",
+                        **measure(lambda: json.dumps(text_payload), repeat)})
+        for codec_name, codec in codecs:
+            payload = binary_payload or text_payload
+            results.append({"payload": name, "codec": codec_name,
+                            **measure(lambda: codec.encode(payload)[0], repeat)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'payload':<14}{'codec':<18}{'encode ms':>12}{'bytes':>12}")
+    for r in results:
+        print(f"{r['payload']:<14}{r['codec']:<18}{r['encode_ms']:>12}{r['bytes']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# bench/bench_startup.py
+"""
+Đo thời gian khởi động của agent:
+
+  1. import time  — chạy `python -X importtime` cho module entry point và
+     tổng hợp thời gian import (tổng + các package nặng nhất).
+  2. time-to-connected — khởi chạy một process mới tạo WebSocketClient trỏ tới
+     relay giả lập local, đo từ lúc spawn tới lúc handshake websocket xong.
+
+    python -m bench.bench_startup [--module ui.main_window] [--runs 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stubs import ConnectRecorder  # noqa: E402
+
+CONNECT_SCRIPT = """
+import sys, threading
+sys.path.insert(0, {root!r})
+import core.websocket_client as wc
+wc.Config().server_url = {url!r}
+connected = threading.Event()
+client = wc.WebSocketClient(on_status_callback=lambda ok: ok and connected.set())
+client.connect()
+connected.wait(30)
+"""
+
+
+def import_time(module, runs):
+    totals, packages = [], {}
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        children = []  # importtime in theo post-order: con xuất hiện trước cha
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            try:
+                cumulative_us = int(cumulative)
+            except ValueError:
+                continue  # dòng tiêu đề
+            depth = len(name) - len(name.lstrip())
+            name = name.strip()
+            if depth == 3:
+                children.append((name, cumulative_us))
+            elif depth == 1:
+                if name == module:
+                    totals.append(cumulative_us)
+                    for child, child_us in children:
+                        packages.setdefault(child, []).append(child_us)
+                children = []
+    heaviest = sorted(((statistics.median(v) / 1000, k) for k, v in packages.items()), reverse=True)[:10]
+    return {
+        "module": module,
+        "total_ms": round(statistics.median(totals) / 1000, 2),
+        "heaviest": [{"package": name, "ms": round(ms, 2)} for ms, name in heaviest],
+    }
+
+
+def time_to_connected(runs):
+    samples = []
+    for _ in range(runs):
+        server = ConnectRecorder().start()
+        script = CONNECT_SCRIPT.format(root=ROOT, url=f"{server.url}/ws")
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", script], cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        ok = server.connected.wait(30)
+        if ok:
+            samples.append((server.connect_times[0] - started) * 1000)
+        proc.kill()
+        proc.wait()
+        server.stop()
+    if not samples:
+        return {"error": "agent did not connect"}
+    return {
+        "runs": len(samples),
+        "median_ms": round(statistics.median(samples), 2),
+        "min_ms": round(min(samples), 2),
+        "max_ms": round(max(samples), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="ui.main_window", help="module entry point cần đo import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args()
+
+    results = {
+        "python": sys.version.split()[0],
+        "import": import_time(args.module, args.runs),
+        "time_to_connected": time_to_connected(args.runs),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    imp = results["import"]
+    print(f"import {imp['module']}: {imp['total_ms']} ms (median of {args.runs})")
+    for entry in imp["heaviest"]:
+        print(f"  {entry['package']:<32}{entry['ms']:>10} ms")
+    ttc = results["time_to_connected"]
+    if "error" in ttc:
+        print(f"time-to-connected: {ttc['error']}")
+    else:
+        print(f"time-to-connected: median {ttc['median_ms']} ms (min {ttc['min_ms']}, max {ttc['max_ms']})")
+
+
+if __name__ == "__main__":
+    main()
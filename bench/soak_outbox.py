@@ -0,0 +1,114 @@
+# bench/soak_outbox.py
+"""
+Kiểm tra độ bền của result outbox: agent gửi N kết quả durable tới relay giả
+lập cắt kết nối ngẫu nhiên; mọi result_seq phải tới nơi và outbox phải rỗng.
+--no-acks: relay cũ không ack — kết quả vẫn phải tới và outbox không được giữ gì.
+
+    python -m bench.soak_outbox [--results 200] [--drop-rate 0.1] [--no-acks] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stubs import FlakyAckRelay  # noqa: E402
+
+
+def run(results, drop_rate, timeout, seed, acks=True):
+    import core.websocket_client as wc
+    from core.result_outbox import ResultOutbox
+
+    relay = FlakyAckRelay(drop_rate=drop_rate if acks else 0.0, seed=seed, acks=acks).start()
+    wc.Config().server_url = relay.url
+    wc.RECONNECT_BASE_DELAY = 0.05
+    wc.RECONNECT_MAX_DELAY = 0.2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = wc.WebSocketClient()
+        client.outbox = ResultOutbox(os.path.join(tmp, "outbox.log"))
+        client.controllers.add("soak")
+        client.connect()
+        deadline = time.monotonic() + timeout
+        while not client._protocol_ready.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if not acks:
+            time.sleep(wc.PROTOCOL_WAIT + 0.5)     # relay cũ không gửi frame protocol
+
+        started = time.perf_counter()
+        outbox_max = 0
+        for i in range(results):
+            client.send_result({"type": "command_result", "status": "success", "i": i}, durable=True)
+            outbox_max = max(outbox_max, len(client.outbox))
+            time.sleep(0.002)
+
+        expected = set(range(1, results + 1))
+        while time.monotonic() < deadline:
+            if acks and expected <= relay.delivered() and len(client.outbox) == 0:
+                break
+            if not acks and len(relay.results) >= results:
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        if not acks:
+            received = {r["i"] + 1 for r in relay.results}
+            missing = sorted(expected - received)
+            report = {
+                "results": results,
+                "acks": False,
+                "delivered": len(expected & received),
+                "missing": missing[:20],
+                "outbox_max": outbox_max,
+                "unacked": len(client.outbox),
+                "seconds": round(elapsed, 2),
+            }
+            client.stop()
+            client.outbox._file.close()
+            relay.stop()
+            return report
+
+        missing = sorted(expected - relay.delivered())
+        report = {
+            "results": results,
+            "drop_rate": drop_rate,
+            "connection_drops": relay.drops,
+            "delivered": len(expected & relay.delivered()),
+            "duplicates": len(relay.received) - len(set(relay.received)),
+            "missing": missing[:20],
+            "unacked": len(client.outbox),
+            "seconds": round(elapsed, 2),
+        }
+        client.stop()
+        client.outbox._file.close()
+    relay.stop()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=200)
+    parser.add_argument("--drop-rate", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-acks", action="store_true", help="relay cũ: không gửi frame protocol, không ack")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args.results, args.drop_rate, args.timeout, args.seed, acks=not args.no_acks)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        ok = not report["missing"] and not report["unacked"]
+        print(f"{'✅' if ok else '❌'} {report['delivered']}/{report['results']} results delivered "
+              f"in {report['seconds']}s — {report.get('connection_drops', 0)} dropped connection(s), "
+              f"{report.get('duplicates', 0)} duplicate(s), {report['unacked']} unacked")
+    return 0 if not report["missing"] and not report["unacked"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+# bench/stubs.py
+"""
+Server giả lập chạy local (chỉ dùng stdlib) để đo đạc agent mà không cần
+relay / Telegram / TTS thật.
+"""
+import base64
+import hashlib
+import socket
+import struct
+import threading
+import time
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+class StubConnection:
+    def __init__(self, sock, path, query):
+        self.sock = sock
+        self.path = path
+        self.query = query
+        self.connected_at = time.perf_counter()
+        self.closed = False
+        self._send_lock = threading.Lock()
+
+    def send(self, data, opcode=None):
+        if opcode is None:
+            opcode = OP_TEXT if isinstance(data, str) else OP_BINARY
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        length = len(data)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        try:
+            with self._send_lock:
+                self.sock.sendall(header + data)
+        except OSError:
+            self.closed = True
+
+    def close(self):
+        """Đóng đột ngột (không gửi close frame) — giả lập mất mạng."""
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _recv_exact(self, size):
+        chunks = []
+        while size:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise ConnectionError("socket closed")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def recv_frame(self):
+        """Trả về (opcode, payload) của một message hoàn chỉnh."""
+        opcode, parts = None, []
+        while True:
+            b1, b2 = self._recv_exact(2)
+            fin, op = b1 & 0x80, b1 & 0x0F
+            length = b2 & 0x7F
+            if length == 126:
+                (length,) = struct.unpack("!H", self._recv_exact(2))
+            elif length == 127:
+                (length,) = struct.unpack("!Q", self._recv_exact(8))
+            mask = self._recv_exact(4) if b2 & 0x80 else None
+            payload = self._recv_exact(length)
+            if mask:
+                payload = _unmask(payload, mask)
+            if op >= 0x8:  # control frame có thể chen giữa message bị phân mảnh
+                return op, payload
+            if op != OP_CONT:
+                opcode = op
+            parts.append(payload)
+            if fin:
+                return opcode, b"".join(parts)
+
+
+def _unmask(payload, mask):
+    # XOR cả payload một lần bằng số nguyên lớn thay vì từng byte trong Python
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(repeated, "little")).to_bytes(len(payload), "little")
+
+
+class WebSocketStubServer:
+    """
+    Websocket server tối giản. Lớp con override on_connect / on_message / on_disconnect.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(64)
+        self.host, self.port = self.sock.getsockname()
+        self.connections = []
+        self._stopped = False
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self.sock.close()
+        for conn in list(self.connections):
+            conn.close()
+
+    # ----- hooks -----
+
+    def on_connect(self, conn):
+        pass
+
+    def on_message(self, conn, opcode, data):
+        pass
+
+    def on_disconnect(self, conn):
+        pass
+
+    # -----------------
+
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _handshake(self, client):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = client.recv(4096)
+            if not chunk:
+                raise ConnectionError("handshake aborted")
+            request += chunk
+        lines = request.split(b"\r\n\r\n", 1)[0].decode("latin-1").split("\r\n")
+        target = lines[0].split(" ")[1]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()).decode()
+        client.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        path, _, query_string = target.partition("?")
+        query = dict(pair.partition("=")[::2] for pair in query_string.split("&") if pair)
+        return path, query
+
+    def _serve(self, client):
+        try:
+            path, query = self._handshake(client)
+        except (OSError, ConnectionError, KeyError, IndexError):
+            client.close()
+            return
+        conn = StubConnection(client, path, query)
+        self.connections.append(conn)
+        try:
+            self.on_connect(conn)
+            while not conn.closed:
+                opcode, data = conn.recv_frame()
+                if opcode == OP_CLOSE:
+                    conn.send(data[:2], OP_CLOSE)
+                    break
+                if opcode == OP_PING:
+                    conn.send(data, OP_PONG)
+                    continue
+                if opcode == OP_PONG:
+                    continue
+                self.on_message(conn, opcode, data if opcode == OP_BINARY else data.decode("utf-8"))
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            conn.closed = True
+            if conn in self.connections:
+                self.connections.remove(conn)
+            try:
+                client.close()
+            except OSError:
+                pass
+            self.on_disconnect(conn)
+
+
+class ConnectRecorder(WebSocketStubServer):
+    """Chỉ ghi lại thời điểm từng kết nối websocket hoàn tất handshake."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = threading.Event()
+        self.connect_times = []
+
+    def on_connect(self, conn):
+        self.connect_times.append(conn.connected_at)
+        self.connected.set()
+
+
+class FlakyAckRelay(WebSocketStubServer):
+    """
+    Relay giả lập: ack (cộng dồn) mọi kết quả có result_seq và thỉnh thoảng
+    cắt kết nối ngẫu nhiên — ngay sau khi nhận kết quả, trước khi kịp ack.
+    """
+
+    def __init__(self, drop_rate=0.1, seed=None, acks=True, *args, **kwargs):
+        import random
+        super().__init__(*args, **kwargs)
+        self.acks = acks            # False: relay cũ — không gửi frame protocol, không ack
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.received = []          # result_seq theo thứ tự nhận (có thể trùng khi replay)
+        self.drops = 0
+        self.results = []           # mọi kết quả command đã nhận (kể cả không có result_seq)
+        self._lock = threading.Lock()
+
+    def on_connect(self, conn):
+        import json
+        if self.acks:
+            conn.send(json.dumps({"type": "protocol", "codec": "json", "acks": True}))
+
+    def on_message(self, conn, opcode, data):
+        import json
+        if opcode != OP_TEXT:
+            return
+        message = json.loads(data)
+        if message.get("type") == "command_result":
+            with self._lock:
+                self.results.append(message)
+        seq = message.get("result_seq")
+        if seq is None or not self.acks:
+            return
+        with self._lock:
+            self.received.append(seq)
+            if self.random.random() < self.drop_rate:
+                self.drops += 1
+                conn.close()
+                return
+        conn.send(json.dumps({"type": "ack", "result_seq": seq}))
+
+    def delivered(self):
+        """Tập result_seq đã nhận ít nhất một lần."""
+        with self._lock:
+            return set(self.received)
+
+
+class ControllerRelay(WebSocketStubServer):
+    """
+    Relay + controller giả lập cho benchmark: báo connect_success khi agent
+    kết nối, gửi command và chờ kết quả cuối theo command_id, ack result_seq.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.agent = None
+        self.connected = threading.Event()
+        self._waiters = {}          # command_id -> [Event, payload]
+        self._lock = threading.Lock()
+
+    def on_connect(self, conn):
+        import json
+        self.agent = conn
+        conn.send(json.dumps({"type": "protocol", "codec": "json", "acks": True}))
+        conn.send(json.dumps({"type": "connect_success", "controller_id": "bench"}))
+        self.connected.set()
+
+    def on_disconnect(self, conn):
+        if conn is self.agent:
+            self.connected.clear()
+
+    def on_message(self, conn, opcode, data):
+        import json
+        from core.protocol import Codec
+        message = json.loads(data) if opcode == OP_TEXT else Codec("json").decode(data)
+        if message.get("result_seq"):
+            conn.send(json.dumps({"type": "ack", "result_seq": message["result_seq"]}))
+        if message.get("status") == "running":
+            return
+        with self._lock:
+            waiter = self._waiters.pop(message.get("command_id"), None)
+        if waiter:
+            waiter[1] = message
+            waiter[0].set()
+
+    def send(self, message):
+        import json
+        self.agent.send(json.dumps(message))
+
+    def request(self, data, timeout=30.0):
+        """Gửi một command, trả về kết quả cuối (hoặc None nếu timeout)."""
+        import uuid
+        command_id = uuid.uuid4().hex
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._waiters[command_id] = waiter
+        self.send({"type": "command", "from": "bench", "data": {**data, "command_id": command_id}})
+        if not waiter[0].wait(timeout):
+            with self._lock:
+                self._waiters.pop(command_id, None)
+            return None
+        return waiter[1]
+
+
+class HTTPStub:
+    """HTTP server stdlib chạy nền; lớp con định nghĩa handle(path, body) -> (status, content_type, bytes)."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True   # header và body ghi riêng -> tránh trễ 40ms do delayed ACK
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                status, content_type, data = stub.handle(self.path, self.headers, body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, path, headers, body):
+        return 404, "text/plain", b""
+
+
+class TelegramStub(HTTPStub):
+    """
+    Bot API giả: sendMessage / sendPhoto ok, trừ khi test xếp sẵn phản hồi
+    (status, body JSON) vào `responses` — trả lần lượt, vd. 429 kèm retry_after.
+    Ghi lại thời điểm nhận và nội dung từng request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages = []          # (perf_counter, method)
+        self.requests = []          # (perf_counter, method, content_type, body)
+        self.responses = []         # [(status, body dict)] trả trước phản hồi ok mặc định
+
+    def handle(self, path, headers, body):
+        import json
+        method = path.rsplit("/", 1)[-1]
+        now = time.perf_counter()
+        self.messages.append((now, method))
+        self.requests.append((now, method, headers.get("Content-Type", ""), body))
+        status, reply = self.responses.pop(0) if self.responses else (200, {"ok": True, "result": {}})
+        return status, "application/json", json.dumps(reply).encode()
+
+
+class TTSStub(HTTPStub):
+    """TTS giả: trả vài KB "mp3" cố định, ghi lại thời điểm nhận theo text."""
+
+    AUDIO = b"ID3" + bytes(4 * 1024)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = {}          # text -> perf_counter lúc nhận
+        self.counts = {}            # text -> số request upstream đã nhận
+        self.arrived = threading.Condition()
+
+    def handle(self, path, headers, body):
+        import json
+        text = json.loads(body or b"{}").get("input", "")
+        with self.arrived:
+            self.requests[text] = time.perf_counter()
+            self.counts[text] = self.counts.get(text, 0) + 1
+            self.arrived.notify_all()
+        return 200, "audio/mpeg", self.AUDIO
+
+    def wait_for(self, text, timeout=10.0):
+        with self.arrived:
+            self.arrived.wait_for(lambda: text in self.requests, timeout)
+            return self.requests.get(text)
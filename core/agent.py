@@ -0,0 +1,87 @@
+# core/agent.py
+"""
+Chạy agent không giao diện (server, kiosk):
+
+    python -m core.agent [--log-file agent.log] [--server-url ws://host/ws]
+    python app.py --headless [...]
+
+Chỉ gồm WebSocketClient + pipeline command. Không import tkinter, pystray,
+PIL hay playsound; chat được ghi ra console hoặc file thay vì đọc bằng TTS.
+
+Ngân sách bộ nhớ: RSS_BUDGET_MB là RSS tối đa của process sau khi đã kết nối
+và đang rảnh (chưa chạy lệnh nào). Các lệnh nặng (screenshot, process list)
+sẽ tự import thư viện của chúng khi chạy. bench/bench_memory.py kiểm tra
+ngân sách này và trả exit code khác 0 nếu vượt.
+"""
+import argparse
+import os
+import sys
+import threading
+from datetime import datetime
+
+RSS_BUDGET_MB = 64
+GUI_MODULES = ("tkinter", "pystray", "PIL", "playsound", "pyautogui")
+
+
+class ChatLog:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        stamped = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {line}"
+        with self._lock:
+            if not self.path:
+                print(stamped, flush=True)
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(stamped + "\n")
+
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB). Dùng psutil nếu có, không thì /proc."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        with open(f"/proc/{os.getpid()}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="core.agent", description="Headless remote agent")
+    parser.add_argument("--log-file", help="ghi chat vào file thay vì console")
+    parser.add_argument("--server-url", help="ghi đè địa chỉ relay websocket")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    import core.websocket_client as websocket_client
+    from core.config import Config
+    if args.server_url:
+        Config().server_url = args.server_url  # chỉ cho lần chạy này, không lưu
+
+    chat_log = ChatLog(args.log_file)
+    client = websocket_client.WebSocketClient(
+        on_chat_callback=chat_log.write,
+        on_status_callback=lambda connected: chat_log.write(
+            "🟢 Connected" if connected else "🔴 Disconnected"
+        ),
+    )
+    print(f"🖥️ Headless agent {client.cfg.device_id}")
+    client.connect()
+
+    stop = threading.Event()
+    try:
+        while not stop.wait(3600):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+# core/capture_archive.py
+"""
+Kho ảnh chụp màn hình có giới hạn dung lượng, thay cho việc ghi một file PNG
+mỗi lần chụp vào ~/.window_manager_agent/screenshots mà không bao giờ xoá.
+
+  - Ảnh lưu dạng WebP (JPEG nếu Pillow không có WebP) kèm thumbnail nhỏ.
+  - Bỏ qua frame trùng hệt (SHA-256 của pixel) với bất kỳ ảnh nào còn trong
+    kho — khi đó chỉ cập nhật last_seen/repeats của ảnh đã có. Nếu đặt
+    capture_dedupe_distance (số bit) trong Config thì frame gần giống ảnh mới
+    nhất (dHash lệch <= chừng đó bit) cũng bị bỏ; mặc định tắt vì thay đổi nhỏ
+    (một dòng chữ, con trỏ...) có thể chỉ lệch vài bit.
+  - Index sqlite (captures.db) để list_captures / get_capture theo khoảng thời gian.
+  - Mỗi lần thêm ảnh: xoá ảnh quá capture_max_age_days, rồi xoá ảnh cũ nhất
+    cho tới khi tổng dung lượng <= capture_budget_mb (đều trong Config).
+    Ảnh quá hạn cũng bị xoá khi mở kho (agent khởi động) và mỗi lần list / get,
+    để agent không chụp gì trong thời gian dài vẫn dọn kho.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from io import BytesIO
+from core.config import Config
+from core.metrics import metrics
+
+ARCHIVE_DIR = os.path.join(os.path.expanduser("~"), ".window_manager_agent", "captures")
+INDEX_NAME = "captures.db"
+FRAME_QUALITY = 80
+THUMB_WIDTH = 320
+THUMB_QUALITY = 60
+DHASH_SIZE = 16              # dHash 16x16 = 256 bit; 8x8 quá thô cho ảnh màn hình (cửa sổ dời chỗ vẫn trùng)
+LIST_LIMIT = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    repeats INTEGER NOT NULL DEFAULT 0,
+    width INTEGER, height INTEGER,
+    format TEXT,
+    sha256 TEXT,
+    dhash TEXT,
+    file TEXT, thumb TEXT,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captures_ts ON captures (ts);
+CREATE INDEX IF NOT EXISTS captures_sha256 ON captures (sha256);
+"""
+
+COLUMNS = ("id", "ts", "last_seen", "repeats", "width", "height", "format", "bytes")
+
+
+def dhash(image, size=DHASH_SIZE):
+    """Perceptual hash: so sánh độ sáng các pixel kề nhau trên ảnh xám thu nhỏ."""
+    from PIL import Image
+    small = image.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = small.tobytes()    # mode "L": mỗi pixel một byte, theo hàng
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{size * size // 4}x}"   # hex: quá lớn cho INTEGER của sqlite
+
+
+def _distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def _parse_time(value):
+    """epoch giây hoặc chuỗi ISO 8601 -> epoch giây."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    from datetime import datetime
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+class CaptureArchive:
+    def __init__(self, archive_dir=ARCHIVE_DIR, budget_bytes=None, max_age=None, dedupe_distance=None):
+        cfg = Config()
+        self.archive_dir = archive_dir
+        self.budget_bytes = budget_bytes or int(cfg.capture_budget_mb * 1024 * 1024)
+        self.max_age = max_age or cfg.capture_max_age_days * 86400
+        # None = chỉ bỏ frame trùng hệt; số bit dHash được lệch để coi là cùng màn hình
+        self.dedupe_distance = dedupe_distance if dedupe_distance is not None else cfg.capture_dedupe_distance
+        os.makedirs(archive_dir, exist_ok=True)
+        self._format = None         # xác định khi encode lần đầu (cần Pillow)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(archive_dir, INDEX_NAME), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self.stored = 0
+        self.duplicates = 0
+        with self._lock:
+            self._expire(time.time())
+
+    @property
+    def format(self):
+        if self._format is None:
+            from PIL import features
+            self._format = "WEBP" if features.check("webp") else "JPEG"
+        return self._format
+
+    @property
+    def ext(self):
+        return "webp" if self.format == "WEBP" else "jpg"
+
+    # --------------------------------------------------
+    # Ghi
+    # --------------------------------------------------
+
+    def add(self, image, timestamp=None):
+        """Lưu một frame (PIL Image). Trả (capture_id, duplicate)."""
+        ts = timestamp or time.time()
+        sha256 = hashlib.sha256(image.tobytes()).hexdigest()
+        phash = dhash(image)
+
+        # kiểm tra trước để khỏi encode frame trùng
+        recorded = self._record(ts, sha256, phash)
+        if recorded is not None:
+            return recorded
+
+        # encode ngoài lock — phần tốn CPU nhất
+        frame = self._encode(image, FRAME_QUALITY)
+        thumb_image = image
+        if image.width > THUMB_WIDTH:
+            from PIL import Image
+            thumb_image = image.resize((THUMB_WIDTH, max(1, image.height * THUMB_WIDTH // image.width)),
+                                       Image.BILINEAR)
+        thumb = self._encode(thumb_image, THUMB_QUALITY, fmt="JPEG")
+
+        stem = f"{time.strftime('%Y%m%d_%H%M%S', time.localtime(ts))}_{sha256[:12]}"
+        file_name, thumb_name = f"{stem}.{self.ext}", f"{stem}_thumb.jpg"
+        for name, data in ((file_name, frame), (thumb_name, thumb)):
+            with open(os.path.join(self.archive_dir, name), "wb") as f:
+                f.write(data)
+
+        row = (ts, ts, image.width, image.height, self.ext, sha256, phash, file_name, thumb_name,
+               len(frame) + len(thumb))
+        capture_id, duplicate = self._record(ts, sha256, phash, row)
+        if duplicate:
+            # frame trùng được lưu trong lúc encode: bỏ file vừa ghi (trừ khi trùng tên với file của ảnh đó)
+            with self._lock:
+                kept = self._db.execute("SELECT file, thumb FROM captures WHERE id = ?", (capture_id,)).fetchone()
+            for name in (file_name, thumb_name):
+                if not kept or name not in kept:
+                    try:
+                        os.remove(os.path.join(self.archive_dir, name))
+                    except OSError:
+                        pass
+        return capture_id, duplicate
+
+    def _record(self, ts, sha256, phash, row=None):
+        """
+        Kiểm tra trùng và ghi trong cùng một transaction: frame trùng thì cập nhật
+        last_seen/repeats và trả (id, True); không trùng thì insert `row` và trả
+        (id, False) — hoặc None nếu chưa có row (lần kiểm tra trước khi encode).
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                match = self._find_duplicate(sha256, phash)
+                inserted = None
+                if match is not None:
+                    self._db.execute("UPDATE captures SET last_seen = ?, repeats = repeats + 1 WHERE id = ?",
+                                     (ts, match))
+                elif row is not None:
+                    inserted = self._db.execute(
+                        "INSERT INTO captures (ts, last_seen, width, height, format, sha256, dhash, file, thumb,"
+                        " bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row).lastrowid
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise
+            if match is not None:
+                self.duplicates += 1
+                return match, True
+            if inserted is None:
+                return None
+            self.stored += 1
+            self._evict(ts)
+            return inserted, False
+
+    def _find_duplicate(self, sha256, phash):
+        match = self._db.execute("SELECT id FROM captures WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        if match is None and self.dedupe_distance is not None:
+            latest = self._db.execute("SELECT id, dhash FROM captures ORDER BY ts DESC LIMIT 1").fetchone()
+            if latest and latest[1] is not None and _distance(latest[1], phash) <= self.dedupe_distance:
+                match = latest
+        return match[0] if match else None
+
+    def _encode(self, image, quality, fmt=None):
+        buffered = BytesIO()
+        image.convert("RGB").save(buffered, format=fmt or self.format, quality=quality)
+        return buffered.getvalue()
+
+    def _evict(self, now):
+        """Gọi khi đang giữ lock. Xoá ảnh quá hạn, rồi ảnh cũ nhất tới khi vừa budget."""
+        self._expire(now)
+        rows = self._db.execute("SELECT id, file, thumb, bytes FROM captures ORDER BY ts").fetchall()
+        total = sum(row[3] for row in rows)
+        doomed = []
+        for row in rows[:-1]:   # luôn giữ frame mới nhất, kể cả khi một mình nó vượt budget
+            if total <= self.budget_bytes:
+                break
+            doomed.append(row)
+            total -= row[3]
+        self._delete(doomed)
+
+    def _expire(self, now):
+        """Gọi khi đang giữ lock. Xoá ảnh không còn thấy lại trong max_age giây."""
+        self._delete(self._db.execute("SELECT id, file, thumb FROM captures WHERE last_seen < ?",
+                                      (now - self.max_age,)).fetchall())
+
+    def _delete(self, doomed):
+        if not doomed:
+            return
+        self._db.executemany("DELETE FROM captures WHERE id = ?", [(row[0],) for row in doomed])
+        self._db.commit()
+        for row in doomed:
+            for name in row[1:3]:
+                try:
+                    os.remove(os.path.join(self.archive_dir, name))
+                except OSError:
+                    pass
+        print(f"🗑️ Capture archive evicted {len(doomed)} frame(s)")
+
+    # --------------------------------------------------
+    # Đọc
+    # --------------------------------------------------
+
+    def list(self, since=None, until=None, offset=0, limit=LIST_LIMIT, thumbnails=False):
+        since, until = _parse_time(since), _parse_time(until)
+        # một ảnh "phủ" khoảng [ts, last_seen] — frame trùng kéo dài last_seen
+        where, args = [], []
+        if since is not None:
+            where.append("last_seen >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts <= ?")
+            args.append(until)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        offset, limit = max(0, int(offset or 0)), max(1, min(int(limit or LIST_LIMIT), 1000))
+        with self._lock:
+            self._expire(time.time())
+            total = self._db.execute(f"SELECT COUNT(*) FROM captures{clause}", args).fetchone()[0]
+            rows = self._db.execute(
+                f"SELECT {', '.join(COLUMNS)}, thumb FROM captures{clause} ORDER BY ts LIMIT ? OFFSET ?",
+                (*args, limit, offset),
+            ).fetchall()
+        entries = []
+        for row in rows:
+            entry = dict(zip(COLUMNS, row))
+            if thumbnails:
+                entry["thumbnail"] = self._read(row[-1])
+            entries.append(entry)
+        next_offset = offset + limit if offset + limit < total else None
+        return {"total": total, "offset": offset, "next_offset": next_offset, "entries": entries}
+
+    def get(self, capture_id, thumbnail=False):
+        """Trả (metadata, bytes) hoặc None nếu không còn trong kho."""
+        with self._lock:
+            self._expire(time.time())
+            row = self._db.execute(f"SELECT {', '.join(COLUMNS)}, file, thumb FROM captures WHERE id = ?",
+                                   (int(capture_id),)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        data = self._read(row[-1] if thumbnail else row[-2])
+        if data is None:
+            return None
+        if thumbnail:
+            entry["format"] = "jpeg"
+        return entry, data
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.archive_dir, name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def usage(self):
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM captures").fetchone()
+        return {"frames": count, "bytes": total, "budget_bytes": self.budget_bytes}
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> CaptureArchive:
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = CaptureArchive()
+            metrics.gauge("agent_capture_archive_bytes", lambda: _archive.usage()["bytes"])
+            metrics.gauge("agent_capture_archive_duplicates", lambda: _archive.duplicates)
+        return _archive
+
+
+def expire_on_startup():
+    """Agent khởi động: mở kho (nếu đã có) để xoá ảnh quá hạn — không cần Pillow."""
+    if os.path.exists(os.path.join(ARCHIVE_DIR, INDEX_NAME)):
+        get_archive()
@@ -1,20 +1,57 @@
+import asyncio
 import base64
 from io import BytesIO
 import os
-import psutil
-import pyautogui
 from datetime import datetime
 import subprocess
+import sys
+import codecs
+import queue
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
 from typing import Dict, Optional
 from core.telegram_service import TelegramService
+from core.protocol import BINARY_FIELD
+
+# psutil / pyautogui / PIL và các module dùng chúng được import trong từng lệnh:
+# agent khởi động và kết nối nhanh hơn, chỉ lệnh nào cần mới trả giá import.
 
 class ICommand(ABC):
+    command_id = None   # correlation id, được CommandHandler gán trước khi chạy
+    emit = None         # callable(dict) -> bool: gửi kết quả trung gian (stream) về controller, False nếu gửi hỏng
+    dispatch = None     # callable(cmd dict, reply): chạy lệnh con qua scheduler của CommandHandler (batch)
+
     @abstractmethod
     def execute(self) -> dict:
         """Thực thi lệnh và trả kết quả (nếu có)"""
         pass
 
+    def cancel(self) -> bool:
+        """Huỷ lệnh đang chạy. Trả False nếu lệnh không hỗ trợ huỷ."""
+        return False
+
+
+def kill_process_tree(pid: int, include_parent: bool = True):
+    """Kill toàn bộ cây process (con trước, cha sau). Trả về list PID đã kill."""
+    import psutil
+    killed = []
+    try:
+        parent = psutil.Process(pid)
+    except psutil.NoSuchProcess:
+        return killed
+    procs = parent.children(recursive=True)
+    if include_parent:
+        procs.append(parent)
+    for proc in procs:
+        try:
+            proc.kill()
+            killed.append(proc.pid)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return killed
+
 
 # ===== Concrete Commands =====
 class ShutdownCommand(ICommand):
@@ -34,45 +71,121 @@ class LockCommand(ICommand):
         os.system("rundll32.exe user32.dll,LockWorkStation")
         return {"status": "success", "message": "Locked workstation"}
 
-class KillProcessCommand:
-    def __init__(self, target):
+KILL_MATCH_MODES = ("exact", "substring", "regex")
+
+
+class KillProcessCommand(ICommand):
+    def __init__(self, targets, match="substring", tree=False, dry_run=False):
         """
-        target: Can be either a process name (str) or a process ID (int)
+        targets: một hoặc list các tên process (str) / PID (int).
+        match: cách so tên — "exact", "substring" (mặc định, như trước) hoặc "regex".
+        tree: kill cả cây process con (con trước, cha sau).
+        dry_run: chỉ trả về danh sách sẽ bị kill.
         """
-        self.target = target
+        if targets is None or targets == "":
+            targets = []
+        elif not isinstance(targets, list):
+            targets = [targets]
+        self.targets = targets
+        self.match = match if match in KILL_MATCH_MODES else "substring"
+        self.tree = tree
+        self.dry_run = dry_run
+
+    def _matcher(self, target):
+        if isinstance(target, int) or str(target).isdigit():
+            pid = int(target)
+            return lambda proc, name: proc.pid == pid
+        needle = str(target).lower()
+        if self.match == "exact":
+            return lambda proc, name: name == needle or name == needle + ".exe"
+        if self.match == "regex":
+            pattern = re.compile(str(target), re.IGNORECASE)
+            return lambda proc, name: bool(pattern.search(name))
+        return lambda proc, name: needle in name
 
     def execute(self):
-        if self.target is None or self.target == "":
+        if not self.targets:
             return {"status": "error", "message": "Missing target (process name or PID)"}
-
-        # Case 1: If target is an integer (PID)
-        if isinstance(self.target, int) or str(self.target).isdigit():
-            pid = int(self.target)
-            try:
-                proc = psutil.Process(pid)
-                proc.kill()
-                msg = f"Killed process with PID {pid} ({proc.name()})"
-                print(f"💀 {msg}")
-                return {"status": "success", "message": msg}
-            except psutil.NoSuchProcess:
-                return {"status": "error", "message": f"No process found with PID {pid}"}
-            except psutil.AccessDenied:
-                return {"status": "error", "message": f"Access denied for PID {pid}"}
-
-        # Case 2: If target is a process name
-        count = 0
-        for proc in psutil.process_iter(['name']):
+        # target không phải tên / PID (dict, list, bool...) -> lỗi riêng cho target đó, không làm hỏng cả lệnh
+        matchers = []
+        for target in self.targets:
+            if isinstance(target, bool) or not isinstance(target, (int, str)):
+                matchers.append((target, None))
+                continue
             try:
-                if proc.info['name'] and self.target.lower() in proc.info['name'].lower():
-                    proc.kill()
-                    count += 1
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                matchers.append((target, self._matcher(target)))
+            except re.error as e:
+                return {"status": "error", "message": f"Invalid regex: {e}"}
+
+        import psutil
+        # Một lần quét duy nhất: vừa match mọi target vừa dựng cây cha-con
+        own_pid = os.getpid()
+        procs, children, matched = {}, {}, [[] for _ in matchers]   # matched theo vị trí target
+        for proc in psutil.process_iter(["name", "ppid"]):
+            if proc.pid == own_pid:
                 continue
+            procs[proc.pid] = proc
+            children.setdefault(proc.info["ppid"], []).append(proc.pid)
+            name = (proc.info["name"] or "").lower()
+            for index, (_, match) in enumerate(matchers):
+                if match and match(proc, name):
+                    matched[index].append(proc.pid)
 
-        msg = f"Killed {count} process(es) matching name '{self.target}'"
-        print(f"💀 {msg}")
-        return {"status": "success", "message": msg}
+        def with_descendants(pid, out, visited):
+            # post-order: con cháu đứng trước cha (visited chặn vòng kiểu PID 0 trên Windows)
+            visited.add(pid)
+            for child in children.get(pid, []):
+                if child not in visited:
+                    with_descendants(child, out, visited)
+            out.append(pid)
 
+        handled = {}    # pid -> (list kết quả, info): process khớp nhiều target chỉ kill một lần
+        results = []
+        for index, (target, match) in enumerate(matchers):
+            entry = {"target": target, "processes": [], "errors": []}
+            if match is None:
+                entry["errors"].append({"error": f"Invalid target {target!r}: expected a process name or PID"})
+                results.append(entry)
+                continue
+            victims = []
+            for pid in matched[index]:
+                if self.tree:
+                    with_descendants(pid, victims, set())
+                else:
+                    victims.append(pid)
+
+            for pid in dict.fromkeys(victims):
+                if pid in handled:
+                    # target trước đã xử lý process này: vẫn ghi lại kết quả cho target này
+                    kind, info = handled[pid]
+                    entry[kind].append(info)
+                    continue
+                proc = procs[pid]
+                info = {"pid": pid, "name": proc.info["name"]}
+                kind = "processes"
+                if not self.dry_run:
+                    try:
+                        proc.kill()
+                    except psutil.NoSuchProcess:
+                        kind, info = "errors", {**info, "error": "No such process"}
+                    except psutil.AccessDenied:
+                        kind, info = "errors", {**info, "error": "Access denied"}
+                handled[pid] = (kind, info)
+                entry[kind].append(info)
+            if not matched[index]:
+                entry["errors"].append({"error": f"No process matching '{target}'"})
+            results.append(entry)
+
+        count = sum(kind == "processes" for kind, _ in handled.values())
+        verb = "Would kill" if self.dry_run else "Killed"
+        msg = f"{verb} {count} process(es) for {len(self.targets)} target(s)"
+        print(f"💀 {msg}")
+        return {
+            "status": "success" if count or self.dry_run else "error",
+            "message": msg,
+            "dry_run": self.dry_run,
+            "results": results,
+        }
 
 
 class WifiCommand(ICommand):
@@ -117,29 +230,238 @@ class MessageCommand(ICommand):
         return {"status": "success", "message": f"Message shown: {self.text}"}
 
 
+SCREENSHOT_FORMATS = {"png": "PNG", "jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+
+
 class ScreenCaptureCommand(ICommand):
-    def __init__(self):
+    """
+    Chụp màn hình và encode đúng một lần. Các tuỳ chọn:
+      format/quality/max_width — định dạng, chất lượng (jpeg/webp), chiều rộng tối đa
+      binary — trả bytes để WebSocketClient gửi binary frame thay vì base64
+      save/telegram — lưu file / gửi Telegram ở thread nền, không chặn phản hồi
+    """
+    def __init__(self, fmt="png", quality=None, max_width=None, binary=False, save=True, telegram=True):
+        self.format = SCREENSHOT_FORMATS.get(str(fmt or "png").lower(), "PNG")
+        self.quality = int(quality) if quality else 80
+        self.max_width = int(max_width) if max_width else None
+        self.binary = binary
+        self.save = save
+        self.telegram_enabled = telegram
         self.telegram = TelegramService()
-    def execute(self):
-        image = pyautogui.screenshot()
-        filename = f"screenshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        save_path = os.path.join(os.path.expanduser("~"), ".window_manager_agent", "screenshots")
-        os.makedirs(save_path, exist_ok=True)
-        full_path = os.path.join(save_path, filename)
-        image.save(full_path)
-        self.telegram.send_telegram_photo(full_path)
-
-        
-        # Convert to Base64
+
+    def _encode(self, image):
+        from PIL import Image
+        if self.max_width and image.width > self.max_width:
+            height = int(image.height * self.max_width / image.width)
+            image = image.resize((self.max_width, height), Image.BILINEAR)
         buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        return {"type": "show_screenshot","status": "success", "file": img_base64}
+        if self.format == "PNG":
+            image.save(buffered, format="PNG")
+        else:
+            image.convert("RGB").save(buffered, format=self.format, quality=self.quality)
+        return image, buffered.getvalue()
+
+    def _persist(self, screen, data: bytes, timestamp: datetime):
+        try:
+            if self.save:
+                # kho có giới hạn dung lượng + bỏ frame trùng (core.capture_archive)
+                from core.capture_archive import get_archive
+                capture_id, duplicate = get_archive().add(screen, timestamp.timestamp())
+                print(f"🗄️ Capture {'already archived as' if duplicate else 'archived as'} #{capture_id}")
+            if self.telegram_enabled:
+                self.telegram.send_telegram_photo(data)
+        except Exception as e:
+            print(f"⚠️ Screenshot persist failed: {e}")
+
+    def execute(self):
+        import pyautogui
+        timestamp = datetime.now()
+        screen = pyautogui.screenshot()
+        image, data = self._encode(screen)
+
+        if self.save or self.telegram_enabled:
+            threading.Thread(target=self._persist, args=(screen, data, timestamp), daemon=True).start()
+
+        return {
+            "type": "show_screenshot",
+            "status": "success",
+            "format": self.format.lower(),
+            "width": image.width,
+            "height": image.height,
+            "file": data if self.binary else base64.b64encode(data).decode("utf-8"),
+        }
+
+
+class SubscribeMetricsCommand(ICommand):
+    """Đăng ký stream cpu/memory/disk/net (xem core.telemetry)."""
+    def __init__(self, groups=None, interval=None, thresholds=None, subscription_id=None, lease=None):
+        self.groups = [groups] if isinstance(groups, str) else groups
+        self.interval = interval
+        self.thresholds = thresholds
+        self.subscription_id = subscription_id
+        self.lease = lease
+
+    def execute(self):
+        if not self.emit:
+            return {"type": "metrics_subscribed", "status": "error", "message": "Telemetry needs a live connection"}
+        from core.telemetry import get_sampler
+        try:
+            sub = get_sampler().subscribe(self.emit, self.groups, self.interval, self.thresholds,
+                                          self.subscription_id, self.lease)
+        except (TypeError, ValueError) as e:
+            return {"type": "metrics_subscribed", "status": "error", "message": str(e)}
+        print(f"📈 Telemetry subscription {sub.id}: {', '.join(sub.groups)} every {sub.interval}s")
+        return {
+            "type": "metrics_subscribed",
+            "status": "success",
+            "subscription_id": sub.id,
+            "metrics": list(sub.groups),
+            "interval": sub.interval,
+            "lease": round(sub.expires - time.monotonic()),
+        }
+
+
+class UnsubscribeMetricsCommand(ICommand):
+    def __init__(self, subscription_id):
+        self.subscription_id = subscription_id
+
+    def execute(self):
+        from core.telemetry import get_sampler
+        if not get_sampler().unsubscribe(self.subscription_id):
+            return {"type": "metrics_unsubscribed", "status": "error",
+                    "message": f"No telemetry subscription {self.subscription_id}"}
+        print(f"📉 Telemetry subscription {self.subscription_id} stopped")
+        return {"type": "metrics_unsubscribed", "status": "success", "subscription_id": self.subscription_id}
+
+
+class ListCapturesCommand(ICommand):
+    """Liệt kê ảnh trong kho theo khoảng thời gian (epoch giây hoặc ISO 8601)."""
+    def __init__(self, since=None, until=None, offset=0, limit=None, thumbnails=True):
+        self.since = since
+        self.until = until
+        self.offset = offset
+        self.limit = limit
+        self.thumbnails = thumbnails
+
+    def execute(self):
+        from core.capture_archive import get_archive, LIST_LIMIT
+        try:
+            archive = get_archive()
+            listing = archive.list(self.since, self.until, self.offset, self.limit or LIST_LIMIT, self.thumbnails)
+        except ValueError as e:
+            return {"type": "capture_list", "status": "error", "message": f"Invalid time range: {e}"}
+        for entry in listing["entries"]:
+            if entry.get("thumbnail") is not None:
+                entry["thumbnail"] = base64.b64encode(entry["thumbnail"]).decode("utf-8")
+        return {"type": "capture_list", "status": "success", "usage": archive.usage(), **listing}
+
+
+class GetCaptureCommand(ICommand):
+    def __init__(self, capture_id, thumbnail=False, binary=False):
+        self.capture_id = capture_id
+        self.thumbnail = thumbnail
+        self.binary = binary
+
+    def execute(self):
+        from core.capture_archive import get_archive
+        found = get_archive().get(self.capture_id, self.thumbnail) if self.capture_id is not None else None
+        if found is None:
+            return {"type": "show_screenshot", "status": "error", "message": f"Capture {self.capture_id} not found"}
+        entry, data = found
+        # cùng type với screenshot để controller hiển thị như ảnh vừa chụp
+        return {
+            "type": "show_screenshot",
+            "status": "success",
+            "capture_id": entry["id"],
+            "captured_at": entry["ts"],
+            "last_seen": entry["last_seen"],
+            "format": entry["format"],
+            "width": entry["width"],
+            "height": entry["height"],
+            "file": data if self.binary else base64.b64encode(data).decode("utf-8"),
+        }
+
+
+class StartScreenStreamCommand(ICommand):
+    def __init__(self, fps=None, quality=None, tile_size=None, fmt=None, max_width=None, binary=True):
+        # __init__ chạy trên dispatch loop: không import screen_stream (pyautogui/PIL) ở đây;
+        # option bỏ trống lấy mặc định DEFAULT_* của core.screen_stream
+        options = {"fps": fps, "quality": quality, "tile_size": tile_size, "fmt": fmt, "max_width": max_width}
+        self.options = {k: v for k, v in options.items() if v}
+        self.options["binary"] = binary
+
+    def execute(self):
+        if not self.emit:
+            return {"status": "error", "message": "Screen stream needs a live connection"}
+        from core import screen_stream  # chạy trên worker
+        streamer = screen_stream.start_stream(self.emit, **self.options)
+        print(f"🎥 Screen stream started ({streamer.target_fps} fps, {streamer.format})")
+        return {
+            "type": "screen_stream_started",
+            "status": "success",
+            "fps": streamer.target_fps,
+            "format": streamer.format.lower(),
+            "tile_size": streamer.tile_size,
+            "binary": streamer.binary,
+        }
+
+
+class StopScreenStreamCommand(ICommand):
+    def execute(self):
+        from core import screen_stream
+        stats = screen_stream.stop_stream()
+        if stats is None:
+            return {"type": "screen_stream_stopped", "status": "error", "message": "No active screen stream"}
+        print(f"🎥 Screen stream stopped: {stats}")
+        return {"type": "screen_stream_stopped", "status": "success", "stats": stats}
+
+
+STREAM_READ_SIZE = 4096          # byte mỗi lần đọc pipe
+STREAM_CHUNK_SIZE = 16 * 1024    # gộp tối đa bấy nhiêu ký tự vào một chunk gửi đi
+STREAM_BUFFER_CHUNKS = 64        # buffer giữa pipe và socket; đầy thì reader chờ
+TELEGRAM_OUTPUT_LIMIT = 3000
+
 
 class ShellCommand(ICommand):
-    def __init__(self, command: str):
+    def __init__(self, command: str, stream: bool = False, timeout: Optional[float] = None):
         self.command = command
+        self.stream = stream
+        self.timeout = timeout
         self.telegram = TelegramService()
+        self._proc = None
+        self._cancelled = False
+
+    def _popen(self, bufsize=-1, **kwargs):
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        return subprocess.Popen(
+            self.command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=bufsize,
+            **kwargs
+        )
+
+    def cancel(self):
+        self._cancelled = True
+        if self._proc and self._proc.poll() is None:
+            kill_process_tree(self._proc.pid)
+        return True
+
+    def _notify_telegram(self, output, error):
+        self.telegram.send_message(
+            f"💻 Command: `{self.command}`\n✅ Output:\n{output[:TELEGRAM_OUTPUT_LIMIT]}\n⚠️ Error:\n{error[:TELEGRAM_OUTPUT_LIMIT]}"
+        )
+
+    def _final_status(self, returncode, timed_out):
+        if self._cancelled:
+            return "cancelled"
+        if timed_out:
+            return "timeout"
+        return "success" if returncode == 0 else "error"
 
     def execute(self):
         if not self.command:
@@ -147,117 +469,653 @@ class ShellCommand(ICommand):
 
         print(f"💻 Running shell command: {self.command}")
         try:
-            result = subprocess.run(
-                self.command,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding="utf-8"
-            )
+            if self.stream and self.emit:
+                return self._execute_streaming()
+            return self._execute_buffered()
+        except Exception as e:
+            return {"type": "command_result","status": "error", "message": str(e)}
 
-            output = result.stdout.strip()
-            error = result.stderr.strip()
+    def _execute_buffered(self):
+        self._proc = self._popen(text=True, encoding="utf-8", errors="replace")
+        timed_out = False
+        try:
+            stdout, stderr = self._proc.communicate(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            kill_process_tree(self._proc.pid)
+            stdout, stderr = self._proc.communicate()
 
-            self.telegram.send_message(
-                f"💻 Command: `{self.command}`\n✅ Output:\n{output[:3000]}\n⚠️ Error:\n{error[:3000]}"
-            )
+        output = (stdout or "").strip()
+        error = (stderr or "").strip()
+        self._notify_telegram(output, error)
 
-            return {
+        return {
+            "type": "command_result",
+            "status": self._final_status(self._proc.returncode, timed_out),
+            "returncode": self._proc.returncode,
+            "output": output,
+            "error": error
+        }
+
+    def _execute_streaming(self):
+        """
+        Gửi output theo từng chunk (type=command_result, status=running, seq tăng dần).
+        Buffer giữa pipe và socket có giới hạn: khi socket chậm, reader thread
+        bị chặn ở put() -> pipe đầy -> process con tự chậm lại.
+        """
+        self._proc = self._popen(bufsize=0)
+        buffer = queue.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+        def reader(pipe, name):
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            try:
+                while True:
+                    data = pipe.read(STREAM_READ_SIZE)
+                    if not data:
+                        break
+                    text = decoder.decode(data)
+                    if text:
+                        buffer.put((name, text))
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    buffer.put((name, tail))
+            finally:
+                pipe.close()
+                buffer.put((name, None))
+
+        for pipe, name in ((self._proc.stdout, "stdout"), (self._proc.stderr, "stderr")):
+            threading.Thread(target=reader, args=(pipe, name), daemon=True).start()
+
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        tails = {"stdout": "", "stderr": ""}
+        open_streams = 2
+        seq = 0
+        timed_out = False
+
+        while open_streams:
+            if deadline and not timed_out and time.monotonic() > deadline:
+                timed_out = True
+                kill_process_tree(self._proc.pid)
+            try:
+                name, text = buffer.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if text is None:
+                open_streams -= 1
+                continue
+
+            # gộp các đoạn liền kề cùng stream để giảm số frame
+            parts = [text]
+            size = len(text)
+            while size < STREAM_CHUNK_SIZE:
+                try:
+                    next_name, next_text = buffer.queue[0]
+                except IndexError:
+                    break
+                if next_name != name or next_text is None:
+                    break
+                buffer.get_nowait()
+                parts.append(next_text)
+                size += len(next_text)
+            chunk = "".join(parts)
+
+            tails[name] = (tails[name] + chunk)[-TELEGRAM_OUTPUT_LIMIT:]
+            self.emit({
                 "type": "command_result",
-                "status": "success" if result.returncode == 0 else "error",
-                "output": output,
-                "error": error
-            }
+                "status": "running",
+                "seq": seq,
+                "stream": name,
+                "chunk": chunk,
+            })
+            seq += 1
+
+        returncode = self._proc.wait()
+        self._notify_telegram(tails["stdout"].strip(), tails["stderr"].strip())
+        return {
+            "type": "command_result",
+            "status": self._final_status(returncode, timed_out),
+            "returncode": returncode,
+            "seq": seq,
+            "done": True,
+        }
+
+PROCESS_PAGE_SIZE = 200
 
-        except Exception as e:
-            return {"type": "command_result","status": "error", "message": str(e)}
 
 class GetListProcessCommand(ICommand):
-    """Lấy danh sách process đang chạy"""
+    """Lấy danh sách process đang chạy (từ bảng của ProcessSampler)"""
+    def __init__(self, top=30, sort="cpu", name=None, user=None, offset=0, limit=PROCESS_PAGE_SIZE):
+        self.top = int(top)
+        self.sort = sort
+        self.name = name
+        self.user = user
+        self.offset = int(offset)
+        self.limit = int(limit) if limit is not None else None
+
     def execute(self):
+        from core.process_sampler import get_sampler
         try:
-            processes = []
-            for proc in psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_percent']):
-                try:
-                    info = proc.info
-                    processes.append({
-                        "pid": info.get("pid"),
-                        "name": info.get("name"),
-                        "user": info.get("username"),
-                        "cpu": round(info.get("cpu_percent", 0.0), 2),
-                        "memory": round(info.get("memory_percent", 0.0), 2)
-                    })
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-
-            processes.sort(key=lambda x: x['cpu'], reverse=True)
-            top_30 = processes[:30]
-
-            print(f"📋 Found {len(processes)} running processes.")
+            sampler = get_sampler()
+            total, top_processes, page = sampler.query(
+                top=self.top, sort=self.sort, name=self.name, user=self.user,
+                offset=self.offset, limit=self.limit,
+            )
+            print(f"📋 Found {total} running processes.")
             return {
                 "type": "forward_list_running_process",
                 "status": "success",
                 "data": {
-                    "total": len(processes),
-                    "top_processes": top_30,
-                    "data": processes
+                    "total": total,
+                    "offset": self.offset,
+                    "limit": self.limit,
+                    "sampled_at": sampler.updated_at,
+                    "top_processes": top_processes,
+                    "data": page
                 },
             }
 
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
+
+class SubscribeProcessesCommand(ICommand):
+    """
+    Gửi snapshot đầy đủ một lần, sau đó chỉ đẩy process added/removed/changed.
+    Subscription hết hạn sau `lease` giây; gửi lại subscribe_processes cùng
+    subscription_id để gia hạn (kèm snapshot mới).
+    """
+    def __init__(self, subscription_id=None, lease=None):
+        self.subscription_id = subscription_id
+        self.lease = lease
+
+    def execute(self):
+        if not self.emit:
+            return {"status": "error", "message": "Process subscription needs a live connection"}
+        from core.process_sampler import get_sampler
+        sampler = get_sampler()
+        emit = self.emit
+
+        def push(diff):
+            return emit({"type": "process_diff", "status": "running", "sampled_at": sampler.updated_at, **diff})
+
+        total, _, snapshot = sampler.query(top=0, limit=None)
+        try:
+            sub = sampler.subscribe(self.subscription_id or self.command_id, push, self.lease, baseline=snapshot)
+        except (TypeError, ValueError) as e:
+            return {"type": "process_subscription", "status": "error", "message": str(e)}
+        return {
+            "type": "process_subscription",
+            "status": "success",
+            "subscription_id": sub.id,
+            "interval": sampler.interval,
+            "lease": round(sub.expires - time.monotonic()),
+            "data": {"total": total, "data": snapshot},
+        }
+
+
+class UnsubscribeProcessesCommand(ICommand):
+    def __init__(self, subscription_id):
+        self.subscription_id = subscription_id
+
+    def execute(self):
+        from core.process_sampler import get_sampler
+        if get_sampler().unsubscribe(self.subscription_id):
+            return {"type": "process_subscription", "status": "success", "message": "Unsubscribed"}
+        return {"type": "process_subscription", "status": "error", "message": "Unknown subscription"}
+
+
+class AgentStatsCommand(ICommand):
+    def execute(self):
+        from core.metrics import metrics
+        return {"type": "agent_stats", "status": "success", "metrics": metrics.snapshot()}
+
+
+class FileDownloadCommand(ICommand):
+    """Gửi file theo chunk nhị phân có cửa sổ ack (xem core.file_transfer)."""
+    def __init__(self, path, offset=0, chunk_size=None, window=None, transfer_id=None):
+        from core.file_transfer import Download
+        self.download = Download(path, offset, chunk_size, window, transfer_id)
+
+    def cancel(self):
+        self.download.cancel()
+        return True
+
+    def execute(self):
+        from core import file_transfer
+        if not self.emit:
+            return {"type": "file_download_result", "status": "error", "message": "Download needs a live connection"}
+        download = self.download
+        print(f"📤 Download {download.path} from offset {download.offset}")
+        file_transfer.start_download(download)
+        try:
+            result = download.run(self.emit)
+        except OSError as e:
+            result = {"status": "error", "message": str(e)}
+        finally:
+            file_transfer.finish_download(download)
+        return {"type": "file_download_result", "transfer_id": download.transfer_id, "path": download.path, **result}
+
+
+class FileUploadCommand(ICommand):
+    def __init__(self, path, size, sha256=None, transfer_id=None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.transfer_id = transfer_id
+
+    def execute(self):
+        from core import file_transfer
+        if not self.path or self.size is None:
+            return {"type": "file_upload_ready", "status": "error", "message": "path and size are required"}
+        try:
+            session = file_transfer.open_upload(self.path, self.size, self.sha256, self.transfer_id)
+        except OSError as e:
+            return {"type": "file_upload_ready", "status": "error", "message": str(e)}
+        print(f"📥 Upload {session.path}: {session.received}/{session.size} bytes already present")
+        if session.received == session.size:
+            # file .part đã đủ (ví dụ mất kết nối ngay trước chunk cuối được ack)
+            result = file_transfer.finish_upload(session.transfer_id)
+            return {"type": "file_ack", "transfer_id": session.transfer_id, **result}
+        return {"type": "file_upload_ready", "status": "success", "transfer_id": session.transfer_id,
+                "offset": session.received, "chunk_size": file_transfer.CHUNK_SIZE,
+                "window": file_transfer.WINDOW_CHUNKS}
+
+
+class FileChunkCommand(ICommand):
+    def __init__(self, transfer_id, offset, data):
+        self.transfer_id = transfer_id
+        self.offset = offset
+        # chunk đi bằng binary frame (data["binary"]) hoặc msgpack là bytes; qua JSON text thì là base64
+        self.data = base64.b64decode(data) if isinstance(data, str) else data
+
+    def execute(self):
+        from core.file_transfer import write_chunk
+        try:
+            result = write_chunk(self.transfer_id, int(self.offset or 0), self.data)
+        except OSError as e:
+            result = {"status": "error", "message": str(e)}
+        if result["status"] == "success":
+            print(f"📥 Upload complete: {result['path']}")
+        return {"type": "file_ack", "transfer_id": self.transfer_id, **result}
+
+
+class ListDirCommand(ICommand):
+    def __init__(self, path, offset=0, limit=None, pattern=None):
+        self.path = path
+        self.offset = offset
+        self.limit = limit
+        self.pattern = pattern
+
+    def execute(self):
+        from core.file_transfer import list_dir, LIST_PAGE_SIZE
+        try:
+            listing = list_dir(self.path, self.offset, self.limit or LIST_PAGE_SIZE, self.pattern)
+        except OSError as e:
+            return {"type": "dir_listing", "status": "error", "message": str(e)}
+        return {"type": "dir_listing", "status": "success", **listing}
+
+
+BATCH_MAX_COMMANDS = 50
+BATCH_PARALLELISM = 4
+
+
+class BatchCommand(ICommand):
+    """
+    Chạy nhiều lệnh trong một frame, trả một kết quả gộp. Mỗi phần tử của
+    "commands" là một command dict bình thường, thêm tuỳ chọn:
+      id          — tên để tham chiếu (mặc định là vị trí trong list)
+      depends_on  — list id phải chạy xong và thành công trước
+    Lệnh không phụ thuộc nhau chạy song song (tối đa `parallel`);
+    sequential=True thì mỗi lệnh phụ thuộc lệnh đứng trước.
+    stop_on_error=True: có lệnh lỗi thì các lệnh chưa bắt đầu bị bỏ qua.
+
+    Lệnh con được đưa qua dispatch của CommandHandler như lệnh thường nên
+    chịu cùng priority, concurrency, timeout, cache/coalescing theo loại lệnh
+    và dùng chung worker pool; batch chỉ giữ một slot để điều phối.
+    """
+    def __init__(self, commands, stop_on_error=False, sequential=False, parallel=BATCH_PARALLELISM):
+        self.commands = list(commands or [])
+        self.stop_on_error = stop_on_error
+        self.sequential = sequential
+        self.parallel = max(1, min(int(parallel or 1), BATCH_PARALLELISM * 2))
+        self._running = {}          # sub id -> (sub, command_id, thời điểm gửi)
+        self._done = queue.Queue()  # (sub, kết quả cuối, thời điểm nhận); None = đánh thức khi huỷ
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+        for _, command_id, _ in list(self._running.values()):
+            self.dispatch({"type": "cancel_command", "target_id": command_id}, lambda payload: None)
+        self._done.put(None)
+        return True
+
+    def _plan(self):
+        """Chuẩn hoá id / depends_on và kiểm tra: id trùng, phụ thuộc không tồn tại, vòng lặp."""
+        subs, ids = [], set()
+        for index, sub in enumerate(self.commands):
+            sub = dict(sub)
+            sub_id = str(sub.pop("id", index))
+            if sub_id in ids:
+                raise ValueError(f"Duplicate sub-command id '{sub_id}'")
+            if sub.get("type") in ("batch", "cancel_command"):
+                raise ValueError(f"'{sub.get('type')}' is not allowed inside a batch")
+            depends_on = [str(d) for d in sub.pop("depends_on", [])]
+            if self.sequential and subs:
+                depends_on.append(subs[-1]["id"])
+            ids.add(sub_id)
+            subs.append({"id": sub_id, "depends_on": depends_on, "data": sub})
+        for sub in subs:
+            unknown = [d for d in sub["depends_on"] if d not in ids]
+            if unknown:
+                raise ValueError(f"Sub-command '{sub['id']}' depends on unknown id(s): {unknown}")
+        # Kahn: còn nút không giảm được bậc vào -> có vòng
+        indegree = {sub["id"]: len(set(sub["depends_on"])) for sub in subs}
+        ready = [i for i, n in indegree.items() if n == 0]
+        seen = 0
+        while ready:
+            current = ready.pop()
+            seen += 1
+            for sub in subs:
+                if current in sub["depends_on"]:
+                    indegree[sub["id"]] -= 1
+                    if indegree[sub["id"]] == 0:
+                        ready.append(sub["id"])
+        if seen != len(subs):
+            raise ValueError("Batch dependencies contain a cycle")
+        return subs
+
+    def _submit(self, sub):
+        command_id = f"{self.command_id}:{sub['id']}"
+
+        def reply(payload):
+            # chỉ kết quả cuối; chunk stream ("running") của lệnh con không lồng vào batch
+            if payload.get("status") != "running":
+                self._done.put((sub, payload, time.perf_counter()))
+
+        self._running[sub["id"]] = (sub, command_id, time.perf_counter())
+        self.dispatch({**sub["data"], "command_id": command_id}, reply)
+
+    def execute(self):
+        if self.dispatch is None:
+            return {"type": "batch_result", "status": "error", "message": "Batch needs the command handler"}
+        if not self.commands:
+            return {"type": "batch_result", "status": "error", "message": "Empty batch"}
+        if len(self.commands) > BATCH_MAX_COMMANDS:
+            return {"type": "batch_result", "status": "error",
+                    "message": f"Batch exceeds {BATCH_MAX_COMMANDS} commands"}
+        try:
+            subs = self._plan()
+        except ValueError as e:
+            return {"type": "batch_result", "status": "error", "message": str(e)}
+
+        started = time.perf_counter()
+        results = {}                # id -> kết quả từng lệnh
+        pending = list(subs)
+        failed = False
+
+        def finish(sub, status, elapsed=0.0, result=None, message=None):
+            entry = {"id": sub["id"], "type": sub["data"].get("type"), "status": status,
+                     "elapsed_ms": round(elapsed * 1000, 2)}
+            if message:
+                entry["message"] = message
+            if result is not None:
+                entry["result"] = _jsonable(result)
+            results[sub["id"]] = entry
+
+        while pending or self._running:
+            for sub in list(pending):
+                if self._cancelled or (failed and self.stop_on_error):
+                    finish(sub, "skipped", message="Cancelled" if self._cancelled else "Skipped after error")
+                    pending.remove(sub)
+                    continue
+                deps = [results.get(d) for d in sub["depends_on"]]
+                if any(d and d["status"] != "success" for d in deps):
+                    finish(sub, "skipped", message="Dependency did not succeed")
+                    pending.remove(sub)
+                    continue
+                if not all(deps) or len(self._running) >= self.parallel:
+                    continue
+                pending.remove(sub)
+                self._submit(sub)
+
+            if not self._running:
+                continue    # vừa có lệnh bị skip -> xét lại các lệnh còn lại
+
+            item = self._done.get()
+            entry = self._running.pop(item[0]["id"], None) if item else None
+            if entry is not None:
+                sub, result, finished = item
+                result = {k: v for k, v in result.items() if k != "command_id"}
+                status = result.get("status", "success")
+                status = status if status in ("success", "cancelled", "timeout") else "error"
+                failed = failed or status != "success"
+                finish(sub, status, finished - entry[2], result)
+            if self._cancelled:
+                # đã gửi cancel_command cho các lệnh con; không chờ lệnh không huỷ được
+                for sub, _, sub_started in list(self._running.values()):
+                    finish(sub, "cancelled", time.perf_counter() - sub_started, message="Cancelled")
+                self._running.clear()
+
+        ordered = [results[sub["id"]] for sub in subs]
+        ok = all(r["status"] == "success" for r in ordered)
+        print(f"📦 Batch: {sum(r['status'] == 'success' for r in ordered)}/{len(ordered)} succeeded")
+        return {
+            "type": "batch_result",
+            "status": "cancelled" if self._cancelled else ("success" if ok else "error"),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            "results": ordered,
+        }
+
+
+def _jsonable(result):
+    """Kết quả lồng trong batch không đi được binary frame -> bytes chuyển sang base64."""
+    return {k: base64.b64encode(v).decode("utf-8") if isinstance(v, (bytes, bytearray)) else v
+            for k, v in result.items()}
+
+
+# ===== Command registry =====
+PRIORITY_URGENT = 0     # chen lên đầu hàng đợi và được dùng slot dự phòng (lock, kill...)
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2       # lệnh nặng / chạy lâu (shell, screenshot, stream)
+DEFAULT_CONCURRENCY = 2
+SHELL_TIMEOUT = 600     # giây; controller gửi "timeout": 0 để chạy không giới hạn
+
+
+class CommandSpec:
+    """
+    Metadata của một loại lệnh:
+      factory     — callable(cmd dict) -> ICommand
+      priority    — PRIORITY_URGENT / NORMAL / BULK
+      timeout     — giây tối đa (None = không giới hạn); cmd["timeout"] ghi đè
+      concurrency — số lệnh cùng loại chạy đồng thời tối đa
+      cache_ttl   — chỉ cho lệnh read-only: giây giữ kết quả để trả cho lệnh giống hệt
+                    (None = không cache); Config.command_cache_ttl ghi đè theo loại lệnh
+      durable     — kết quả cuối vào result outbox (gửi lại sau khi mất kết nối); False cho
+                    kết quả lớn hỏi lại được (ảnh...) để không đẩy kết quả nhỏ quan trọng ra khỏi outbox
+    """
+    def __init__(self, factory=None, priority=PRIORITY_NORMAL, timeout=None, concurrency=DEFAULT_CONCURRENCY,
+                 cache_ttl=None, durable=True):
+        self.factory = factory
+        self.priority = priority
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.cache_ttl = cache_ttl
+        self.durable = durable
+
+
+COMMAND_REGISTRY: Dict[str, CommandSpec] = {}
+DEFAULT_SPEC = CommandSpec()
+
+
+def register_command(name, factory, priority=PRIORITY_NORMAL, timeout=None, concurrency=DEFAULT_CONCURRENCY,
+                     cache_ttl=None, durable=True):
+    COMMAND_REGISTRY[name] = CommandSpec(factory, priority, timeout, concurrency, cache_ttl, durable)
+
+
+register_command("shutdown", lambda cmd: ShutdownCommand(), PRIORITY_URGENT, timeout=10, concurrency=1)
+register_command("restart", lambda cmd: RestartCommand(), PRIORITY_URGENT, timeout=10, concurrency=1)
+register_command("lock", lambda cmd: LockCommand(), PRIORITY_URGENT, timeout=10, concurrency=1)
+register_command(
+    "kill_process",
+    lambda cmd: KillProcessCommand(
+        cmd.get("targets", cmd.get("target")),
+        match=cmd.get("match", "substring"),
+        tree=bool(cmd.get("tree", False)),
+        dry_run=bool(cmd.get("dry_run", False)),
+    ),
+    PRIORITY_URGENT, timeout=30, concurrency=2,
+)
+register_command("stop_screen_stream", lambda cmd: StopScreenStreamCommand(), timeout=10)
+register_command("unsubscribe_processes",
+                 lambda cmd: UnsubscribeProcessesCommand(cmd.get("subscription_id")), timeout=10)
+register_command("disable_wifi", lambda cmd: WifiCommand(enable=False), timeout=30, concurrency=1)
+register_command("enable_wifi", lambda cmd: WifiCommand(enable=True), timeout=30, concurrency=1)
+register_command("disable_bluetooth", lambda cmd: BluetoothCommand(enable=False), timeout=60, concurrency=1)
+register_command("enable_bluetooth", lambda cmd: BluetoothCommand(enable=True), timeout=60, concurrency=1)
+# MessageBox chặn tới khi người dùng bấm OK -> không giới hạn thời gian
+register_command("message", lambda cmd: MessageCommand(cmd.get("text", "")))
+register_command(
+    "get_list_process",
+    lambda cmd: GetListProcessCommand(
+        top=cmd.get("top", 30),
+        sort=cmd.get("sort", "cpu"),
+        name=cmd.get("name"),
+        user=cmd.get("user"),
+        offset=cmd.get("offset", 0),
+        limit=cmd.get("limit", PROCESS_PAGE_SIZE),
+    ),
+    timeout=30, concurrency=2, cache_ttl=0.5,
+)
+register_command("subscribe_processes",
+                 lambda cmd: SubscribeProcessesCommand(cmd.get("subscription_id"), cmd.get("lease")), timeout=30)
+register_command("get_agent_stats", lambda cmd: AgentStatsCommand(), timeout=10)
+register_command(
+    "file_download",
+    lambda cmd: FileDownloadCommand(cmd.get("path"), cmd.get("offset", 0), cmd.get("chunk_size"),
+                                    cmd.get("window"), cmd.get("transfer_id")),
+    PRIORITY_BULK, timeout=None, concurrency=2,
+)
+# NORMAL vẫn chen trước file_download (BULK) nên download không tự chặn vì hết cửa sổ;
+# slot dự phòng chỉ dành cho lock/kill/shutdown
+# file_ack (flow control của download) do CommandHandler.enqueue_command xử lý ngay
+register_command(
+    "file_upload",
+    lambda cmd: FileUploadCommand(cmd.get("path"), cmd.get("size"), cmd.get("sha256"), cmd.get("transfer_id")),
+    timeout=120, concurrency=2,
+)
+# chunk phải ghi đúng thứ tự nhận -> chạy từng cái một
+register_command("file_chunk",
+                 lambda cmd: FileChunkCommand(cmd.get("transfer_id"), cmd.get("offset"),
+                                              cmd[BINARY_FIELD] if BINARY_FIELD in cmd else cmd.get("data")),
+                 timeout=60, concurrency=1)
+register_command(
+    "list_dir",
+    lambda cmd: ListDirCommand(cmd.get("path"), cmd.get("offset", 0), cmd.get("limit"), cmd.get("pattern")),
+    timeout=30, concurrency=2,
+)
+# lệnh con đi qua scheduler của handler với timeout / concurrency riêng; batch không lồng nhau
+# và tối đa 2 batch giữ slot, nên lệnh con luôn còn slot để chạy
+register_command(
+    "batch",
+    lambda cmd: BatchCommand(
+        cmd.get("commands"),
+        stop_on_error=bool(cmd.get("stop_on_error", False)),
+        sequential=bool(cmd.get("sequential", False)),
+        parallel=cmd.get("parallel", BATCH_PARALLELISM),
+    ),
+    concurrency=2,
+)
+register_command(
+    "screenshot",
+    lambda cmd: ScreenCaptureCommand(
+        fmt=cmd.get("format"),
+        quality=cmd.get("quality"),
+        max_width=cmd.get("max_width"),
+        binary=bool(cmd.get("binary", False)),
+        save=cmd.get("save", True),
+        telegram=cmd.get("telegram", True),
+    ),
+    PRIORITY_BULK, timeout=30, concurrency=1, cache_ttl=0.5, durable=False,
+)
+register_command(
+    "subscribe_metrics",
+    lambda cmd: SubscribeMetricsCommand(cmd.get("metrics"), cmd.get("interval"), cmd.get("thresholds"),
+                                        cmd.get("subscription_id"), cmd.get("lease")),
+    timeout=10, concurrency=2,
+)
+register_command("unsubscribe_metrics", lambda cmd: UnsubscribeMetricsCommand(cmd.get("subscription_id")),
+                 timeout=10, concurrency=2)
+register_command(
+    "list_captures",
+    lambda cmd: ListCapturesCommand(cmd.get("since"), cmd.get("until"), cmd.get("offset", 0), cmd.get("limit"),
+                                    thumbnails=bool(cmd.get("thumbnails", True))),
+    timeout=30, concurrency=2, durable=False,
+)
+register_command(
+    "get_capture",
+    lambda cmd: GetCaptureCommand(cmd.get("id"), thumbnail=bool(cmd.get("thumbnail", False)),
+                                  binary=bool(cmd.get("binary", False))),
+    timeout=30, concurrency=2, durable=False,
+)
+register_command(
+    "start_screen_stream",
+    lambda cmd: StartScreenStreamCommand(
+        fps=cmd.get("fps"),
+        quality=cmd.get("quality"),
+        tile_size=cmd.get("tile_size"),
+        fmt=cmd.get("format"),
+        max_width=cmd.get("max_width"),
+        binary=bool(cmd.get("binary", True)),     # false: tile base64 cho controller cũ
+    ),
+    PRIORITY_BULK, timeout=30, concurrency=1,
+)
+register_command(
+    "shell",
+    lambda cmd: ShellCommand(
+        cmd.get("command", ""),
+        stream=bool(cmd.get("stream", False)),
+        timeout=cmd.get("timeout", SHELL_TIMEOUT) or None,
+    ),
+    PRIORITY_BULK, timeout=SHELL_TIMEOUT, concurrency=4,
+)
+
+
+def loggable(cmd: Dict) -> Dict:
+    """Bản sao để in log: thay bytes (chunk file, ảnh) bằng kích thước."""
+    return {k: f"<{len(v)} bytes>" if isinstance(v, (bytes, bytearray, memoryview)) else v for k, v in cmd.items()}
+
+
 # ===== Factory / Executor =====
 class CommandExecutor:
-    ws_client = None  # sẽ được gán từ agent/main.py
+    @staticmethod
+    def spec(action) -> CommandSpec:
+        return COMMAND_REGISTRY.get(action, DEFAULT_SPEC)
 
     @staticmethod
     def create(cmd: Dict) -> Optional[ICommand]:
-        print(f"cmd: {cmd}")
+        print(f"cmd: {loggable(cmd)}")
         action = cmd.get("type")
-        if action == "shutdown":
-            return ShutdownCommand()
-        elif action == "restart":
-            return RestartCommand()
-        elif action == "kill_process":
-            return KillProcessCommand(cmd.get("target"))
-        elif action == "disable_wifi":
-            return WifiCommand(enable=False)
-        elif action == "enable_wifi":
-            return WifiCommand(enable=True)
-        elif action == "disable_bluetooth":
-            return BluetoothCommand(enable=False)
-        elif action == "enable_bluetooth":
-            return BluetoothCommand(enable=True)
-        elif action == "lock":
-            return LockCommand()
-        elif action == "message":
-            return MessageCommand(cmd.get("text", ""))
-        elif action == "screenshot":
-            return ScreenCaptureCommand()
-        elif action == "shell":
-            return ShellCommand(cmd.get("command", ""))
-        elif action == "get_list_process":
-            return GetListProcessCommand()
-        else:
+        spec = COMMAND_REGISTRY.get(action)
+        if spec is None:
             print(f"[⚠️ Unknown Command Type] {action}")
             return None
+        return spec.factory(cmd)
 
     @staticmethod
-    async def execute(cmd: Dict):
+    async def execute(cmd: Dict, executor=None):
         command = CommandExecutor.create(cmd)
         if not command:
             return
+        print(f"⚙️ Executing command: {loggable(cmd)}")
+        return await CommandExecutor.run(command, executor)
 
-        print(f"⚙️ Executing command: {cmd}")
+    @staticmethod
+    async def run(command: ICommand, executor=None):
         try:
-            result = command.execute()
+            # chạy lệnh blocking trên worker pool, không chiếm dispatch loop
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(executor, command.execute)
         except Exception as e:
             result = {"status": "error", "message": str(e)}
-
-        # gửi kết quả về server nếu có websocket
-        if CommandExecutor.ws_client:
-            await CommandExecutor.ws_client.send_result(result)
-
+        # CommandHandler gửi kết quả về controller — ở đây không gửi lần nữa
         return result
@@ -1,12 +1,351 @@
+import asyncio
+import heapq
+import itertools
+import json
 import queue
-from core.command_executor import CommandExecutor
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from core.command_executor import CommandExecutor, PRIORITY_URGENT, loggable
+from core import file_transfer
+from core.config import Config
+from core.metrics import metrics
+from core.protocol import BINARY_TYPES, BINARY_FIELD
+
+WORKER_POOL_SIZE = 8          # số lệnh chạy đồng thời tối đa
+URGENT_RESERVED_SLOTS = 1     # slot chỉ lệnh khẩn (lock, kill...) được dùng
+TIMEOUT_GRACE = 5.0           # lệnh tự xử lý timeout (shell) được thêm chừng này giây để trả kết quả
+# priority / timeout / concurrency / cache_ttl của từng loại lệnh: xem COMMAND_REGISTRY trong command_executor
+RESULT_CACHE_SIZE = 32        # số kết quả read-only giữ trong bộ nhớ
+IDEMPOTENCY_TTL = 600         # giây nhớ idempotency_key (đủ cho retry sau khi relay reconnect)
+IDEMPOTENCY_SIZE = 1000
+# field không ảnh hưởng kết quả -> bỏ khỏi khoá coalesce
+VOLATILE_FIELDS = ("command_id", "timeout", "idempotency_key", "telegram", "save")
+
 
 class CommandHandler:
-    def __init__(self, ws_client):
+    """
+    Nhận command từ thread đọc websocket và chạy chúng trên một event loop
+    dùng chung + worker pool có giới hạn, để lệnh chậm không chặn việc đọc frame.
+    """
+
+    def __init__(self, ws_client, max_workers=WORKER_POOL_SIZE):
         self.ws = ws_client
-        self.commands = queue.Queue()
+        self.commands = queue.Queue()   # inbox: reader thread -> dispatch loop
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cmd-worker")
+
+        self._pending = []              # heap (priority, thứ tự nhận, cmd) chưa có slot
+        self._order = itertools.count()
+        self._starting = set()          # đã có slot, task _run chưa chạy bước đầu
+        self._cancel_before_start = set()
+        self._result_cache = {}         # coalesce key -> (monotonic lúc xong, response)
+        self._idempotency = {}          # "type:key" -> {"at", "response" (None = đang chạy)}
+        self._followers = {}            # share key -> [cmd] chờ chung kết quả với lệnh đang chạy
+        self.running = {}               # command_id -> ICommand đang chạy
+        self._received_at = {}          # command_id -> perf_counter lúc nhận (đo thời gian chờ)
+        self._reply_sinks = {}          # command_id -> callable(payload) thay cho relay
+        self._active = 0
+        self._active_by_type = {}
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="cmd-dispatch", daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------
+    # Gọi từ thread đọc websocket — không được block
+    # --------------------------------------------------
+
+    def enqueue_command(self, cmd, reply=None):
+        """
+        reply: callable(payload) nhận mọi kết quả của lệnh này (vd. kết nối LAN).
+        None -> gửi qua relay như bình thường.
+        """
+        data = cmd.get("data")
+        data = dict(data) if isinstance(data, dict) else {}
+        # correlation id: lấy từ controller nếu có, không thì tự sinh
+        data["command_id"] = data.get("command_id") or cmd.get("command_id") or uuid.uuid4().hex
+        # binary frame chỉ mang được bytes ở cấp ngoài cùng (vd. chunk của file_chunk) -> data["binary"]
+        for value in cmd.values():
+            if isinstance(value, BINARY_TYPES):
+                data.setdefault(BINARY_FIELD, bytes(value))
+        print(f"📩 Received command: {loggable(data)}")
+        if data.get("type") == "file_ack":
+            # flow control của download: xử lý ngay, không chờ slot sau lệnh chậm
+            # (sender hết ACK_TIMEOUT là dừng download) — ack không cần trả lời
+            try:
+                file_transfer.ack_download(data.get("transfer_id"), data.get("offset") or 0)
+            except (TypeError, ValueError):
+                print(f"⚠️ Invalid file_ack offset: {data.get('offset')!r}")
+            return
+        if reply is not None:
+            self._reply_sinks[data["command_id"]] = reply
+
+        if data.get("type") == "cancel_command":
+            self.loop.call_soon_threadsafe(self._cancel, data)
+            return
+        self._received_at[data["command_id"]] = time.perf_counter()
+        self.commands.put(data)
+        self.loop.call_soon_threadsafe(self._drain)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.pool.shutdown(wait=False)
+
+    # --------------------------------------------------
+    # Chạy trên dispatch loop
+    # --------------------------------------------------
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _pull_inbox(self):
+        while True:
+            try:
+                cmd = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if self._serve_shared(cmd, register=True):
+                continue
+            priority = CommandExecutor.spec(cmd.get("type")).priority
+            heapq.heappush(self._pending, (priority, next(self._order), cmd))
+
+    def _drain(self):
+        self._pull_inbox()
+        self._schedule()
+
+    def _schedule(self):
+        """
+        Khởi chạy lệnh theo priority (cùng priority thì theo thứ tự nhận) nếu còn slot.
+        Lệnh không khẩn để trống URGENT_RESERVED_SLOTS slot cho lock/kill chen vào.
+        """
+        deferred = []
+        while self._pending and self._active < self.max_workers:
+            entry = heapq.heappop(self._pending)
+            priority, _, cmd = entry
+            if self._serve_shared(cmd):
+                continue    # lệnh giống hệt vừa chạy xong / đang chạy trong lúc chờ slot
+            cmd_type = cmd.get("type")
+            spec = CommandExecutor.spec(cmd_type)
+            if (self._active_by_type.get(cmd_type, 0) >= spec.concurrency
+                    or (priority != PRIORITY_URGENT and self._active >= self.max_workers - URGENT_RESERVED_SLOTS)):
+                deferred.append(entry)
+                continue
+            self._active += 1
+            self._active_by_type[cmd_type] = self._active_by_type.get(cmd_type, 0) + 1
+            self._starting.add(cmd["command_id"])
+            coalesce_key, _ = self._share_keys(cmd)
+            if coalesce_key:
+                self._followers.setdefault(coalesce_key, [])   # lệnh giống hệt tới sau sẽ chờ kết quả này
+            self.loop.create_task(self._run(cmd, cmd_type))
+        for entry in deferred:
+            heapq.heappush(self._pending, entry)
+
+    async def _run(self, cmd, cmd_type):
+        command_id = cmd["command_id"]
+        received_at = self._received_at.pop(command_id, None)
+        if received_at is not None:
+            metrics.observe("agent_command_queue_seconds", time.perf_counter() - received_at, type=cmd_type)
+        metrics.inc("agent_commands_total", type=cmd_type)
+        self._starting.discard(command_id)
+        response = None
+        task = None
+        try:
+            if command_id in self._cancel_before_start:
+                self._cancel_before_start.discard(command_id)
+                response = {"type": "command_result", "status": "cancelled", "message": "Cancelled before start"}
+                return
+            command = CommandExecutor.create(cmd)
+            if command is None:
+                response = {"type": "command_result", "status": "error", "message": f"Unknown command type {cmd_type}"}
+                return
+            command.command_id = command_id
+            # giữ sink ngay lúc tạo: stream / subscription còn emit sau khi lệnh đã trả kết quả
+            sink = self._reply_sinks.get(command_id)
+            command.emit = lambda payload: self._reply(command_id, payload, sink=sink)
+            command.dispatch = lambda data, reply: self.enqueue_command({"type": "command", "data": data}, reply=reply)
+            self.running[command_id] = command
+
+            print(f"⚙️ Executing command: {loggable(cmd)}")
+            timeout = cmd["timeout"] if "timeout" in cmd else CommandExecutor.spec(cmd_type).timeout
+            started = time.perf_counter()
+            task = asyncio.ensure_future(CommandExecutor.run(command, executor=self.pool))
+            done, _ = await asyncio.wait({task}, timeout=float(timeout) + TIMEOUT_GRACE if timeout else None)
+            metrics.observe("agent_command_execute_seconds", time.perf_counter() - started, type=cmd_type)
+            if task in done:
+                response = task.result()
+            else:
+                # thread worker không dừng cưỡng bức được: yêu cầu lệnh tự huỷ, kết quả muộn bị bỏ
+                command.cancel()
+                metrics.inc("agent_command_timeouts_total", type=cmd_type)
+                print(f"⏰ Command {command_id} ({cmd_type}) timed out after {timeout}s")
+                response = {"type": "command_result", "status": "timeout", "message": f"Timed out after {timeout}s"}
+        except Exception as e:
+            # factory / tạo lệnh lỗi: controller vẫn phải nhận được kết quả
+            print(f"⚠️ Command failed: {e}")
+            response = {"type": "command_result", "status": "error", "message": f"Command failed: {e}"}
+        finally:
+            if response is not None:
+                try:
+                    durable = CommandExecutor.spec(cmd_type).durable
+                    await self.loop.run_in_executor(self.pool, self._reply, command_id, response, durable, cmd_type)
+                except Exception as e:
+                    print(f"⚠️ Reply failed: {e}")
+            self._settle(cmd, response)
+            self.running.pop(command_id, None)
+            self._reply_sinks.pop(command_id, None)
+            if task is not None and not task.done():
+                # lệnh quá giờ vẫn chiếm một worker thread: giữ slot tới khi thread thật sự trả về,
+                # không thì slot dự phòng cho lệnh khẩn không còn được đảm bảo
+                task.add_done_callback(lambda _: self._release(cmd_type))
+            else:
+                self._release(cmd_type)
+
+    def _release(self, cmd_type):
+        self._active -= 1
+        self._active_by_type[cmd_type] -= 1
+        self._schedule()
+
+    def _cancel(self, cmd):
+        """Huỷ lệnh theo command_id: lệnh còn trong hàng đợi thì bỏ luôn, lệnh đang chạy thì gọi cancel()."""
+        target_id = cmd.get("target_id")
+        self._pull_inbox()   # lệnh đích có thể vẫn nằm trong inbox
+        queued = next((entry for entry in self._pending if entry[2]["command_id"] == target_id), None)
+        command = self.running.get(target_id)
+        if queued is not None:
+            self._pending.remove(queued)
+            heapq.heapify(self._pending)
+            cancelled = {"type": "command_result", "status": "cancelled", "message": "Cancelled before start"}
+            self._reply_later(queued[2], cancelled)
+            self._settle(queued[2], cancelled)
+            result = {"status": "success", "state": "queued", "message": f"Removed queued command {target_id}"}
+        elif target_id in self._starting:
+            self._cancel_before_start.add(target_id)
+            result = {"status": "success", "state": "queued", "message": f"Removed queued command {target_id}"}
+        elif command is None:
+            result = {"status": "error", "message": f"Command {target_id} is not queued or running"}
+        elif command.cancel():
+            result = {"status": "success", "state": "running", "message": f"Cancelled command {target_id}"}
+        else:
+            result = {"status": "error", "state": "running", "message": f"Command {target_id} cannot be cancelled"}
+        metrics.inc("agent_command_cancels_total", outcome=result["status"])
+        print(f"🛑 Cancel {target_id}: {result['message']}")
+        sink = self._reply_sinks.pop(cmd["command_id"], None)
+        self.pool.submit(self._reply, cmd["command_id"], {"type": "cancel_result", "target_id": target_id, **result},
+                         True, None, sink)
+
+    # --------------------------------------------------
+    # Chia sẻ kết quả: cache TTL + coalescing (read-only), idempotency_key
+    # --------------------------------------------------
+
+    def _share_keys(self, cmd):
+        """(coalesce_key, idempotency_key) của lệnh; None nếu không áp dụng."""
+        cmd_type = cmd.get("type")
+        coalesce_key = None
+        if self._cache_ttl(cmd_type) is not None:
+            params = {k: v for k, v in cmd.items() if k not in VOLATILE_FIELDS}
+            coalesce_key = "c:" + json.dumps(params, sort_keys=True, default=str)
+        idempotency_key = cmd.get("idempotency_key")
+        return coalesce_key, (f"i:{cmd_type}:{idempotency_key}" if idempotency_key else None)
+
+    @staticmethod
+    def _cache_ttl(cmd_type):
+        overrides = Config().command_cache_ttl or {}
+        if cmd_type in overrides:
+            return overrides[cmd_type]
+        return CommandExecutor.spec(cmd_type).cache_ttl
+
+    def _serve_shared(self, cmd, register=False):
+        """
+        Trả True nếu lệnh được phục vụ mà không cần chạy: kết quả idempotent đã có,
+        kết quả cache còn hạn, hoặc gắn vào lệnh giống hệt đang chạy.
+        register=True: lần đầu thấy idempotency_key thì ghi nhận lệnh này là lệnh chạy thật.
+        """
+        coalesce_key, idempotency_key = self._share_keys(cmd)
+        now = time.monotonic()
+        if idempotency_key:
+            entry = self._idempotency.get(idempotency_key)
+            if entry and now - entry["at"] < IDEMPOTENCY_TTL:
+                if entry["response"] is None and entry["command_id"] == cmd["command_id"]:
+                    return False    # chính lệnh đã đăng ký key, tới lượt chạy
+                metrics.inc("agent_command_duplicates_total", type=cmd.get("type"))
+                if entry["response"] is None:
+                    self._followers.setdefault(idempotency_key, []).append(cmd)
+                    return True
+                print(f"♻️ Duplicate {idempotency_key} — replaying stored result")
+                self._reply_later(cmd, {**entry["response"], "duplicate": True}, durable=False)
+                return True
+            if register:
+                self._idempotency[idempotency_key] = {"at": now, "response": None, "command_id": cmd["command_id"]}
+                _trim(self._idempotency, IDEMPOTENCY_SIZE)
+        if coalesce_key:
+            cached = self._result_cache.get(coalesce_key)
+            ttl = self._cache_ttl(cmd.get("type"))
+            if cached and now - cached[0] <= ttl:
+                metrics.inc("agent_command_cache_hits_total", type=cmd.get("type"))
+                self._reply_later(cmd, {**cached[1], "cached": True, "age_ms": round((now - cached[0]) * 1000, 1)},
+                                  durable=False)
+                return True
+            if coalesce_key in self._followers:
+                metrics.inc("agent_command_coalesced_total", type=cmd.get("type"))
+                self._followers[coalesce_key].append(cmd)
+                return True
+        return False
+
+    def _settle(self, cmd, response):
+        """
+        Lệnh thật đã xong: lưu cache / kết quả idempotent và trả lời các lệnh đang chờ chung.
+        Lệnh bị huỷ: việc huỷ chỉ là của controller gửi lệnh đó, nên các lệnh chờ chung
+        được đưa lại vào inbox để chạy thật (lệnh đầu tiên thành lệnh dẫn mới).
+        """
+        coalesce_key, idempotency_key = self._share_keys(cmd)
+        now = time.monotonic()
+        cancelled = response is not None and response.get("status") == "cancelled"
+        if idempotency_key and idempotency_key in self._idempotency:
+            if cancelled:
+                del self._idempotency[idempotency_key]     # retry cùng key phải chạy lại
+            else:
+                self._idempotency[idempotency_key] = {"at": now, "response": response,
+                                                      "command_id": cmd["command_id"]}
+        rerun = []
+        for key, flag in ((coalesce_key, "coalesced"), (idempotency_key, "duplicate")):
+            for follower in self._followers.pop(key, []) if key else []:
+                if cancelled:
+                    rerun.append(follower)
+                else:
+                    self._reply_later(follower, {**(response or {}), flag: True}, durable=False)
+        if rerun:
+            print(f"🔁 Re-running {len(rerun)} command(s) that shared cancelled {cmd['command_id']}")
+            for follower in rerun:
+                self.commands.put(follower)
+            self.loop.call_soon(self._drain)
+        if coalesce_key and response and response.get("status") == "success":
+            self._result_cache[coalesce_key] = (now, response)
+            _trim(self._result_cache, RESULT_CACHE_SIZE)
+
+    def _reply_later(self, cmd, payload, durable=True):
+        """
+        Trả lời lệnh không đi qua _run (cache, coalesce, huỷ khi còn trong hàng đợi).
+        Bản sao từ cache / lệnh chạy chung không vào outbox: mất thì controller hỏi lại.
+        """
+        command_id = cmd["command_id"]
+        self._received_at.pop(command_id, None)
+        sink = self._reply_sinks.pop(command_id, None)
+        self.pool.submit(self._reply, command_id, payload, durable, cmd.get("type"), sink)
+
+    def _reply(self, command_id, payload, durable=False, cmd_type=None, sink=None):
+        """Trả True nếu payload đã gửi đi (hoặc đã vào outbox), False nếu gửi hỏng."""
+        payload = {"command_id": command_id, **payload}
+        sink = sink or self._reply_sinks.get(command_id)
+        if sink is not None:
+            return sink(payload) is not False
+        # chỉ kết quả cuối là durable; chunk stream / frame màn hình mất thì thôi
+        return self.ws.send_result(payload, durable=durable, label=cmd_type)
+
 
-    async def enqueue_command(self, cmd):
-        print(f"📩 Received command: {cmd}")
-        response = await CommandExecutor.execute(cmd['data'])
-        self.ws.send_result(response)
+def _trim(mapping, size):
+    """Bỏ các entry cũ nhất (dict giữ thứ tự chèn) cho tới khi còn `size`."""
+    while len(mapping) > size:
+        del mapping[next(iter(mapping))]
@@ -1,10 +1,17 @@
 # core/config.py
 import stat
 import json, os, uuid
+import hashlib, hmac, secrets
 config_path = os.path.join(os.path.expanduser("~"), ".window_manager_agent", "config.json")
 os.makedirs(os.path.dirname(config_path), exist_ok=True)
 CONFIG_PATH = config_path
 
+# endpoint mặc định — ghi đè trong config.json (vd. trỏ về stub local khi benchmark)
+DEFAULT_SERVER_URL = "ws://control.imsteve.dev/ws"
+DEFAULT_TELEGRAM_API_BASE = "https://api.telegram.org"
+DEFAULT_TTS_BASE_URL = "https://tts.imsteve.dev"
+DEFAULT_TTS_API_KEY = "YOUR_API_KEY_HERE"
+
 def ensure_config_writable(path):
         dir_path = os.path.dirname(path)
         os.makedirs(dir_path, exist_ok=True)
@@ -33,6 +40,24 @@ class Config:
         self.device_id = data.get("device_id") or str(uuid.uuid4())
         self.telegram_token = data.get("telegram_token", "")
         self.telegram_chat_id = data.get("telegram_chat_id", "")
+        self.server_url = data.get("server_url", DEFAULT_SERVER_URL)
+        self.telegram_api_base = data.get("telegram_api_base", DEFAULT_TELEGRAM_API_BASE)
+        self.tts_base_url = data.get("tts_base_url", DEFAULT_TTS_BASE_URL)
+        self.tts_api_key = data.get("tts_api_key", DEFAULT_TTS_API_KEY)
+        self.process_sample_interval = data.get("process_sample_interval", 2.0)
+        self.speech_queue_size = data.get("speech_queue_size", 5)
+        self.speech_overflow_policy = data.get("speech_overflow_policy", "drop_oldest")
+        self.heartbeat_interval = data.get("heartbeat_interval", 15)
+        self.heartbeat_timeout = data.get("heartbeat_timeout", 45)
+        self.metrics_port = data.get("metrics_port", 0)  # 0 = không mở /metrics
+        self.command_cache_ttl = data.get("command_cache_ttl", {})  # {"get_list_process": 0.5, ...}
+        self.lan_port = data.get("lan_port", 0)          # 0 = không mở cổng điều khiển LAN
+        self.lan_host = data.get("lan_host", "127.0.0.1")  # "0.0.0.0" để controller khác máy kết nối được
+        self.lan_secret = data.get("lan_secret") or secrets.token_hex(32)
+        self.capture_budget_mb = data.get("capture_budget_mb", 500)      # dung lượng tối đa của kho ảnh chụp
+        self.capture_max_age_days = data.get("capture_max_age_days", 14)
+        # None = chỉ bỏ ảnh trùng hệt; đặt số bit (vd. 3) để bỏ cả ảnh gần giống theo dHash
+        self.capture_dedupe_distance = data.get("capture_dedupe_distance")
         self.save()
     
     def save(self):
@@ -42,10 +67,35 @@ class Config:
                 "device_id": self.device_id,
                 "telegram_token": self.telegram_token,
                 "telegram_chat_id": self.telegram_chat_id,
+                "server_url": self.server_url,
+                "telegram_api_base": self.telegram_api_base,
+                "tts_base_url": self.tts_base_url,
+                "tts_api_key": self.tts_api_key,
+                "process_sample_interval": self.process_sample_interval,
+                "speech_queue_size": self.speech_queue_size,
+                "speech_overflow_policy": self.speech_overflow_policy,
+                "heartbeat_interval": self.heartbeat_interval,
+                "heartbeat_timeout": self.heartbeat_timeout,
+                "metrics_port": self.metrics_port,
+                "command_cache_ttl": self.command_cache_ttl,
+                "lan_port": self.lan_port,
+                "lan_host": self.lan_host,
+                "lan_secret": self.lan_secret,
+                "capture_budget_mb": self.capture_budget_mb,
+                "capture_max_age_days": self.capture_max_age_days,
+                "capture_dedupe_distance": self.capture_dedupe_distance,
             }, f, indent=2)
 
     def revoke_device_id(self):
         self.device_id = str(uuid.uuid4())
         self.save()
 
+    def lan_token(self):
+        # token gắn với device_id: revoke device id thì token LAN cũ cũng hết hiệu lực
+        return hmac.new(self.lan_secret.encode(), self.device_id.encode(), hashlib.sha256).hexdigest()
+
+    def lan_token_fingerprint(self):
+        # đủ để đối chiếu token đang dùng mà không lộ token ra log
+        return hashlib.sha256(self.lan_token().encode()).hexdigest()[:8]
+
     
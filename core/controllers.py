@@ -0,0 +1,65 @@
+# core/controllers.py
+import threading
+import time
+
+CONTROLLER_TTL = 15 * 60    # giây không có tín hiệu của riêng controller đó -> coi như đã rời
+
+
+class ControllerRegistry:
+    """
+    Danh sách controller đang gắn với agent. Mỗi controller chỉ được làm mới bằng
+    tín hiệu của chính nó: frame nó gửi, hoặc danh sách controller còn sống relay
+    gửi (frame "controllers"). Controller bị xoá khi relay báo ngắt kết nối, khi
+    không còn trong danh sách của relay, hoặc sau CONTROLLER_TTL không có tín hiệu
+    (relay cũ không báo disconnect).
+    """
+
+    def __init__(self, ttl=CONTROLLER_TTL):
+        self.ttl = ttl
+        self._controllers = {}
+        self._lock = threading.Lock()
+
+    def add(self, controller_id):
+        now = time.time()
+        with self._lock:
+            self._controllers[controller_id] = {"connected_at": now, "last_seen": now}
+
+    def touch(self, controller_id):
+        with self._lock:
+            info = self._controllers.get(controller_id)
+            if info:
+                info["last_seen"] = time.time()
+
+    def sync(self, controller_ids):
+        """Relay liệt kê controller còn sống: thêm cái mới, làm mới cái còn, xoá cái đã rời."""
+        now = time.time()
+        live = set(controller_ids)
+        with self._lock:
+            gone = [cid for cid in self._controllers if cid not in live]
+            for cid in gone:
+                del self._controllers[cid]
+            for cid in live:
+                info = self._controllers.setdefault(cid, {"connected_at": now, "last_seen": now})
+                info["last_seen"] = now
+        return gone
+
+    def remove(self, controller_id):
+        with self._lock:
+            return self._controllers.pop(controller_id, None) is not None
+
+    def active(self):
+        """Trả về list controller_id còn sống (đồng thời dọn các entry hết hạn)."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [cid for cid, info in self._controllers.items() if info["last_seen"] < cutoff]
+            for cid in expired:
+                del self._controllers[cid]
+                print(f"⌛ Controller expired: {cid}")
+            return list(self._controllers)
+
+    def snapshot(self):
+        with self._lock:
+            return {cid: dict(info) for cid, info in self._controllers.items()}
+
+    def __len__(self):
+        return len(self.active())
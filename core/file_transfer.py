@@ -0,0 +1,271 @@
+# core/file_transfer.py
+"""
+Truyền file theo chunk, không đọc/ghi cả file vào bộ nhớ.
+
+Download (agent -> controller):
+  file_download {path, offset?, chunk_size?, window?}
+    -> nhiều frame {"type": "file_chunk", transfer_id, offset, data: bytes}
+    -> kết quả cuối {"type": "file_download_result", size, sha256}
+  Controller ack bằng file_ack {transfer_id, offset} (offset = số byte đã nhận
+  liên tục). Agent chỉ gửi trước tối đa `window` chunk chưa ack. Mất kết nối
+  thì gửi lại file_download với offset = byte đã ack cuối cùng.
+
+Upload (controller -> agent):
+  file_upload {path, size, sha256?, transfer_id?} -> {"status": "ready", offset}
+  file_chunk {transfer_id, offset, data: bytes} (lần lượt, đúng offset)
+    -> {"type": "file_ack", offset}; chunk cuối -> kiểm tra sha256 rồi đổi tên.
+  Dữ liệu ghi vào <path>.part — gửi lại file_upload cùng path sau khi mất
+  kết nối (kể cả khi agent khởi động lại) sẽ tiếp tục từ kích thước file .part.
+
+SHA-256 luôn tính trên toàn bộ file: khi resume, phần đã có được băm lại
+qua mmap (đọc tuần tự, bộ nhớ không đổi).
+"""
+import hashlib
+import mmap
+import os
+import stat
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+WINDOW_CHUNKS = 16
+ACK_TIMEOUT = 30.0          # không có ack trong khoảng này -> dừng, controller resume sau
+UPLOAD_IDLE_TIMEOUT = 600.0  # session upload không nhận chunk lâu thì đóng file
+HASH_BLOCK = 4 * 1024 * 1024
+LIST_PAGE_SIZE = 200
+
+
+def _hash_prefix(f, length):
+    """SHA-256 của `length` byte đầu file (mmap, từng khối)."""
+    digest = hashlib.sha256()
+    if length:
+        with mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, length, HASH_BLOCK):
+                digest.update(mm[start:start + HASH_BLOCK])
+    return digest
+
+
+# ===== Download =====
+
+class Download:
+    def __init__(self, path, offset=0, chunk_size=CHUNK_SIZE, window=WINDOW_CHUNKS, transfer_id=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.offset = max(0, int(offset or 0))
+        self.chunk_size = max(4096, min(int(chunk_size or CHUNK_SIZE), MAX_CHUNK_SIZE))
+        self.window = max(1, int(window or WINDOW_CHUNKS))
+        self.transfer_id = transfer_id or uuid.uuid4().hex
+        self.acked = self.offset
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def ack(self, offset):
+        with self._cond:
+            if offset > self.acked:
+                self.acked = offset
+                self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self._cond.notify_all()
+
+    def _wait_window(self, sent):
+        """Chờ tới khi số byte chưa ack nằm trong cửa sổ. False nếu hết giờ / bị huỷ."""
+        limit = self.window * self.chunk_size
+        deadline = time.monotonic() + ACK_TIMEOUT
+        with self._cond:
+            while sent - self.acked >= limit and not self.cancelled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return not self.cancelled
+
+    def run(self, emit):
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if self.offset > size:
+                return {"status": "error", "message": f"Offset {self.offset} is past end of file ({size} bytes)"}
+            digest = _hash_prefix(f, self.offset)
+            sent = self.offset
+            started = time.perf_counter()
+            mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+            try:
+                while sent < size:
+                    if not self._wait_window(sent):
+                        status = "cancelled" if self.cancelled else "stalled"
+                        return {"status": status, "size": size, "acked": self.acked,
+                                "message": "Resume with offset=acked"}
+                    chunk = mm[sent:sent + self.chunk_size]
+                    digest.update(chunk)
+                    emit({"type": "file_chunk", "status": "running", "transfer_id": self.transfer_id,
+                          "offset": sent, "data": chunk})
+                    sent += len(chunk)
+            finally:
+                if mm is not None:
+                    mm.close()
+            elapsed = time.perf_counter() - started
+            return {
+                "status": "success",
+                "size": size,
+                "offset": self.offset,
+                "sha256": digest.hexdigest(),
+                "elapsed_ms": round(elapsed * 1000, 1),
+                "mb_per_s": round((size - self.offset) / (1024 * 1024) / elapsed, 1) if elapsed else None,
+            }
+
+
+_downloads = {}
+_downloads_lock = threading.Lock()
+
+
+def start_download(download):
+    with _downloads_lock:
+        _downloads[download.transfer_id] = download
+
+
+def finish_download(download):
+    with _downloads_lock:
+        _downloads.pop(download.transfer_id, None)
+
+
+def ack_download(transfer_id, offset):
+    with _downloads_lock:
+        download = _downloads.get(transfer_id)
+    if download is None:
+        return False
+    download.ack(int(offset))
+    return True
+
+
+# ===== Upload =====
+
+class UploadSession:
+    def __init__(self, path, size, sha256=None, transfer_id=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.part_path = self.path + ".part"
+        self.size = int(size)
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.transfer_id = transfer_id or uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.touched = time.monotonic()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.part_path, "a+b")
+        self.received = os.fstat(self.file.fileno()).st_size
+        if self.received > self.size:
+            self.file.truncate(0)
+            self.received = 0
+        self.digest = _hash_prefix(self.file, self.received)
+
+    def write(self, offset, data):
+        """Ghi một chunk; trả dict kết quả (ack, lỗi offset, hoặc hoàn tất)."""
+        with self.lock:
+            self.touched = time.monotonic()
+            if offset != self.received:
+                return {"status": "error", "message": "Unexpected offset", "expected_offset": self.received}
+            if self.received + len(data) > self.size:
+                return {"status": "error", "message": "Chunk past declared size", "expected_offset": self.received}
+            self.file.write(data)   # mở ở chế độ append và offset == received nên luôn ghi nối tiếp
+            self.digest.update(data)
+            self.received += len(data)
+            if self.received < self.size:
+                return {"status": "running", "offset": self.received}
+            return self._complete()
+
+    def finish(self):
+        """Hoàn tất session mà .part đã đủ byte (không cần thêm chunk)."""
+        with self.lock:
+            if self.received != self.size:
+                return {"status": "error", "message": "Upload incomplete", "expected_offset": self.received}
+            return self._complete()
+
+    def _complete(self):
+        self.file.close()
+        sha256 = self.digest.hexdigest()
+        if self.expected_sha256 and sha256 != self.expected_sha256:
+            os.remove(self.part_path)
+            return {"status": "error", "message": "SHA-256 mismatch", "sha256": sha256}
+        os.replace(self.part_path, self.path)
+        return {"status": "success", "offset": self.received, "sha256": sha256, "path": self.path}
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+_uploads = {}
+_uploads_lock = threading.Lock()
+
+
+def open_upload(path, size, sha256=None, transfer_id=None):
+    with _uploads_lock:
+        # session cũ cùng path (trước khi mất kết nối) -> đóng để mở lại từ file .part
+        for key, session in list(_uploads.items()):
+            idle = time.monotonic() - session.touched > UPLOAD_IDLE_TIMEOUT
+            if idle or session.path == os.path.abspath(os.path.expanduser(path)):
+                session.close()
+                del _uploads[key]
+        session = UploadSession(path, size, sha256, transfer_id)
+        _uploads[session.transfer_id] = session
+        return session
+
+
+def write_chunk(transfer_id, offset, data):
+    with _uploads_lock:
+        session = _uploads.get(transfer_id)
+    if session is None:
+        return {"status": "error", "message": f"Unknown upload {transfer_id} — send file_upload to resume"}
+    if not isinstance(data, (bytes, bytearray)) or not data:
+        # chunk rỗng / sai kiểu mà vẫn ack "running" thì controller tưởng transfer đang chạy
+        return {"status": "error", "message": "Chunk payload is empty or not bytes",
+                "expected_offset": session.received}
+    return _settle_upload(transfer_id, session.write(int(offset), data))
+
+
+def finish_upload(transfer_id):
+    with _uploads_lock:
+        session = _uploads.get(transfer_id)
+    if session is None:
+        return {"status": "error", "message": f"Unknown upload {transfer_id} — send file_upload to resume"}
+    return _settle_upload(transfer_id, session.finish())
+
+
+def _settle_upload(transfer_id, result):
+    # xong, hoặc lỗi không gửi tiếp được (sha256 sai) -> bỏ session;
+    # lỗi offset thì giữ để controller gửi lại từ expected_offset
+    if result["status"] == "success" or (result["status"] == "error" and "expected_offset" not in result):
+        with _uploads_lock:
+            _uploads.pop(transfer_id, None)
+    return result
+
+
+# ===== Directory listing =====
+
+def list_dir(path, offset=0, limit=LIST_PAGE_SIZE, pattern=None):
+    import fnmatch
+    path = os.path.abspath(os.path.expanduser(path or "."))
+    with os.scandir(path) as it:
+        names = sorted(
+            entry.name for entry in it
+            if not pattern or fnmatch.fnmatch(entry.name.lower(), pattern.lower())
+        )
+    offset, limit = max(0, int(offset or 0)), max(1, min(int(limit or LIST_PAGE_SIZE), 5000))
+    entries = []
+    for name in names[offset:offset + limit]:
+        full = os.path.join(path, name)
+        try:
+            st = os.stat(full)
+            entries.append({
+                "name": name,
+                "is_dir": stat.S_ISDIR(st.st_mode),
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+            })
+        except OSError:
+            entries.append({"name": name, "is_dir": None, "size": None, "mtime": None})
+    next_offset = offset + limit if offset + limit < len(names) else None
+    return {"path": path, "total": len(names), "offset": offset, "next_offset": next_offset, "entries": entries}
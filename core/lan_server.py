@@ -0,0 +1,154 @@
+# core/lan_server.py
+"""
+Cổng điều khiển trực tiếp trong LAN: controller cùng mạng gửi command thẳng
+tới agent thay vì qua relay (bớt hai chặng internet cho mỗi lệnh/ảnh).
+Relay vẫn chạy song song làm đường dự phòng.
+
+    ws://<agent>:<lan_port>/ws?token=<token>[&codec=msgpack&compress=deflate]
+    POST http://<agent>:<lan_port>/command   (Authorization: Bearer <token>)
+
+Frame giống hệt relay: {"type": "command", "data": {...}}, {"type": "ping"}.
+Token = Config().lan_token() (HMAC của device_id bằng lan_secret trong config);
+log chỉ in fingerprint của token. Mặc định chỉ nghe trên loopback — đặt
+lan_host = "0.0.0.0" trong config để mở cho cả LAN.
+"""
+import asyncio
+import base64
+import hmac
+import threading
+from core.config import Config, CONFIG_PATH
+from core.metrics import metrics
+from core.protocol import Codec, OPCODE_TEXT, supported_codecs, PROTOCOL_VERSION
+
+SEND_TIMEOUT = 30.0          # worker chờ tối đa bấy nhiêu giây khi client LAN đọc chậm
+HTTP_RESULT_TIMEOUT = 120.0
+CLOSE_UNAUTHORIZED = 4401
+
+
+def _authorized(token):
+    return bool(token) and hmac.compare_digest(token, Config().lan_token())
+
+
+def _bearer(request_or_ws):
+    header = request_or_ws.headers.get("authorization", "")
+    if header.lower().startswith("bearer "):
+        return header[7:].strip()
+    return request_or_ws.query_params.get("token")
+
+
+def _jsonable(payload):
+    """bytes -> base64 để trả qua HTTP JSON."""
+    return {k: base64.b64encode(v).decode() if isinstance(v, (bytes, bytearray)) else v
+            for k, v in payload.items()}
+
+
+def create_app(handler):
+    from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+
+    app = FastAPI()
+    cfg = Config()
+
+    @app.get("/info")
+    def info(request: Request):
+        if not _authorized(_bearer(request)):
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return {"device_id": cfg.device_id, "protocol": PROTOCOL_VERSION, "codecs": supported_codecs()}
+
+    @app.post("/command")
+    async def command(request: Request):
+        if not _authorized(_bearer(request)):
+            raise HTTPException(status_code=401, detail="Invalid token")
+        message = await request.json()
+        if "data" not in message:
+            message = {"type": "command", "data": message}
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def reply(payload):
+            # chỉ trả kết quả cuối; chunk stream ("running") bị bỏ qua
+            if payload.get("status") != "running":
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(payload))
+
+        metrics.inc("agent_lan_commands_total")
+        handler.enqueue_command(message, reply=reply)
+        try:
+            return _jsonable(await asyncio.wait_for(done, HTTP_RESULT_TIMEOUT))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Command timed out")
+
+    @app.websocket("/ws")
+    async def control(ws: WebSocket):
+        if not _authorized(_bearer(ws)):
+            await ws.close(code=CLOSE_UNAUTHORIZED)
+            return
+        await ws.accept()
+        loop = asyncio.get_running_loop()
+        requested = ws.query_params.get("codec", "json").split(",")
+        codec = Codec(next((c for c in requested if c in supported_codecs()), "json"),
+                      compress=ws.query_params.get("compress") == "deflate")
+        closed = threading.Event()
+        print(f"🏠 LAN controller connected: {ws.client.host if ws.client else '?'} ({codec.name})")
+
+        async def send(payload):
+            data, opcode = codec.encode(payload)
+            if opcode == OPCODE_TEXT:
+                await ws.send_text(data)
+            else:
+                await ws.send_bytes(data)
+            metrics.inc("agent_ws_bytes_out_total", len(data))
+
+        def reply(payload):
+            # gọi từ worker thread; chờ gửi xong để client chậm tạo backpressure cho lệnh stream
+            if closed.is_set():
+                return False
+            try:
+                asyncio.run_coroutine_threadsafe(send(payload), loop).result(SEND_TIMEOUT)
+                return True
+            except Exception as e:
+                print(f"⚠️ LAN send failed: {e}")
+                return False
+
+        await send({"type": "protocol", "codec": codec.name, "compress": "deflate" if codec.compress else None})
+        try:
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                raw = message.get("text") if message.get("text") is not None else message.get("bytes")
+                metrics.inc("agent_ws_bytes_in_total", len(raw))
+                data = codec.decode(raw)
+                msg_type = data.get("type")
+                if msg_type == "command":
+                    metrics.inc("agent_lan_commands_total")
+                    handler.enqueue_command(data, reply=reply)
+                elif msg_type == "ping":
+                    await send({"type": "pong", "ts": data.get("ts")})
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            print(f"⚠️ LAN connection error: {e}")
+        finally:
+            closed.set()
+            print("👋 LAN controller disconnected")
+
+    return app
+
+
+def start_lan_server(handler, port, host=None):
+    """Chạy server LAN trên thread nền. port = 0 -> tắt. host mặc định lấy từ Config().lan_host."""
+    if not port:
+        return None
+    cfg = Config()
+    host = host or cfg.lan_host
+    try:
+        import uvicorn
+        app = create_app(handler)
+    except ImportError as e:
+        print(f"⚠️ LAN control disabled — missing dependency: {e.name}")
+        return None
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="lan-server", daemon=True).start()
+    print(f"🏠 LAN control on ws://{host}:{port}/ws (token fingerprint {cfg.lan_token_fingerprint()},"
+          f" lan_secret in {CONFIG_PATH})")
+    return server
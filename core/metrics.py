@@ -0,0 +1,169 @@
+# core/metrics.py
+import bisect
+import threading
+import time
+
+# mốc bucket (giây) — đủ chi tiết cho cả lệnh vài ms lẫn shell chạy vài phút
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRICS_HOST = "127.0.0.1"      # /metrics chỉ mở cho máy local
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # ô cuối là +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Ước lượng quantile từ bucket (nội suy tuyến tính trong bucket)."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank, seen = q * self.count, 0
+            for i, n in enumerate(self.counts):
+                if seen + n >= rank and n:
+                    lower = self.buckets[i - 1] if i else 0.0
+                    upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                    return lower + (upper - lower) * (rank - seen) / n
+                seen += n
+            return self.buckets[-1]
+
+    def snapshot(self):
+        p50, p99 = self.quantile(0.5), self.quantile(0.99)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+        }
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Metrics:
+    """
+    Registry metric trong process. Tên metric kiểu Prometheus, label là một
+    tuple (key, value) cố định. Gauge là callable được đọc khi snapshot.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def histogram(self, name, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            return self._histograms[key]
+
+    def counter(self, name, **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._counters:
+                self._counters[key] = Counter()
+            return self._counters[key]
+
+    def gauge(self, name, getter):
+        with self._lock:
+            self._gauges[name] = getter
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        self.counter(name, **labels).inc(amount)
+
+    # --------------------------------------------------
+
+    def _read_gauges(self):
+        values = {}
+        for name, getter in list(self._gauges.items()):
+            try:
+                values[name] = getter()
+            except Exception:
+                values[name] = None
+        return values
+
+    def snapshot(self):
+        """Dạng dict cho lệnh get_agent_stats."""
+        result = {"uptime_s": round(time.time() - self.started_at, 1), "histograms": {}, "counters": {}}
+        for (name, labels), hist in list(self._histograms.items()):
+            result["histograms"].setdefault(name, {})[_label_key(labels)] = hist.snapshot()
+        for (name, labels), counter in list(self._counters.items()):
+            result["counters"].setdefault(name, {})[_label_key(labels)] = counter.value
+        result["gauges"] = self._read_gauges()
+        return result
+
+    def render_prometheus(self):
+        lines = []
+        for (name, labels), hist in sorted(self._histograms.items()):
+            cumulative = 0
+            for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(labels)} {hist.sum}")
+            lines.append(f"{name}_count{_label_text(labels)} {hist.count}")
+        for (name, labels), counter in sorted(self._counters.items()):
+            lines.append(f"{name}{_label_text(labels)} {counter.value}")
+        for name, value in sorted(self._read_gauges().items()):
+            if value is not None:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return ",".join(f"{k}={v}" for k, v in labels) or "all"
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def serve_metrics(port, host=METRICS_HOST):
+    """Chạy /metrics (FastAPI + uvicorn) trên thread nền. port = 0 -> tắt."""
+    if not port:
+        return None
+    try:
+        import uvicorn
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse
+    except ImportError as e:
+        print(f"⚠️ /metrics disabled — missing dependency: {e.name}")
+        return None
+
+    app = FastAPI()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def prometheus():
+        return metrics.render_prometheus()
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="metrics-http", daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,215 @@
+# core/process_sampler.py
+import heapq
+import threading
+import time
+import psutil
+from core.config import Config
+
+IDLE_TIMEOUT = 60.0         # không ai đọc bảng trong khoảng này thì sampler tự dừng
+CHANGE_THRESHOLD = 0.5      # cpu/memory (%) đổi ít hơn mức này (so với lần đã gửi) thì không coi là "changed"
+SORT_KEYS = ("cpu", "memory", "pid", "name")
+DEFAULT_LEASE = 600.0       # subscription hết hạn nếu controller không subscribe lại để gia hạn
+MAX_LEASE = 3600.0
+
+
+class ProcessSubscription:
+    """
+    Một subscriber của bảng process. `sent` là bảng controller đang có (lần
+    gửi thành công gần nhất), nên thay đổi nhỏ dồn qua nhiều lần quét vẫn
+    được báo khi tổng vượt CHANGE_THRESHOLD.
+    """
+
+    def __init__(self, sub_id, callback, lease):
+        self.id = sub_id
+        self.callback = callback
+        self.sent = {}              # pid -> info đã gửi
+        self.renew(lease)
+
+    def renew(self, lease):
+        self.expires = time.monotonic() + lease
+
+    def delta(self, table):
+        return {
+            "added": [info for pid, info in table.items() if pid not in self.sent],
+            "removed": [pid for pid in self.sent if pid not in table],
+            "changed": [info for pid, info in table.items()
+                        if pid in self.sent and _is_changed(self.sent[pid], info)],
+        }
+
+    def commit(self, diff):
+        for info in diff["added"] + diff["changed"]:
+            self.sent[info["pid"]] = info
+        for pid in diff["removed"]:
+            self.sent.pop(pid, None)
+
+
+class ProcessSampler:
+    """
+    Giữ bảng process "nóng" trong bộ nhớ. Các đối tượng psutil.Process được
+    giữ lại giữa các lần quét nên cpu_percent là delta thật giữa hai lần,
+    không phải 0.0 như khi gọi process_iter lạnh.
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.table = {}             # pid -> dict thông tin
+        self.updated_at = 0.0
+        self._procs = {}            # pid -> psutil.Process (giữ để tính cpu delta)
+        self._subscribers = {}      # id -> ProcessSubscription
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._last_read = time.monotonic()
+        self._thread = None
+
+    # --------------------------------------------------
+
+    def ensure_running(self):
+        with self._lock:
+            self._last_read = time.monotonic()
+            if self._thread and self._thread.is_alive():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="process-sampler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # lần quét đầu chỉ "mồi" cpu_percent; lần thứ hai mới có số liệu thật
+        self._sample()
+        time.sleep(min(self.interval, 0.5))
+        while True:
+            self._sample()
+            self._ready.set()
+            now = time.monotonic()
+            with self._lock:
+                for sub_id in [s.id for s in self._subscribers.values() if s.expires <= now]:
+                    print(f"📉 Process subscription {sub_id} expired")
+                    del self._subscribers[sub_id]
+                subs = list(self._subscribers.values())
+            for sub in subs:
+                self._push(sub)
+            with self._lock:
+                idle = time.monotonic() - self._last_read > IDLE_TIMEOUT
+                if idle and not self._subscribers:
+                    self._thread = None
+                    return
+            time.sleep(self.interval)
+
+    def _sample(self):
+        seen, new_table = {}, {}
+        for proc in psutil.process_iter():
+            pid = proc.pid
+            cached = self._procs.get(pid)
+            if cached is not None and cached.is_running():
+                proc = cached
+            try:
+                with proc.oneshot():
+                    seen[pid] = proc
+                    info = {
+                        "pid": pid,
+                        "name": proc.name(),
+                        "user": _safe(proc.username),
+                        "cpu": round(_safe(lambda: proc.cpu_percent(None), 0.0), 2),
+                        "memory": round(_safe(proc.memory_percent, 0.0), 2),
+                    }
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                seen.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+            new_table[pid] = info
+
+        self._procs = seen
+        self.table = new_table
+        self.updated_at = time.time()
+
+    def _push(self, sub):
+        diff = sub.delta(self.table)
+        if not (diff["added"] or diff["removed"] or diff["changed"]):
+            return
+        try:
+            sent = sub.callback(diff)
+        except Exception as e:
+            print(f"⚠️ Process subscriber failed: {e}")
+            sent = False
+        # baseline chỉ đổi khi đã gửi: diff hỏng được gửi lại ở lần quét sau
+        if sent is not False:
+            sub.commit(diff)
+
+    # --------------------------------------------------
+    # Đọc bảng
+    # --------------------------------------------------
+
+    def query(self, top=30, sort="cpu", name=None, user=None, offset=0, limit=None, timeout=5.0):
+        """
+        Trả về (total, top_processes, page) từ bảng hiện tại.
+        top dùng heap (O(n log top)), page là danh sách đã lọc theo pid.
+        """
+        self.ensure_running()
+        self._ready.wait(timeout)
+        rows = list(self.table.values())
+        if name:
+            needle = name.lower()
+            rows = [r for r in rows if r["name"] and needle in r["name"].lower()]
+        if user:
+            rows = [r for r in rows if r["user"] == user]
+
+        sort = sort if sort in SORT_KEYS else "cpu"
+        reverse = sort in ("cpu", "memory")
+        key = (lambda r: (r[sort] or "")) if sort == "name" else (lambda r: r[sort])
+        if reverse:
+            top_rows = heapq.nlargest(top, rows, key=key)
+        else:
+            top_rows = heapq.nsmallest(top, rows, key=key)
+
+        rows.sort(key=lambda r: r["pid"])
+        end = offset + limit if limit is not None else None
+        return len(rows), top_rows, rows[offset:end]
+
+    def subscribe(self, sub_id, callback, lease=None, baseline=()):
+        """
+        callback(diff) được gọi sau mỗi lần quét có thay đổi so với lần đã gửi, với
+        {added, removed, changed}; trả False nếu gửi hỏng. baseline: các dòng process
+        controller vừa nhận (snapshot). Subscribe lại cùng sub_id để gia hạn lease.
+        """
+        lease = max(self.interval, min(float(lease or DEFAULT_LEASE), MAX_LEASE))
+        with self._lock:
+            sub = self._subscribers.get(sub_id)
+            if sub is None:
+                sub = self._subscribers[sub_id] = ProcessSubscription(sub_id, callback, lease)
+            else:
+                sub.callback = callback
+                sub.renew(lease)
+            sub.sent = {info["pid"]: info for info in baseline}
+        self.ensure_running()
+        return sub
+
+    def unsubscribe(self, sub_id):
+        with self._lock:
+            return self._subscribers.pop(sub_id, None) is not None
+
+
+def _safe(getter, default=None):
+    try:
+        return getter()
+    except (psutil.AccessDenied, psutil.ZombieProcess):
+        return default
+
+
+def _is_changed(old, new):
+    return (
+        abs(old["cpu"] - new["cpu"]) >= CHANGE_THRESHOLD
+        or abs(old["memory"] - new["memory"]) >= CHANGE_THRESHOLD
+        or old["name"] != new["name"]
+    )
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> ProcessSampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = ProcessSampler(interval=Config().process_sample_interval)
+        return _sampler
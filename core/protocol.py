@@ -0,0 +1,152 @@
+# core/protocol.py
+import json
+import struct
+import zlib
+try:
+    import msgpack
+except ImportError:  # msgpack là tuỳ chọn — thiếu thì chỉ dùng JSON
+    msgpack = None
+
+# Binary frame: [4 byte big-endian độ dài header][header JSON utf-8][payload bytes]
+HEADER_LEN = struct.Struct(">I")
+BINARY_TYPES = (bytes, bytearray, memoryview)
+# blob của binary frame controller -> agent luôn được đưa vào data[BINARY_FIELD]
+# của command, bất kể controller đặt binary_field là gì
+BINARY_FIELD = "binary"
+
+
+def pack_binary_frame(header: dict, blob) -> bytes:
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"".join((HEADER_LEN.pack(len(encoded)), encoded, blob))
+
+
+def unpack_binary_frame(frame):
+    """Trả về (header dict, payload bytes)."""
+    frame = memoryview(frame)
+    (size,) = HEADER_LEN.unpack_from(frame)
+    start = HEADER_LEN.size
+    header = json.loads(bytes(frame[start:start + size]).decode("utf-8"))
+    return header, bytes(frame[start + size:])
+
+
+def split_binary(payload: dict):
+    """
+    Tách field bytes (nếu có) khỏi payload để gửi dạng binary frame.
+    Trả về (header, blob) — blob là None nếu payload không chứa bytes.
+    Header ghi lại tên field qua "binary_field" để phía controller ghép lại.
+    """
+    for key, value in payload.items():
+        if isinstance(value, BINARY_TYPES):
+            header = {k: v for k, v in payload.items() if k != key}
+            header["binary_field"] = key
+            header["size"] = len(value)
+            return header, value
+    return payload, None
+
+
+# ===== Codec (thương lượng lúc connect) =====
+# Agent gửi ?proto=2&codec=msgpack&compress=deflate&acks=1 trong URI; server xác nhận
+# bằng frame {"type": "protocol", "codec": ..., "compress": ..., "acks": true}. Trước khi
+# nhận xác nhận (hoặc server cũ không hiểu) agent dùng JSON như v1 và không dùng
+# result outbox — chỉ server báo "acks": true mới ack result_seq.
+#
+# Frame msgpack: [1 byte flag][envelope msgpack nếu có FLAG_ENVELOPE][body].
+# FLAG_DEFLATE: body đã nén zlib. FLAG_ENVELOPE: trước body có một map nhỏ
+# (to/client_id/agent_id) không nén — body chỉ cần serialize/nén một lần
+# cho mọi controller, và relay đọc được địa chỉ mà không phải giải nén body.
+# websocket-client không hỗ trợ extension permessage-deflate nên việc nén
+# được làm ở tầng ứng dụng, chỉ với frame lớn hơn COMPRESS_THRESHOLD.
+PROTOCOL_VERSION = 2
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 1          # nén nhanh; ảnh jpeg/png hầu như không nén thêm được
+FLAG_PLAIN = 0x00
+FLAG_DEFLATE = 0x01
+FLAG_ENVELOPE = 0x02
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+
+
+def supported_codecs():
+    return ["msgpack", "json"] if msgpack else ["json"]
+
+
+def negotiation_query():
+    """Query string quảng bá các codec agent hỗ trợ."""
+    return f"proto={PROTOCOL_VERSION}&codec={','.join(supported_codecs())}&compress=deflate&acks=1"
+
+
+class Codec:
+    def __init__(self, name="json", compress=False):
+        if name == "msgpack" and msgpack is None:
+            name = "json"
+        self.name = name
+        self.compress = compress
+
+    def encode(self, payload: dict):
+        """Trả về (data, opcode) sẵn sàng cho ws.send."""
+        if self.name == "msgpack":
+            body = msgpack.packb(payload, use_bin_type=True)
+            if self.compress and len(body) > COMPRESS_THRESHOLD:
+                packed = zlib.compress(body, COMPRESS_LEVEL)
+                if len(packed) < len(body):
+                    return bytes((FLAG_DEFLATE,)) + packed, OPCODE_BINARY
+            return bytes((FLAG_PLAIN,)) + body, OPCODE_BINARY
+
+        header, blob = split_binary(payload)
+        if blob is None:
+            return json.dumps(payload), OPCODE_TEXT
+        return pack_binary_frame(header, blob), OPCODE_BINARY
+
+    def encode_fanout(self, payload: dict, envelopes):
+        """
+        Encode payload một lần rồi ghép envelope riêng cho từng người nhận.
+        Yield (data, opcode) theo thứ tự envelopes. Key trong payload ghi đè envelope.
+        """
+        envelopes = [{k: v for k, v in env.items() if k not in payload} for env in envelopes]
+        if self.name == "msgpack":
+            body = msgpack.packb(payload, use_bin_type=True)
+            flag = FLAG_ENVELOPE
+            if self.compress and len(body) > COMPRESS_THRESHOLD:
+                packed = zlib.compress(body, COMPRESS_LEVEL)
+                if len(packed) < len(body):
+                    body, flag = packed, flag | FLAG_DEFLATE
+            for env in envelopes:
+                yield b"".join((bytes((flag,)), msgpack.packb(env, use_bin_type=True), body)), OPCODE_BINARY
+            return
+
+        header, blob = split_binary(payload)
+        body = json.dumps(header)
+        for env in envelopes:
+            if not env:
+                merged = body
+            elif body == "{}":
+                merged = json.dumps(env)
+            else:
+                merged = json.dumps(env)[:-1] + ", " + body[1:]
+            if blob is None:
+                yield merged, OPCODE_TEXT
+            else:
+                encoded = merged.encode("utf-8")
+                yield b"".join((HEADER_LEN.pack(len(encoded)), encoded, blob)), OPCODE_BINARY
+
+    def decode(self, message):
+        if isinstance(message, str):
+            return json.loads(message)
+        if self.name == "msgpack":
+            flag, body = message[0], memoryview(message)[1:]
+            envelope = {}
+            if flag & FLAG_ENVELOPE:
+                unpacker = msgpack.Unpacker(raw=False)
+                unpacker.feed(body)
+                envelope = unpacker.unpack()
+                body = body[unpacker.tell():]
+            if flag & FLAG_DEFLATE:
+                body = zlib.decompress(body)
+            return {**envelope, **msgpack.unpackb(body, raw=False)}
+        header, blob = unpack_binary_frame(message)
+        field = header.pop("binary_field", None)
+        if field:
+            header.pop("size", None)
+            # không ghi đè field đã có (vd. binary_field "data" trùng dict command)
+            header[field if field not in header else BINARY_FIELD] = blob
+        return header
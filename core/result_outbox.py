@@ -0,0 +1,153 @@
+# core/result_outbox.py
+import os
+import struct
+import threading
+import time
+from core.protocol import Codec, OPCODE_TEXT
+
+OUTBOX_PATH = os.path.join(os.path.expanduser("~"), ".window_manager_agent", "result_outbox.log")
+MAX_BYTES = 32 * 1024 * 1024     # quá dung lượng này thì bỏ kết quả cũ nhất
+MAX_AGE = 24 * 3600              # giây — kết quả chưa ack quá lâu thì bỏ
+COMPACT_RATIO = 0.5              # phần đã ack chiếm hơn tỉ lệ này của file thì ghi lại file
+
+# Record: [seq u64][thời điểm f64][loại u8][độ dài u32][data]
+# loại 1 = text JSON, 2 = binary frame (xem core.protocol);
+# 3 = mốc seq (giữ seq tăng tiếp sau khi compact), 4 = ack cộng dồn tới seq. Hai loại cuối không có data.
+RECORD = struct.Struct(">QdBI")
+KIND_TEXT, KIND_BINARY, KIND_SEQ, KIND_ACK = 1, 2, 3, 4
+
+
+class ResultOutbox:
+    """
+    Log append-only cho kết quả command: mỗi kết quả nhận một seq tăng dần và
+    được ghi xuống đĩa trước khi gửi. Server ack (cộng dồn) theo seq thì xoá;
+    sau khi kết nối lại, các kết quả chưa ack được gửi lại theo đúng thứ tự.
+    """
+
+    def __init__(self, path=OUTBOX_PATH, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.codec = Codec("json")
+        self.lock = threading.RLock()
+
+        self._records = []          # [(seq, created, kind, data)] chưa ack, theo thứ tự
+        self._pending_bytes = 0
+        self._file_bytes = 0
+        self.last_seq = 0
+        self.acked_seq = 0
+        self.dropped = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._load()
+        self._file = open(self.path, "ab")
+
+    # --------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return
+        offset = 0
+        while offset + RECORD.size <= len(blob):
+            seq, created, kind, size = RECORD.unpack_from(blob, offset)
+            start = offset + RECORD.size
+            if start + size > len(blob):
+                break  # record ghi dở khi tắt máy — bỏ phần đuôi
+            if kind == KIND_ACK:
+                self.acked_seq = max(self.acked_seq, seq)
+            else:
+                self.last_seq = max(self.last_seq, seq)
+                if kind != KIND_SEQ:
+                    self._records.append((seq, created, kind, blob[start:start + size]))
+            offset = start + size
+        self._records = [r for r in self._records if r[0] > self.acked_seq]
+        self._pending_bytes = sum(len(r[3]) for r in self._records)
+        self._file_bytes = offset
+        if offset != len(blob):
+            self._rewrite()
+        if self._records:
+            print(f"📦 Result outbox: {len(self._records)} unacked result(s) to replay")
+
+    def _rewrite(self):
+        """Ghi lại file chỉ với các record chưa ack (+ một record mốc seq)."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(RECORD.pack(self.last_seq, time.time(), KIND_SEQ, 0))
+            for seq, created, kind, data in self._records:
+                f.write(RECORD.pack(seq, created, kind, len(data)))
+                f.write(data)
+        if getattr(self, "_file", None):
+            self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._file_bytes = RECORD.size + sum(RECORD.size + len(r[3]) for r in self._records)
+
+    def _enforce_limits(self):
+        cutoff = time.time() - self.max_age
+        dropped = 0
+        while self._records and (
+            self._pending_bytes > self.max_bytes or self._records[0][1] < cutoff
+        ):
+            _, _, _, data = self._records.pop(0)
+            self._pending_bytes -= len(data)
+            dropped += 1
+        if dropped:
+            self.dropped += dropped
+            print(f"⚠️ Result outbox full/expired — dropped {dropped} oldest result(s)")
+        return dropped
+
+    # --------------------------------------------------
+
+    def append(self, payload: dict):
+        """Gán seq, ghi xuống đĩa và trả về (seq, payload có result_seq)."""
+        with self.lock:
+            self.last_seq += 1
+            payload = {**payload, "result_seq": self.last_seq}
+            data, opcode = self.codec.encode(payload)
+            if opcode == OPCODE_TEXT:
+                kind, data = KIND_TEXT, data.encode("utf-8")
+            else:
+                kind = KIND_BINARY
+            created = time.time()
+            self._file.write(RECORD.pack(self.last_seq, created, kind, len(data)))
+            self._file.write(data)
+            self._file.flush()
+            self._file_bytes += RECORD.size + len(data)
+            self._records.append((self.last_seq, created, kind, data))
+            self._pending_bytes += len(data)
+            if self._enforce_limits():
+                self._rewrite()
+            return self.last_seq, payload
+
+    def ack(self, seq: int):
+        """Ack cộng dồn: mọi kết quả có seq <= seq đã tới nơi."""
+        with self.lock:
+            if seq <= self.acked_seq:
+                return
+            self.acked_seq = seq
+            while self._records and self._records[0][0] <= seq:
+                self._pending_bytes -= len(self._records.pop(0)[3])
+            if not self._records or self._pending_bytes < self._file_bytes * COMPACT_RATIO:
+                self._rewrite()
+            else:
+                self._file.write(RECORD.pack(seq, time.time(), KIND_ACK, 0))
+                self._file.flush()
+                self._file_bytes += RECORD.size
+
+    def pending(self, after=0):
+        """List (seq, payload) chưa ack có seq > after, theo thứ tự."""
+        with self.lock:
+            self._enforce_limits()
+            records = [r for r in self._records if r[0] > after]
+        result = []
+        for seq, _, kind, data in records:
+            message = data.decode("utf-8") if kind == KIND_TEXT else data
+            result.append((seq, self.codec.decode(message)))
+        return result
+
+    def __len__(self):
+        with self.lock:
+            return len(self._records)
@@ -0,0 +1,205 @@
+# core/screen_stream.py
+import base64
+import queue
+import threading
+import time
+from io import BytesIO
+import pyautogui
+from PIL import Image, ImageChops
+
+DEFAULT_FPS = 10
+MIN_FPS = 1
+DEFAULT_QUALITY = 60
+DEFAULT_TILE_SIZE = 128
+KEYFRAME_INTERVAL = 10      # giây — gửi full frame định kỳ cho controller mới vào
+SEND_QUEUE_SIZE = 2         # số frame chờ gửi; đầy nghĩa là socket không theo kịp
+FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+
+class ScreenStreamer:
+    """
+    Chụp màn hình liên tục, chia thành tile và chỉ gửi các tile thay đổi
+    so với frame đã gửi trước đó. FPS tự giảm khi hàng đợi gửi bị dồn.
+
+    binary=True: bytes của mọi tile được nối thành một field "data" duy nhất
+    (binary frame JSON chỉ mang được một field bytes), mỗi tile ghi
+    offset/size trong đó. binary=False: mỗi tile mang "data" base64 như cũ.
+    Stream tự dừng khi emit báo gửi hỏng — kết nối đã đóng hoặc relay không
+    còn controller nào để nhận.
+    """
+
+    def __init__(self, emit, fps=DEFAULT_FPS, quality=DEFAULT_QUALITY,
+                 tile_size=DEFAULT_TILE_SIZE, fmt="jpeg", max_width=None, binary=True):
+        self.emit = emit
+        self.binary = binary
+        self.target_fps = max(MIN_FPS, float(fps))
+        self.fps = self.target_fps
+        self.quality = int(quality)
+        self.tile_size = int(tile_size)
+        self.format = FORMATS.get(str(fmt).lower(), "JPEG")
+        self.max_width = max_width
+
+        self._send_queue = queue.Queue(maxsize=SEND_QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._prev = None
+        self._frame_no = 0
+        self._last_keyframe = 0.0
+        self.stats = {"frames": 0, "dropped": 0, "tiles": 0, "bytes": 0}
+
+    def start(self):
+        threading.Thread(target=self._capture_loop, name="screen-capture", daemon=True).start()
+        threading.Thread(target=self._send_loop, name="screen-send", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._send_queue.put(None)
+
+    # --------------------------------------------------
+
+    def _grab(self):
+        image = pyautogui.screenshot().convert("RGB")
+        if self.max_width and image.width > self.max_width:
+            height = int(image.height * self.max_width / image.width)
+            image = image.resize((int(self.max_width), height), Image.BILINEAR)
+        return image
+
+    def _changed_tiles(self, image, keyframe):
+        ts = self.tile_size
+        if keyframe or self._prev is None or self._prev.size != image.size:
+            region = (0, 0, image.width, image.height)
+            diff = None
+        else:
+            diff = ImageChops.difference(image, self._prev)
+            region = diff.getbbox()
+            if region is None:
+                return []
+
+        left, top, right, bottom = region
+        tiles = []
+        for y in range(top - top % ts, bottom, ts):
+            for x in range(left - left % ts, right, ts):
+                box = (x, y, min(x + ts, image.width), min(y + ts, image.height))
+                if diff is not None and diff.crop(box).getbbox() is None:
+                    continue
+                tiles.append(box)
+        return tiles
+
+    def _encode_tile(self, image, box):
+        buffered = BytesIO()
+        image.crop(box).save(buffered, format=self.format, quality=self.quality)
+        return buffered.getvalue()
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+
+            if self._send_queue.full():
+                # socket đang chậm: bỏ frame này và hạ fps
+                self.stats["dropped"] += 1
+                self.fps = max(MIN_FPS, self.fps * 0.75)
+            else:
+                try:
+                    self._capture_frame()
+                except Exception as e:
+                    print(f"⚠️ Screen stream capture failed: {e}")
+                    self._stop.wait(1)
+                    continue
+                if self._send_queue.empty() and self.fps < self.target_fps:
+                    self.fps = min(self.target_fps, self.fps + 1)
+
+            delay = 1.0 / self.fps - (time.monotonic() - started)
+            if delay > 0:
+                self._stop.wait(delay)
+
+    def _capture_frame(self):
+        image = self._grab()
+        now = time.monotonic()
+        keyframe = now - self._last_keyframe >= KEYFRAME_INTERVAL
+        boxes = self._changed_tiles(image, keyframe)
+        if not boxes:
+            return
+        if keyframe:
+            self._last_keyframe = now
+
+        tiles, blobs, offset = [], [], 0
+        for box in boxes:
+            data = self._encode_tile(image, box)
+            self.stats["bytes"] += len(data)
+            tile = {"x": box[0], "y": box[1], "w": box[2] - box[0], "h": box[3] - box[1]}
+            if self.binary:
+                tile.update(offset=offset, size=len(data))
+                blobs.append(data)
+                offset += len(data)
+            else:
+                tile["data"] = base64.b64encode(data).decode("ascii")
+            tiles.append(tile)
+
+        self._prev = image
+        self._frame_no += 1
+        self.stats["frames"] += 1
+        self.stats["tiles"] += len(tiles)
+        frame = {
+            "type": "screen_frame",
+            "status": "running",
+            "frame": self._frame_no,
+            "keyframe": keyframe,
+            "width": image.width,
+            "height": image.height,
+            "format": self.format.lower(),
+            "fps": round(self.fps, 1),
+            "tiles": tiles,
+        }
+        if self.binary:
+            frame["data"] = b"".join(blobs)
+        self._send_queue.put(frame)
+
+    def _send_loop(self):
+        while True:
+            frame = self._send_queue.get()
+            if frame is None or self._stop.is_set():
+                return
+            try:
+                sent = self.emit(frame)
+            except Exception as e:
+                print(f"⚠️ Screen stream send failed: {e}")
+                sent = False
+            if sent is False:
+                # controller đã ngắt (hoặc relay không còn ai nhận): không chụp tiếp cho ai cả
+                print("🎥 Screen stream stopped — no one is receiving it")
+                self._stop.set()
+                _forget(self)
+                return
+
+
+_streamer = None
+_lock = threading.Lock()
+
+
+def start_stream(emit, **options):
+    """Bắt đầu stream (dừng stream cũ nếu đang chạy)."""
+    global _streamer
+    with _lock:
+        if _streamer:
+            _streamer.stop()
+        _streamer = ScreenStreamer(emit, **options)
+        _streamer.start()
+        return _streamer
+
+
+def _forget(streamer):
+    """Stream tự dừng: bỏ khỏi module nếu vẫn là stream hiện tại."""
+    global _streamer
+    with _lock:
+        if _streamer is streamer:
+            _streamer = None
+
+
+def stop_stream():
+    """Dừng stream hiện tại. Trả về stats của stream hoặc None nếu không có."""
+    global _streamer
+    with _lock:
+        if not _streamer:
+            return None
+        _streamer.stop()
+        stats, _streamer = _streamer.stats, None
+        return stats
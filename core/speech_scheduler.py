@@ -0,0 +1,99 @@
+# core/speech_scheduler.py
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from core.config import Config
+from core import tts_service
+
+OVERFLOW_POLICIES = ("drop_oldest", "merge", "skip")
+
+
+class SpeechScheduler:
+    """
+    Một worker phát âm duy nhất với hàng đợi có giới hạn, thay cho mỗi tin
+    chat một thread. Trong lúc đang phát câu hiện tại, câu kế tiếp được tổng
+    hợp trước (prefetch) trên một thread phụ duy nhất.
+
+    Khi hàng đợi đầy (max_queue), policy quyết định:
+      drop_oldest — bỏ câu cũ nhất đang chờ
+      merge       — gộp mọi câu đang chờ và câu mới thành một lượt đọc
+      skip        — bỏ qua câu mới
+    """
+
+    def __init__(self, max_queue=None, policy=None, voice_gender="FEMALE"):
+        cfg = Config()
+        self.max_queue = max_queue or cfg.speech_queue_size
+        policy = policy or cfg.speech_overflow_policy
+        self.policy = policy if policy in OVERFLOW_POLICIES else "drop_oldest"
+        self.voice_gender = voice_gender
+        self.dropped = 0
+
+        self._items = deque()
+        self._playing = False           # worker đang phát -> câu đầu hàng đợi cần prefetch
+        self._cond = threading.Condition()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-prefetch")
+        threading.Thread(target=self._run, name="speech-worker", daemon=True).start()
+
+    def say(self, text: str):
+        text = text.strip()
+        if not text:
+            return
+        with self._cond:
+            if len(self._items) >= self.max_queue:
+                if self.policy == "skip":
+                    self.dropped += 1
+                    return
+                if self.policy == "merge":
+                    merged = [item["text"] for item in self._items] + [text]
+                    self._cancel_all()
+                    self._items.append({"text": ". ".join(merged), "future": None})
+                    self._queued()
+                    return
+                oldest = self._items.popleft()
+                if oldest["future"]:
+                    oldest["future"].cancel()
+                self.dropped += 1
+            self._items.append({"text": text, "future": None})
+            self._queued()
+
+    def pending(self):
+        with self._cond:
+            return len(self._items)
+
+    def _cancel_all(self):
+        while self._items:
+            item = self._items.popleft()
+            if item["future"]:
+                item["future"].cancel()
+
+    def _queued(self):
+        """Gọi khi giữ _cond: báo worker; câu tới lúc đang phát thì tổng hợp trước ngay."""
+        self._cond.notify()
+        if self._playing:
+            self._prefetch(self._items[0])
+
+    def _prefetch(self, item):
+        if item["future"] is None:
+            item["future"] = self._prefetcher.submit(tts_service.synthesize, item["text"], self.voice_gender)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                item = self._items.popleft()
+                self._playing = True
+                if self._items:
+                    self._prefetch(self._items[0])
+
+            try:
+                if item["future"] is None:
+                    # chưa prefetch — phát dạng stream (bắt đầu đọc khi đang tải)
+                    tts_service.synthesize_and_play(item["text"], voice_gender=self.voice_gender)
+                else:
+                    tts_service.play_file(item["future"].result())
+            except Exception as e:
+                print(f"❌ Lỗi TTS: {e}")
+            finally:
+                with self._cond:
+                    self._playing = False
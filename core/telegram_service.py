@@ -1,8 +1,256 @@
 # core/telegram_service.py
-import requests
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
 from core.config import Config
+from core.metrics import metrics
+
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".window_manager_agent")
+OUTBOX_PATH = os.path.join(DATA_DIR, "telegram_outbox.json")
+SPOOL_DIR = os.path.join(DATA_DIR, "telegram_spool")
+
+COALESCE_WINDOW = 1.0        # giây chờ gom các tin ngắn liên tiếp thành một
+SHORT_MESSAGE = 500          # tin dài hơn thì gửi riêng
+MAX_MESSAGE_CHARS = 4000     # Telegram giới hạn 4096 ký tự/tin
+MIN_INTERVAL = 1.0           # Telegram: ~1 tin/giây cho mỗi chat
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MAX_PENDING = 500            # quá số này thì bỏ tin cũ nhất
+REQUEST_TIMEOUT = (5, 30)    # (connect, read)
+
+
+class TelegramOutbox:
+    """
+    Hàng đợi gửi Telegram chạy nền: một session keep-alive, gom tin ngắn,
+    tôn trọng rate limit / retry_after, retry có backoff và lưu tin chưa gửi
+    xuống đĩa để gửi tiếp sau khi khởi động lại.
+    """
+
+    def __init__(self, api_base=None, outbox_path=OUTBOX_PATH, spool_dir=SPOOL_DIR):
+        self.cfg = Config()
+        self.api_base = (api_base or self.cfg.telegram_api_base).rstrip("/")
+        self.outbox_path = outbox_path
+        self.spool_dir = spool_dir
+        import requests  # chỉ cần khi outbox thật sự được tạo (lần gửi đầu tiên)
+        self.session = requests.Session()
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._next_allowed = 0.0
+        self.sent = 0
+        self.failed = 0
+
+        self._load()
+        threading.Thread(target=self._run, name="telegram-outbox", daemon=True).start()
+
+    # --------------------------------------------------
+    # API cho TelegramService
+    # --------------------------------------------------
+
+    def put_text(self, text: str):
+        self._put({"kind": "text", "text": text})
+
+    def put_photo(self, photo):
+        """photo: đường dẫn file hoặc bytes ảnh đã encode"""
+        if isinstance(photo, (bytes, bytearray)):
+            os.makedirs(self.spool_dir, exist_ok=True)
+            path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.img")
+            with open(path, "wb") as f:
+                f.write(photo)
+            self._put({"kind": "photo", "path": path, "spooled": True})
+        else:
+            self._put({"kind": "photo", "path": photo, "spooled": False})
+
+    def depth(self):
+        with self._cond:
+            return len(self._items)
+
+    def flush(self, timeout=10.0):
+        """Chờ tới khi outbox rỗng (dùng khi tắt app / đo đạc). Trả True nếu đã rỗng."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, 0.1))
+            return True
+
+    # --------------------------------------------------
+
+    def _put(self, item):
+        item.update({"created": time.time(), "attempts": 0})
+        with self._cond:
+            self._items.append(item)
+            while len(self._items) > MAX_PENDING:
+                self._discard(self._items.popleft())
+            self._save()
+            self._cond.notify_all()
+
+    def _discard(self, item):
+        if item.get("spooled"):
+            try:
+                os.remove(item["path"])
+            except OSError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.outbox_path, "r", encoding="utf-8") as f:
+                self._items.extend(json.load(f))
+            if self._items:
+                print(f"📨 Telegram outbox: resuming {len(self._items)} pending item(s)")
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        """Ghi toàn bộ hàng đợi (gọi khi đang giữ _cond)."""
+        try:
+            os.makedirs(os.path.dirname(self.outbox_path), exist_ok=True)
+            tmp_path = self.outbox_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._items), f, ensure_ascii=False)
+            os.replace(tmp_path, self.outbox_path)
+        except OSError as e:
+            print(f"⚠️ Telegram outbox save failed: {e}")
+
+    def _next_batch(self):
+        """Lấy item đầu hàng; nếu là tin ngắn thì gom thêm các tin ngắn liền sau."""
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            first = self._items[0]
+            if first["kind"] != "text" or len(first["text"]) > SHORT_MESSAGE:
+                return [first]
+
+            # chờ hết cửa sổ gom tính từ lúc tin đầu tiên vào hàng
+            if first["attempts"] == 0:
+                deadline = first["created"] + COALESCE_WINDOW
+                while time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+
+            batch, size = [], 0
+            for item in self._items:
+                if item["kind"] != "text" or len(item["text"]) > SHORT_MESSAGE:
+                    break
+                if batch and size + len(item["text"]) + 1 > MAX_MESSAGE_CHARS:
+                    break
+                batch.append(item)
+                size += len(item["text"]) + 1
+            return batch
+
+    def _request(self, item):
+        url = f"{self.api_base}/bot{self.cfg.telegram_token}"
+        if item["kind"] == "text":
+            return self.session.post(
+                f"{url}/sendMessage",
+                json={"chat_id": self.cfg.telegram_chat_id, "text": item["text"][:MAX_MESSAGE_CHARS]},
+                timeout=REQUEST_TIMEOUT,
+            )
+        with open(item["path"], "rb") as photo:
+            return self.session.post(
+                f"{url}/sendPhoto",
+                data={"chat_id": self.cfg.telegram_chat_id},
+                files={"photo": photo},
+                timeout=REQUEST_TIMEOUT,
+            )
+
+    def _finish(self, batch, delivered):
+        with self._cond:
+            for item in batch:
+                try:
+                    self._items.remove(item)
+                except ValueError:
+                    continue
+                if item["kind"] == "photo":
+                    self._discard(item)
+            if delivered:
+                self.sent += len(batch)
+            else:
+                self.failed += len(batch)
+            self._save()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) == 1:
+                item = batch[0]
+            else:
+                item = {"kind": "text", "text": "\n".join(i["text"] for i in batch)}
+
+            delay = self._next_allowed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_allowed = time.monotonic() + MIN_INTERVAL
+
+            if not self.cfg.telegram_token or not self.cfg.telegram_chat_id:
+                print("⚠️ Telegram chưa được cấu hình")
+                self._finish(batch, delivered=False)
+                continue
+
+            try:
+                response = self._request(item)
+            except FileNotFoundError:
+                self._finish(batch, delivered=False)
+                continue
+            except Exception as e:
+                print(f"❌ Telegram error: {e}")
+                self._retry_later(batch)
+                continue
+
+            if response.status_code == 429:
+                try:
+                    retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    retry_after = 1
+                print(f"⏳ Telegram rate limited — retry after {retry_after}s")
+                self._next_allowed = time.monotonic() + float(retry_after)
+            elif response.status_code >= 500:
+                print(f"❌ Telegram error: HTTP {response.status_code}")
+                self._retry_later(batch)
+            else:
+                if response.status_code >= 400:
+                    print(f"❌ Telegram rejected message: HTTP {response.status_code} {response.text[:200]}")
+                self._finish(batch, delivered=response.ok)
+
+    def _retry_later(self, batch):
+        attempts = max(item["attempts"] for item in batch) + 1
+        if attempts >= MAX_ATTEMPTS:
+            self._finish(batch, delivered=False)
+            return
+        with self._cond:
+            for item in batch:
+                item["attempts"] = attempts
+            self._save()
+        backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+        self._next_allowed = time.monotonic() + random.uniform(backoff / 2, backoff)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+# đọc từ biến toàn cục: chưa gửi gì thì không tạo outbox (và không import requests)
+metrics.gauge("agent_telegram_outbox_depth", lambda: _outbox.depth() if _outbox else 0)
+metrics.gauge("agent_telegram_sent_total", lambda: _outbox.sent if _outbox else 0)
+metrics.gauge("agent_telegram_failed_total", lambda: _outbox.failed if _outbox else 0)
+
+
+def get_outbox() -> TelegramOutbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = TelegramOutbox()
+        return _outbox
+
 
 class TelegramService:
+    """Giao diện cũ — giờ chỉ đẩy vào outbox chạy nền, không chặn người gọi."""
+
     def __init__(self):
         self.cfg = Config()
 
@@ -10,14 +258,10 @@ class TelegramService:
         if not self.cfg.telegram_token or not self.cfg.telegram_chat_id:
             print("⚠️ Telegram chưa được cấu hình")
             return
-        url = f"https://api.telegram.org/bot{self.cfg.telegram_token}/sendMessage"
-        payload = {"chat_id": self.cfg.telegram_chat_id, "text": text}
-        try:
-            requests.post(url, json=payload, timeout=5)
-        except Exception as e:
-            print(f"❌ Telegram error: {e}")
-
-    def send_telegram_photo(self, photo_path):
-        url = f"https://api.telegram.org/bot{self.cfg.telegram_token}/sendPhoto"
-        with open(photo_path, "rb") as photo:
-            requests.post(url, data={"chat_id": self.cfg.telegram_chat_id}, files={"photo": photo})
+        get_outbox().put_text(text)
+
+    def send_telegram_photo(self, photo):
+        """photo: đường dẫn file hoặc bytes ảnh đã encode"""
+        if not self.cfg.telegram_token or not self.cfg.telegram_chat_id:
+            return
+        get_outbox().put_photo(photo)
@@ -0,0 +1,267 @@
+# core/telemetry.py
+"""
+Stream số liệu hệ thống theo subscription, thay cho việc controller poll
+get_list_process / shell mỗi giây.
+
+  subscribe_metrics {metrics: ["cpu", "memory", ...], interval: 1.0,
+                     thresholds: {"cpu": 2.0}, subscription_id?, lease?}
+    -> {"type": "metrics_subscribed", subscription_id, ...}
+    -> nhiều frame {"type": "metrics_update", "status": "running",
+                    subscription_id, seq, full, values: {"cpu.percent": 12.5, ...}}
+  unsubscribe_metrics {subscription_id}
+
+Một sampler psutil dùng chung cho mọi subscriber, chỉ đo các nhóm đang có
+người nghe, chu kỳ = interval nhỏ nhất. Mỗi update chỉ chứa giá trị đổi quá
+ngưỡng so với lần *đã gửi* cho subscriber đó (key biến mất -> null); cứ
+KEYFRAME_INTERVAL giây gửi đủ một lần. Nếu update trước của subscriber còn
+đang gửi (socket chậm) thì bỏ update này — lần sau delta tự gộp phần đã bỏ.
+Subscription hết hạn sau `lease` giây; gửi lại subscribe_metrics cùng
+subscription_id để gia hạn / đổi cấu hình.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+from core.metrics import metrics
+
+METRIC_GROUPS = ("cpu", "per_cpu", "memory", "swap", "disk", "disk_io", "net")
+DEFAULT_GROUPS = ("cpu", "memory", "disk", "net")
+DEFAULT_INTERVAL = 1.0
+MIN_INTERVAL = 0.25
+KEYFRAME_INTERVAL = 60.0
+DEFAULT_LEASE = 600.0
+MAX_LEASE = 3600.0
+SEND_WORKERS = 4
+
+# ngưỡng mặc định theo nhóm: điểm % đổi tuyệt đối, tốc độ (*_bps) đổi tương đối
+THRESHOLDS = {
+    "cpu": 0.5,
+    "per_cpu": 2.0,
+    "memory": 0.5,
+    "swap": 0.5,
+    "disk": 0.1,
+    "disk_io": 0.05,        # 5% so với giá trị đã gửi
+    "net": 0.05,
+}
+RELATIVE_GROUPS = ("disk_io", "net")
+MIN_RATE_DELTA = 1024       # tốc độ (B/s) đổi ít hơn mức này thì bỏ qua dù tương đối lớn
+BYTES_THRESHOLD = 0.01      # dung lượng (memory.used, disk.free...) đổi tương đối
+
+
+def _round(value):
+    return round(value, 1) if isinstance(value, float) else value
+
+
+class Subscription:
+    def __init__(self, sub_id, emit, groups, interval, thresholds, lease):
+        self.id = sub_id
+        self.emit = emit
+        self.sent = {}              # giá trị controller đang có (lần gửi thành công gần nhất)
+        self.seq = 0
+        self.dropped = 0
+        self.sending = False
+        self.next_due = 0.0
+        self.last_keyframe = 0.0
+        self.configure(groups, interval, thresholds, lease)
+
+    def configure(self, groups, interval, thresholds, lease):
+        self.groups = groups
+        self.interval = interval
+        self.thresholds = {**THRESHOLDS, **thresholds}
+        self.expires = time.monotonic() + lease
+        self.last_keyframe = 0.0    # cấu hình mới -> gửi đủ ở lần tới
+
+    def _changed(self, key, old, new):
+        if old is None or new is None or isinstance(new, str):
+            return old != new
+        group = key.split(".", 1)[0]
+        threshold = self.thresholds.get(group, 0)
+        if group in RELATIVE_GROUPS:
+            return abs(new - old) >= max(MIN_RATE_DELTA, abs(old) * threshold)
+        if group in ("cpu", "per_cpu") or key.endswith(".percent"):
+            return abs(new - old) >= threshold
+        return abs(new - old) >= abs(old) * BYTES_THRESHOLD
+
+    def delta(self, sample, now):
+        """Trả (full, values) cần gửi, hoặc None nếu không có gì đổi."""
+        values = {k: v for k, v in sample.items() if k.split(".", 1)[0] in self.groups}
+        if now - self.last_keyframe >= KEYFRAME_INTERVAL:
+            return True, values
+        changed = {k: v for k, v in values.items() if self._changed(k, self.sent.get(k), v)}
+        changed.update({k: None for k in self.sent if k not in values})
+        return (False, changed) if changed else None
+
+
+class TelemetrySampler:
+    def __init__(self):
+        self._subs = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix="telemetry-send")
+        self._prev_io = {}          # counter tích luỹ lần trước để tính tốc độ
+        self.samples = 0
+        self.dropped = 0
+
+    # --------------------------------------------------
+    # Subscriber API
+    # --------------------------------------------------
+
+    def subscribe(self, emit, groups=None, interval=None, thresholds=None, sub_id=None, lease=None):
+        groups = tuple(g for g in (groups or DEFAULT_GROUPS) if g in METRIC_GROUPS)
+        if not groups:
+            raise ValueError(f"No known metric group; choose from {', '.join(METRIC_GROUPS)}")
+        interval = max(MIN_INTERVAL, float(interval or DEFAULT_INTERVAL))
+        lease = max(interval, min(float(lease or DEFAULT_LEASE), MAX_LEASE))
+        thresholds = {k: float(v) for k, v in (thresholds or {}).items() if k in METRIC_GROUPS}
+        with self._lock:
+            sub = self._subs.get(sub_id) if sub_id else None
+            if sub is not None:
+                sub.emit = emit
+                sub.configure(groups, interval, thresholds, lease)
+            else:
+                sub = Subscription(sub_id or uuid.uuid4().hex, emit, groups, interval, thresholds, lease)
+                self._subs[sub.id] = sub
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="telemetry-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()            # chu kỳ có thể vừa ngắn lại
+        return sub
+
+    def unsubscribe(self, sub_id):
+        with self._lock:
+            return self._subs.pop(sub_id, None) is not None
+
+    def count(self):
+        with self._lock:
+            return len(self._subs)
+
+    # --------------------------------------------------
+    # Sampler
+    # --------------------------------------------------
+
+    def _run(self):
+        psutil.cpu_percent(None, percpu=True)    # mồi: lần gọi đầu của cpu_percent luôn trả 0.0
+        time.sleep(MIN_INTERVAL)
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                for sub_id in [s.id for s in self._subs.values() if s.expires <= now]:
+                    print(f"📉 Telemetry subscription {sub_id} expired")
+                    del self._subs[sub_id]
+                if not self._subs:
+                    self._thread = None
+                    self._prev_io.clear()
+                    return
+                subs = list(self._subs.values())
+                due = [s for s in subs if s.next_due <= now]
+            if due:
+                sample = self._sample({g for s in due for g in s.groups}, now)
+                for sub in due:
+                    sub.next_due = now + sub.interval
+                    self._offer(sub, sample, now)
+            self._wake.wait(max(0.0, min(s.next_due for s in subs) - time.monotonic()))
+            self._wake.clear()
+
+    def _sample(self, groups, now):
+        values = {}
+        if "cpu" in groups or "per_cpu" in groups:
+            per_cpu = psutil.cpu_percent(None, percpu=True)
+            values["cpu.percent"] = _round(sum(per_cpu) / len(per_cpu)) if per_cpu else None
+            if "per_cpu" in groups:
+                values.update({f"per_cpu.{i}": _round(p) for i, p in enumerate(per_cpu)})
+        if "memory" in groups:
+            mem = psutil.virtual_memory()
+            values.update({"memory.percent": mem.percent, "memory.used": mem.used, "memory.available": mem.available})
+        if "swap" in groups:
+            swap = psutil.swap_memory()
+            values.update({"swap.percent": swap.percent, "swap.used": swap.used})
+        if "disk" in groups:
+            for part in psutil.disk_partitions(all=False):
+                try:
+                    usage = psutil.disk_usage(part.mountpoint)
+                except (PermissionError, OSError):
+                    continue    # ổ CD rỗng, mount không đọc được...
+                values[f"disk.{part.mountpoint}.percent"] = usage.percent
+                values[f"disk.{part.mountpoint}.free"] = usage.free
+        if "disk_io" in groups:
+            io = psutil.disk_io_counters()
+            if io is not None:
+                values.update(self._rates("disk_io", {"read_bps": io.read_bytes, "write_bps": io.write_bytes}, now))
+        if "net" in groups:
+            io = psutil.net_io_counters()
+            values.update(self._rates("net", {"sent_bps": io.bytes_sent, "recv_bps": io.bytes_recv}, now))
+        self.samples += 1
+        return values
+
+    def _rates(self, group, counters, now):
+        prev = self._prev_io.get(group)
+        self._prev_io[group] = (now, counters)
+        if prev is None or now <= prev[0]:
+            return {}   # cần hai lần đo mới có tốc độ
+        elapsed = now - prev[0]
+        return {f"{group}.{k}": _round(max(0, v - prev[1][k]) / elapsed) for k, v in counters.items()}
+
+    # --------------------------------------------------
+    # Gửi
+    # --------------------------------------------------
+
+    def _offer(self, sub, sample, now):
+        with self._lock:
+            if sub.sending:
+                # socket còn bận với update trước: bỏ, không xếp hàng
+                sub.dropped += 1
+                self.dropped += 1
+                return
+            update = sub.delta(sample, now)
+            if update is None:
+                return
+            sub.sending = True
+        full, values = update
+        sub.seq += 1
+        payload = {
+            "type": "metrics_update",
+            "status": "running",
+            "subscription_id": sub.id,
+            "seq": sub.seq,
+            "full": full,
+            "dropped": sub.dropped,
+            "values": values,
+        }
+        self._pool.submit(self._deliver, sub, payload, values, full, now)
+
+    def _deliver(self, sub, payload, values, full, now):
+        try:
+            # emit trả False khi gửi hỏng (mất kết nối, client LAN đã đóng...):
+            # baseline chỉ đổi khi đã gửi, nên update hỏng / bị bỏ được gộp vào delta sau
+            if not sub.emit(payload):
+                sub.dropped += 1
+                self.dropped += 1
+                return
+            if full:
+                sub.sent = {k: v for k, v in values.items()}
+                sub.last_keyframe = now
+            else:
+                sub.sent.update(values)
+                for key in [k for k, v in values.items() if v is None]:
+                    sub.sent.pop(key, None)
+        except Exception as e:
+            print(f"⚠️ Telemetry send failed: {e}")
+        finally:
+            with self._lock:
+                sub.sending = False
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> TelemetrySampler:
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = TelemetrySampler()
+            metrics.gauge("agent_telemetry_subscribers", _sampler.count)
+            metrics.gauge("agent_telemetry_dropped_updates", lambda: _sampler.dropped)
+        return _sampler
@@ -1,42 +1,179 @@
-import requests
-import tempfile
+import hashlib
 import os
-from playsound import playsound  # pip install playsound==1.2.2
+import shutil
+import subprocess
+import threading
+from core.config import Config
+from core.metrics import metrics
+
+RESPONSE_FORMAT = "mp3"
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".window_manager_agent", "tts_cache")
+CACHE_BUDGET_BYTES = 50 * 1024 * 1024
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Player đọc mp3 từ stdin — có thì phát ngay trong lúc còn đang tải
+STREAM_PLAYERS = (
+    ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-i", "-"],
+    ["mpg123", "-q", "-"],
+    ["mpv", "--no-video", "--really-quiet", "-"],
+)
+
+_session = None
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
 
-CUSTOM_TTS_BASE_URL = "https://tts.imsteve.dev"
-CUSTOM_TTS_API_KEY = "YOUR_API_KEY_HERE"
 
 def clean_ssml_tags(text):
     import re
     return re.sub(r"<[^>]+>", "", text)
 
-def synthesize_and_play(text_content, voice_gender="FEMALE"):
-    payload = {
-        "input": clean_ssml_tags(text_content),
-        "voice": "vi-VN-HoaiMyNeural" if voice_gender.upper() == "FEMALE" else "vi-VN-NamMinhNeural",
-        "response_format": "mp3"
-    }
 
+def voice_for(voice_gender):
+    return "vi-VN-HoaiMyNeural" if voice_gender.upper() == "FEMALE" else "vi-VN-NamMinhNeural"
+
+
+class TTSCache:
+    """
+    Cache audio trên đĩa, khoá theo (text đã làm sạch, voice, format).
+    LRU theo mtime: mỗi lần hit thì "chạm" file, khi vượt budget thì xoá file cũ nhất.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, budget_bytes=CACHE_BUDGET_BYTES):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, voice, fmt=RESPONSE_FORMAT):
+        return hashlib.sha256(f"{voice}\0{fmt}\0{text}".encode("utf-8")).hexdigest()
+
+    def path_for(self, key, fmt=RESPONSE_FORMAT):
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key, fmt=RESPONSE_FORMAT):
+        path = self.path_for(key, fmt)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.budget_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    continue
+
+
+cache = TTSCache()
+metrics.gauge("agent_tts_cache_hit_rate", lambda: round(cache.hit_rate(), 3))
+
+
+def _open_stream_player():
+    for argv in STREAM_PLAYERS:
+        if shutil.which(argv[0]):
+            try:
+                return subprocess.Popen(argv, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError:
+                continue
+    return None
+
+
+def _download(text, voice, path, player=None):
+    """Tải audio vào file .part rồi đổi tên; đồng thời đẩy từng chunk vào player nếu có."""
+    cfg = Config()
+    payload = {"input": text, "voice": voice, "response_format": RESPONSE_FORMAT}
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {CUSTOM_TTS_API_KEY}"
+        "Authorization": f"Bearer {cfg.tts_api_key}"
     }
-
-    try:
-        response = requests.post(
-            f"{CUSTOM_TTS_BASE_URL}/v1/audio/speech",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
+    part_path = f"{path}.{threading.get_ident()}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _get_session().post(f"{cfg.tts_base_url.rstrip('/')}/v1/audio/speech", json=payload,
+                       headers=headers, timeout=30, stream=True) as response:
         response.raise_for_status()
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+                    if player:
+                        try:
+                            player.stdin.write(chunk)
+                        except OSError:
+                            player = None
+            os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    cache.evict()
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            tmp.write(response.content)
-            tmp_path = tmp.name
 
-        playsound(tmp_path)
-        os.remove(tmp_path)
+def synthesize(text_content, voice_gender="FEMALE"):
+    """Trả về đường dẫn file audio trong cache (tải về nếu chưa có)."""
+    text, voice = clean_ssml_tags(text_content), voice_for(voice_gender)
+    key = cache.key(text, voice)
+    path = cache.get(key)
+    if path is None:
+        path = cache.path_for(key)
+        _download(text, voice, path)
+    return path
+
+
+def play_file(path):
+    from playsound import playsound  # pip install playsound==1.2.2
+    playsound(path)
+
+
+def synthesize_and_play(text_content, voice_gender="FEMALE"):
+    try:
+        text, voice = clean_ssml_tags(text_content), voice_for(voice_gender)
+        key = cache.key(text, voice)
+        path = cache.get(key)
+        if path:
+            play_file(path)
+            return
+
+        path = cache.path_for(key)
+        player = _open_stream_player()
+        try:
+            _download(text, voice, path, player)
+        finally:
+            if player:
+                try:
+                    player.stdin.close()
+                except OSError:
+                    pass
+                player.wait()
+        if not player:
+            play_file(path)
 
     except Exception as e:
         print(f"❌ Lỗi TTS: {e}")
@@ -1,66 +1,132 @@
-import asyncio
 import json
+import random
+import struct
 import time
 import threading
 from websocket import WebSocketApp, WebSocketConnectionClosedException
 from core.config import Config
 from core.telegram_service import TelegramService
 from core.command_handler import CommandHandler
+from core.protocol import Codec, negotiation_query
+from core.controllers import ControllerRegistry
+from core.result_outbox import ResultOutbox
+from core.metrics import metrics, serve_metrics
+from core.lan_server import start_lan_server
+from core import capture_archive
 
-SERVER_URL = "ws://control.imsteve.dev/ws"
+PROTOCOL_WAIT = 5.0            # giây chờ frame "protocol" sau khi mở kết nối (server cũ không gửi)
+RECONNECT_BASE_DELAY = 1       # giây — mốc backoff sau lần thử lại đầu tiên
+RECONNECT_MAX_DELAY = 60
+FIRST_RETRY_JITTER = 0.5       # lần thử lại đầu gần như ngay lập tức, chỉ rải nhẹ
 
 
 class WebSocketClient:
-    def __init__(self, on_chat_callback=None, on_status_callback=None):
+    def __init__(self, on_chat_callback=None, on_status_callback=None, on_rtt_callback=None):
         self.cfg = Config()
         self.telegram = TelegramService()
         self.handler = CommandHandler(self)
         self.on_chat_callback = on_chat_callback
         self.on_status_callback = on_status_callback
+        self.on_rtt_callback = on_rtt_callback
 
         self.ws = None
         self._should_reconnect = True
-        self._is_reconnecting = False  # 🔒 tránh reconnect song song
-        self._reconnect_delay = 5      # giây — sẽ tăng dần nếu thất bại
-        self.controllers = {}
+        self._supervisor = None        # 🔒 thread duy nhất được phép mở kết nối
+        self._supervisor_lock = threading.Lock()
+        self._failures = 0             # số lần kết nối thất bại liên tiếp
+        self._last_pong = 0.0
+        self.rtt_ms = None             # RTT agent <-> relay đo bằng websocket ping
+        self.controllers = ControllerRegistry()
+        self._send_lock = threading.Lock()  # ws.send không an toàn khi nhiều worker cùng gửi
+        self.codec = Codec("json")          # đổi sang msgpack khi server xác nhận
+        self.outbox = ResultOutbox()        # kết quả chưa được server ack
+        self._outbox_cond = threading.Condition()  # báo sender có kết quả mới / đổi kết nối
+        # server đã báo hỗ trợ ack (frame protocol có "acks": true)? Giữ qua các lần
+        # kết nối lại để kết quả phát sinh lúc mất mạng vẫn vào outbox
+        self._relay_acks = False
+        self._protocol_ready = threading.Event()
+        metrics.gauge("agent_result_outbox_pending", lambda: len(self.outbox))
+        metrics.gauge("agent_ws_rtt_ms", lambda: self.rtt_ms)
+        metrics.gauge("agent_controllers_active", lambda: len(self.controllers))
+        serve_metrics(self.cfg.metrics_port)
+        start_lan_server(self.handler, self.cfg.lan_port)  # relay vẫn chạy làm đường dự phòng
+        # agent rảnh lâu không chụp / list vẫn phải dọn ảnh quá hạn trong kho capture
+        threading.Thread(target=capture_archive.expire_on_startup, name="capture-expire", daemon=True).start()
     # --------------------------------------------------
     # WebSocket Event Handlers
     # --------------------------------------------------
 
     def _on_open(self, ws):
+        if ws is not self.ws:
+            return
         print("✅ Connected to server")
+        self.codec = Codec("json")     # server chưa xác nhận codec cho kết nối mới
         self.telegram.send_message("🟢 Agent đã kết nối server")
         self.telegram.send_message(f"{self.cfg.device_id}")
-        self._reconnect_delay = 5      # reset delay khi kết nối lại thành công
-        self._is_reconnecting = False  # cho phép reconnect lần sau nếu mất kết nối
+        self._failures = 0             # lần mất kết nối sau sẽ thử lại ngay
+        self._last_pong = time.monotonic()
+        threading.Thread(target=self._heartbeat_loop, args=(ws,), name="ws-heartbeat", daemon=True).start()
+        self._protocol_ready = ready = threading.Event()
+        # kết quả durable phát sinh trong lúc chờ frame protocol được giữ lại trong outbox
+        start_seq = self.outbox.last_seq
+        threading.Thread(target=self._outbox_sender, args=(ws, ready, start_seq),
+                         name="outbox-sender", daemon=True).start()
 
         if self.on_status_callback:
             self.on_status_callback(True)
 
     def _on_message(self, ws, message):
         try:
-            if not message or not message.strip():
+            if not message or (isinstance(message, str) and not message.strip()):
                 print("⚠️ Received empty WS message — skipping")
                 return
 
-            data = json.loads(message)
-            print(f"Received: {data}")
+            metrics.inc("agent_ws_bytes_in_total", len(message))
+            data = self.codec.decode(message)
             msg_type = data.get("type")
-            
-            if msg_type == "command":
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self.handler.enqueue_command(data))
-                loop.close()
+            print(f"Received: {msg_type} ({len(message)} bytes)")
+            sender = data.get("from") or data.get("controller_id") or data.get("client_id")
+            if sender:
+                self.controllers.touch(sender)
+
+            if msg_type == "protocol":
+                self.codec = Codec(data.get("codec", "json"), compress=data.get("compress") == "deflate")
+                self._relay_acks = bool(data.get("acks"))
+                self._protocol_ready.set()
+                print(f"🔧 Protocol: {self.codec.name} (compress={self.codec.compress}, acks={self._relay_acks})")
+
+            elif msg_type == "ack":
+                # ack cộng dồn: mọi kết quả có result_seq <= seq đã tới server
+                self.outbox.ack(int(data.get("result_seq", 0)))
+
+            elif msg_type == "ping":
+                # trả lời ngay trên thread đọc để controller đo RTT toàn tuyến
+                self.send_result({"type": "pong", "ts": data.get("ts"), "rtt_ms": self.rtt_ms})
+
+            elif msg_type == "command":
+                # chỉ đẩy vào hàng đợi — dispatch loop sẽ chạy lệnh
+                self.handler.enqueue_command(data)
 
             elif msg_type == "connect_success":
                 controller_id = data.get("controller_id")
                 if controller_id:
-                    self.controllers[controller_id] = {"connected_at": time.time()}
+                    self.controllers.add(controller_id)
                     print(f"✅ Controller connected: {controller_id}")
                     self.telegram.send_message(f"🤝 Connected to controller {controller_id}")
                 return
 
+            elif msg_type == "controllers":
+                # relay liệt kê controller còn sống (presence) — nguồn chính xác nhất
+                for controller_id in self.controllers.sync(data.get("controller_ids") or []):
+                    print(f"👋 Controller disconnected: {controller_id}")
+                return
+
+            elif msg_type in ("controller_disconnected", "disconnect"):
+                controller_id = data.get("controller_id")
+                if controller_id and self.controllers.remove(controller_id):
+                    print(f"👋 Controller disconnected: {controller_id}")
+                return
+
             elif msg_type == "chat":
                 msg = f"{data.get('from')}: {data.get('message')}"
                 print(f"💬 Chat: {msg}")
@@ -74,63 +140,108 @@ class WebSocketClient:
             print(f"⚠️ Error handling WS message: {e}")
 
     def _on_close(self, ws, close_status_code, close_msg):
+        # không tự reconnect ở đây: _run_forever sẽ mở kết nối mới khi run_forever trả về,
+        # nên _on_close và _on_error cùng bắn cũng không sinh ra hai kết nối
+        if ws is not self.ws:
+            return
         print(f"⚠️ Disconnected from server ({close_status_code}): {close_msg}")
         if self.on_status_callback:
             self.on_status_callback(False)
-        self._schedule_reconnect()
 
     def _on_error(self, ws, error):
+        if ws is not self.ws:
+            return
         print(f"⚠️ WS error: {error}")
         if self.on_status_callback:
             self.on_status_callback(False)
-        self._schedule_reconnect()
+
+    def _on_pong(self, ws, data):
+        if ws is not self.ws:
+            return
+        now = time.monotonic()
+        self._last_pong = now
+        try:
+            (sent_at,) = struct.unpack(">d", data)
+        except struct.error:
+            return
+        self.rtt_ms = round((now - sent_at) * 1000, 1)
+        if self.on_rtt_callback:
+            self.on_rtt_callback(self.rtt_ms)
 
     # --------------------------------------------------
-    # Reconnect Logic (với exponential backoff)
+    # Heartbeat & Reconnect (backoff có jitter)
     # --------------------------------------------------
 
+    def _heartbeat_loop(self, ws):
+        """Ping định kỳ (payload = thời điểm gửi) để đo RTT và phát hiện kết nối chết."""
+        interval = self.cfg.heartbeat_interval
+        timeout = self.cfg.heartbeat_timeout
+        while ws is self.ws and ws.sock and ws.sock.connected:
+            time.sleep(interval)
+            if ws is not self.ws:
+                return
+            if time.monotonic() - self._last_pong > timeout:
+                print(f"💀 No pong for {timeout}s — dropping half-open connection")
+                ws.sock.abort()  # không chờ close handshake với peer đã chết
+                return
+            try:
+                with self._send_lock:
+                    ws.sock.ping(struct.pack(">d", time.monotonic()))
+            except Exception:
+                return
+
     def _schedule_reconnect(self):
-        """Chỉ gọi reconnect nếu chưa có reconnect đang chạy."""
-        if not self._should_reconnect:
-            return
-        if self._is_reconnecting:
-            print("⏳ Reconnect already in progress — skipping")
-            return
+        """Đóng kết nối hiện tại; thread _run_forever sẽ tự kết nối lại."""
+        if self.ws:
+            self.ws.close()
 
-        self._is_reconnecting = True
-        thread = threading.Thread(target=self._reconnect_loop, daemon=True)
-        thread.start()
+    def _next_delay(self):
+        if self._failures == 0:
+            return random.uniform(0, FIRST_RETRY_JITTER)
+        cap = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (self._failures - 1))
+        return random.uniform(cap / 2, cap)
 
-    def _reconnect_loop(self):
-        """Thử reconnect với delay tăng dần (exponential backoff)."""
+    def _run_forever(self):
+        """Vòng lặp kết nối duy nhất: mở kết nối, chờ nó đóng, chờ backoff rồi mở lại."""
         while self._should_reconnect:
-            print(f"🔁 Trying to reconnect in {self._reconnect_delay}s...")
-            time.sleep(self._reconnect_delay)
+            uri = f"{self.cfg.server_url.rstrip('/')}/{self.cfg.device_id}?{negotiation_query()}"
+            print(f"🌐 Connecting to {uri} ...")
+            ws = WebSocketApp(
+                uri,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_close=self._on_close,
+                on_error=self._on_error,
+                on_pong=self._on_pong,
+            )
+            with self._outbox_cond:
+                self.ws = ws
+                self._outbox_cond.notify_all()     # sender của kết nối cũ thoát
             try:
-                self.connect()
-                # Nếu connect thành công, _on_open sẽ reset delay
-                break
+                ws.run_forever()
             except Exception as e:
-                print(f"⚠️ Reconnect failed: {e}")
-                self._reconnect_delay = min(self._reconnect_delay * 2, 60)  # giới hạn 60s
+                print(f"⚠️ Connection failed: {e}")
+            if not self._should_reconnect:
+                break
+
+            delay = self._next_delay()
+            self._failures += 1
+            metrics.inc("agent_ws_reconnects_total")
+            print(f"🔁 Trying to reconnect in {delay:.1f}s...")
+            time.sleep(delay)
 
     # --------------------------------------------------
     # Connection & Messaging
     # --------------------------------------------------
 
     def connect(self):
-        """Khởi tạo và chạy WebSocket connection"""
-        uri = f"{SERVER_URL}/{self.cfg.device_id}"
-        print(f"🌐 Connecting to {uri} ...")
-        self.ws = WebSocketApp(
-            uri,
-            on_open=self._on_open,
-            on_message=self._on_message,
-            on_close=self._on_close,
-            on_error=self._on_error,
-        )
-        thread = threading.Thread(target=self.ws.run_forever, daemon=True)
-        thread.start()
+        """Khởi động thread kết nối (gọi nhiều lần cũng chỉ có một kết nối)"""
+        with self._supervisor_lock:
+            self._should_reconnect = True
+            if self._supervisor and self._supervisor.is_alive():
+                return
+            self._supervisor = threading.Thread(target=self._run_forever, name="ws-connection", daemon=True)
+            self._supervisor.start()
 
     def send_chat(self, text: str):
         """Gửi tin nhắn chat"""
@@ -139,40 +250,130 @@ class WebSocketClient:
             return
         try:
             payload = {"type": "chat", "message": text}
-            if self.controllers:
-                for cid in self.controllers.keys():
-                    payload["to"] = cid
-                    self.ws.send(json.dumps(payload))
-                    print(f"📤 Broadcast chat to controller {cid}")
+            envelopes = [{"to": cid} for cid in self.controllers.active()]
+            for data, opcode in self.codec.encode_fanout(payload, envelopes):
+                with self._send_lock:
+                    self.ws.send(data, opcode=opcode)
+                metrics.inc("agent_ws_bytes_out_total", len(data))
+            if envelopes:
+                print(f"📤 Broadcast chat to {len(envelopes)} controller(s)")
         except WebSocketConnectionClosedException:
             print("⚠️ Connection closed — scheduling reconnect")
             self._schedule_reconnect()
         except Exception as e:
             print(f"⚠️ Send chat failed: {e}")
 
-    def send_result(self, payload: dict):
-        """Gửi kết quả command"""
+    def _outbox_sender(self, ws, ready, start_seq):
+        """
+        Thread duy nhất gửi kết quả durable trên một kết nối. Chờ server xác nhận protocol.
+        Server có ack: gửi theo đúng thứ tự seq mọi kết quả chưa ack — phần còn lại từ
+        kết nối trước rồi tới kết quả mới — ngoài outbox.lock, để ack và reply khác không
+        phải chờ một lần gửi lớn. Server không ack: tắt durable, gửi một lần các kết quả
+        giữ lại từ lúc mở kết nối, bỏ phần cũ hơn.
+        """
+        if not ready.wait(PROTOCOL_WAIT):
+            self._relay_acks = False
+        if ws is not self.ws:
+            return
+        if not self._relay_acks:
+            with self.outbox.lock:
+                held = self.outbox.pending(after=start_seq)
+                stale = len(self.outbox) - len(held)
+                self.outbox.ack(self.outbox.last_seq)
+            for _, payload in held:
+                payload.pop("result_seq", None)
+                self._send(payload, ws=ws)
+            if stale:
+                print(f"📦 Relay does not ack results — dropped {stale} stale outbox result(s)")
+            return
+        last_seq, replayed = 0, 0
+        while ws is self.ws and self._should_reconnect:
+            with self.outbox.lock:
+                items = self.outbox.pending(after=last_seq)
+                if not items:
+                    last_seq = self.outbox.last_seq
+            if not items:
+                if replayed:
+                    print(f"📦 Replayed {replayed} unacked result(s)")
+                    replayed = 0
+                with self._outbox_cond:
+                    self._outbox_cond.wait_for(
+                        lambda: ws is not self.ws or not self._should_reconnect or self.outbox.last_seq > last_seq,
+                        timeout=1.0)
+                continue
+            for seq, payload in items:
+                if not self._send(payload, ws=ws):
+                    return  # kết nối chết — sender của kết nối sau gửi tiếp từ outbox
+                last_seq = seq
+                replayed += seq <= start_seq
+
+    def send_result(self, payload: dict, durable=False, label=None):
+        """
+        Gửi kết quả command. durable=True: ghi vào outbox (gán result_seq), sender của
+        kết nối gửi theo thứ tự seq, giữ tới khi server ack và gửi lại sau khi kết nối
+        lại — chỉ khi server đã báo hỗ trợ ack, không thì gửi như kết quả thường.
+        label: loại command dùng làm label cho metric serialize/send.
+        Trả False nếu không gửi được (và kết quả không nằm trong outbox), kể cả khi
+        kết quả không durable mà relay không còn controller nào.
+        """
+        if durable and self._relay_acks:
+            with self.outbox.lock:
+                queued = self._relay_acks      # sender có thể vừa tắt durable (relay không ack)
+                if queued:
+                    self.outbox.append(payload)
+            if queued:
+                with self._outbox_cond:
+                    self._outbox_cond.notify_all()
+                return True
         if not self.ws:
             print("⚠️ No active connection")
-            return
+            return False
+        if not durable and not self.controllers.active():
+            return False    # không controller nào nhận: stream / subscription biết để dừng hoặc giữ baseline
+        return self._send(payload, label)
+
+    def _send(self, payload: dict, label=None, ws=None):
+        label = label or payload.get("type")
+        ws = ws or self.ws
         try:
-            packet = {}
-            print(f"Controllers: {self.controllers}")
-            if self.controllers:
-                for cid in self.controllers.keys():
-                    packet["to"] = cid
-                    packet["client_id"] = cid
-                    packet["agent_id"] = self.cfg.device_id
-                    merged = {**packet, **payload}
-                    self.ws.send(json.dumps(merged))
-                    print(f"📤 Send response {merged}")
+            envelopes = [
+                {"to": cid, "client_id": cid, "agent_id": self.cfg.device_id}
+                for cid in self.controllers.active()
+            ]
+            # body chỉ serialize một lần, mỗi controller chỉ thêm envelope nhỏ;
+            # payload có bytes (ảnh...) -> binary frame thay vì base64
+            frames = self.codec.encode_fanout(payload, envelopes)
+            size = total = 0
+            serialize_s = send_s = 0.0
+            while True:
+                started = time.perf_counter()
+                frame = next(frames, None)  # encode nằm trong generator
+                encoded = time.perf_counter()
+                serialize_s += encoded - started
+                if frame is None:
+                    break
+                data, opcode = frame
+                with self._send_lock:
+                    ws.send(data, opcode=opcode)
+                send_s += time.perf_counter() - encoded
+                size = len(data)
+                total += size
+            metrics.observe("agent_result_serialize_seconds", serialize_s, type=label)
+            metrics.observe("agent_result_send_seconds", send_s, type=label)
+            metrics.inc("agent_ws_bytes_out_total", total)
+            if envelopes:
+                print(f"📤 Send {payload.get('type')} to {len(envelopes)} controller(s) ({size} bytes, {self.codec.name})")
+            return True
         except Exception as e:
             print(f"⚠️ Send result failed: {e}")
+            return False
 
     def stop(self):
         """Ngắt kết nối thủ công"""
         self._should_reconnect = False
-        self._is_reconnecting = False
         if self.ws:
             self.ws.close()
+        with self._outbox_cond:
+            self._outbox_cond.notify_all()
+        self.handler.stop()
         print("🛑 WebSocket client stopped.")
@@ -0,0 +1,70 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+import threading
+
+# Config / outbox / cache đều nằm dưới HOME -> trỏ về thư mục tạm trước khi import core
+_HOME = tempfile.mkdtemp(prefix="agent-tests-")
+os.environ["HOME"] = os.environ["USERPROFILE"] = _HOME
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+class RecordingClient:
+    """Thay WebSocketClient: ghi lại mọi kết quả CommandHandler gửi về relay."""
+
+    def __init__(self):
+        self.sent = []
+        self.durable = {}           # command_id -> cờ durable của kết quả cuối
+        self._cond = threading.Condition()
+
+    def send_result(self, payload, durable=False, label=None):
+        with self._cond:
+            self.sent.append(payload)
+            if payload.get("status") != "running":
+                self.durable[payload.get("command_id")] = durable
+            self._cond.notify_all()
+        return True
+
+    def wait_for(self, predicate, timeout=10.0):
+        with self._cond:
+            self._cond.wait_for(lambda: any(predicate(p) for p in self.sent), timeout)
+            return next((p for p in self.sent if predicate(p)), None)
+
+
+@pytest.fixture
+def client():
+    return RecordingClient()
+
+
+@pytest.fixture
+def handler(client):
+    from core.command_handler import CommandHandler
+    handler = CommandHandler(client)
+    yield handler
+    handler.stop()
+
+
+def call(handler, client, frame, timeout=10.0):
+    """Enqueue một frame command và chờ kết quả cuối (status khác "running")."""
+    command_id = frame["data"].setdefault("command_id", os.urandom(8).hex())
+    handler.enqueue_command(frame)
+    return client.wait_for(
+        lambda p: p.get("command_id") == command_id and p.get("status") != "running", timeout)
+
+
+@pytest.fixture
+def register():
+    """Đăng ký command tạm cho test; gỡ khỏi COMMAND_REGISTRY khi xong."""
+    from core.command_executor import COMMAND_REGISTRY, register_command
+    added = []
+
+    def _register(name, factory, **spec):
+        register_command(name, factory, **spec)
+        added.append(name)
+
+    yield _register
+    for name in added:
+        COMMAND_REGISTRY.pop(name, None)
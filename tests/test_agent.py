@@ -0,0 +1,62 @@
+# tests/test_agent.py
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from core.agent import GUI_MODULES, RSS_BUDGET_MB, ChatLog, parse_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_headless_client_does_not_import_gui_modules(tmp_path):
+    # process riêng: test khác trong cùng process có thể đã import PIL
+    script = (
+        "import sys\n"
+        "from core.agent import GUI_MODULES\n"
+        "import core.websocket_client as ws\n"
+        "client = ws.WebSocketClient()\n"
+        "print('gui:' + ','.join(m for m in GUI_MODULES if m in sys.modules))\n"
+        "client.handler.stop()\n"
+    )
+    env = {**os.environ, "HOME": str(tmp_path), "USERPROFILE": str(tmp_path)}
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert "gui:\n" in result.stdout
+
+
+def test_headless_agent_stays_within_rss_budget(tmp_path):
+    psutil = pytest.importorskip("psutil")
+    from bench.stubs import ConnectRecorder
+    server = ConnectRecorder().start()
+    env = {**os.environ, "HOME": str(tmp_path), "USERPROFILE": str(tmp_path)}
+    proc = subprocess.Popen([sys.executable, "-m", "core.agent", "--server-url", f"{server.url}/ws"],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert server.connected.wait(30), "agent did not connect"
+        time.sleep(1.0)     # để agent ổn định sau khi kết nối, như bench_memory
+        rss_mb = psutil.Process(proc.pid).memory_info().rss / (1024 * 1024)
+    finally:
+        proc.kill()
+        proc.wait()
+        server.stop()
+    assert rss_mb <= RSS_BUDGET_MB, f"RSS {rss_mb:.1f} MB > {RSS_BUDGET_MB} MB"
+
+
+def test_chat_log_writes_stamped_lines(tmp_path):
+    path = tmp_path / "chat.log"
+    log = ChatLog(str(path))
+    log.write("controller: xin chào")
+    log.write("🟢 Connected")
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("[") and lines[0].endswith("] controller: xin chào")
+
+
+def test_parse_args():
+    args = parse_args(["--log-file", "a.log", "--server-url", "ws://relay/ws"])
+    assert args.log_file == "a.log" and args.server_url == "ws://relay/ws"
+    assert "tkinter" in GUI_MODULES
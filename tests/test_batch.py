@@ -0,0 +1,82 @@
+# tests/test_batch.py
+import threading
+import time
+
+from conftest import call
+from core.command_executor import ICommand
+
+
+class Tracked(ICommand):
+    """Ghi lại số lệnh cùng loại đang chạy đồng thời."""
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+
+    def execute(self):
+        with Tracked.lock:
+            Tracked.active += 1
+            Tracked.peak = max(Tracked.peak, Tracked.active)
+        time.sleep(self.delay)
+        with Tracked.lock:
+            Tracked.active -= 1
+        return {"type": "command_result", "status": "success"}
+
+
+class Sleepy(ICommand):
+    def __init__(self):
+        self.stop = threading.Event()
+
+    def execute(self):
+        self.stop.wait(10)
+        return {"type": "command_result", "status": "cancelled" if self.stop.is_set() else "success"}
+
+    def cancel(self):
+        self.stop.set()
+        return True
+
+
+def test_batch_respects_per_type_concurrency(handler, client, register):
+    Tracked.peak = 0
+    register("test_tracked", lambda cmd: Tracked(), concurrency=1)
+    result = call(handler, client, {"type": "command", "data": {
+        "type": "batch", "parallel": 4, "commands": [{"type": "test_tracked", "n": i} for i in range(4)]}})
+    assert result["status"] == "success"
+    assert [r["status"] for r in result["results"]] == ["success"] * 4
+    assert Tracked.peak == 1
+
+
+def test_batch_sub_command_uses_spec_timeout(handler, client, register, monkeypatch):
+    import core.command_handler as command_handler
+    monkeypatch.setattr(command_handler, "TIMEOUT_GRACE", 0.0)
+    register("test_sleepy", lambda cmd: Sleepy(), timeout=0.2)
+    result = call(handler, client, {"type": "command", "data": {
+        "type": "batch", "commands": [{"type": "test_sleepy"}]}})
+    assert result["status"] == "error"
+    assert result["results"][0]["status"] == "timeout"
+
+
+def test_batch_reports_unknown_sub_command(handler, client):
+    result = call(handler, client, {"type": "command", "data": {
+        "type": "batch", "commands": [{"type": "no_such_command"}]}})
+    assert result["results"][0]["status"] == "error"
+    assert "no_such_command" in result["results"][0]["result"]["message"]
+
+
+def test_cancelling_batch_cancels_running_sub_commands(handler, client, register):
+    register("test_sleepy", lambda cmd: Sleepy(), timeout=30)
+    handler.enqueue_command({"type": "command", "data": {
+        "type": "batch", "command_id": "b1", "commands": [{"type": "test_sleepy", "id": "a"}]}})
+    deadline = time.monotonic() + 5
+    while "b1:a" not in handler.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    handler.enqueue_command({"type": "command", "data": {"type": "cancel_command", "target_id": "b1"}})
+    result = client.wait_for(lambda p: p.get("command_id") == "b1" and p.get("status") != "running", 5)
+    assert result["status"] == "cancelled"
+    assert result["results"][0]["status"] == "cancelled"
+    deadline = time.monotonic() + 5
+    while "b1:a" in handler.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert "b1:a" not in handler.running
@@ -0,0 +1,99 @@
+# tests/test_capture_archive.py
+import os
+import threading
+import time
+import warnings
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw  # noqa: E402
+
+from core import capture_archive  # noqa: E402
+from core.capture_archive import CaptureArchive, dhash, _distance  # noqa: E402
+
+
+def _screen(text=""):
+    image = Image.new("RGB", (320, 200), "white")
+    ImageDraw.Draw(image).rectangle((20, 20, 300, 60), fill="navy")
+    if text:
+        ImageDraw.Draw(image).text((30, 150), text, fill="black")
+    return image
+
+
+def test_small_change_is_kept_by_default(tmp_path):
+    archive = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=10 ** 6)
+    before, after = _screen(), _screen("12")        # thêm vài ký tự
+    assert _distance(dhash(before), dhash(after)) <= 3     # ngưỡng dHash cũ coi là trùng
+    assert archive.add(before, 1000.0)[1] is False
+    assert archive.add(after, 1001.0)[1] is False
+    assert archive.add(_screen("12"), 1002.0)[1] is True    # trùng hệt vẫn bỏ
+    assert archive.usage()["frames"] == 2
+
+
+def test_perceptual_dedupe_is_opt_in(tmp_path):
+    archive = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=10 ** 6, dedupe_distance=256)
+    archive.add(_screen(), 1000.0)
+    assert archive.add(_screen("1 new mail"), 1001.0)[1] is True
+    assert archive.usage()["frames"] == 1
+
+
+def test_concurrent_identical_frames_are_stored_once(tmp_path):
+    archive = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=10 ** 6)
+    barrier = threading.Barrier(4)
+    results = []
+
+    def add(i):
+        barrier.wait()
+        results.append(archive.add(_screen("same"), 1000.0 + i))
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(dup for _, dup in results) == [False, True, True, True]
+    assert len({capture_id for capture_id, _ in results}) == 1
+    assert archive.usage()["frames"] == 1
+    files = [name for name in os.listdir(tmp_path) if not name.startswith("captures.db")]
+    assert len(files) == 2      # một frame + một thumbnail, không còn file mồ côi
+
+
+def test_dhash_uses_no_deprecated_pillow_api():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        value = dhash(_screen())
+    assert len(value) == 64 and value == dhash(_screen())
+    assert value != dhash(_screen("khác hẳn"))
+
+
+def _stored_files(path):
+    return sorted(name for name in os.listdir(path) if not name.startswith("captures.db"))
+
+
+def test_expired_captures_are_removed_when_archive_opens(tmp_path):
+    archive = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=60)
+    archive.add(_screen("cũ"), time.time() - 120)
+    assert len(_stored_files(tmp_path)) == 2
+    # agent khởi động lại sau một thời gian rảnh: không có capture mới nào kích hoạt eviction
+    reopened = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=60)
+    assert reopened.usage()["frames"] == 0
+    assert _stored_files(tmp_path) == []
+
+
+def test_list_and_get_remove_expired_captures(tmp_path):
+    archive = CaptureArchive(str(tmp_path), budget_bytes=10 ** 8, max_age=60)
+    old_id, _ = archive.add(_screen("cũ"), time.time() - 30)
+    new_id, _ = archive.add(_screen("mới"), time.time())
+    assert archive.list()["total"] == 2
+    archive.max_age = 10                        # không chụp gì thêm: frame cũ hết hạn trong lúc rảnh
+    assert archive.get(old_id) is None
+    assert [entry["id"] for entry in archive.list()["entries"]] == [new_id]
+    assert len(_stored_files(tmp_path)) == 2
+
+
+def test_startup_expiry_does_not_create_an_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_archive, "ARCHIVE_DIR", str(tmp_path / "captures"))
+    monkeypatch.setattr(capture_archive, "_archive", None)
+    capture_archive.expire_on_startup()
+    assert capture_archive._archive is None and not os.path.exists(tmp_path / "captures")
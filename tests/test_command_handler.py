@@ -0,0 +1,171 @@
+# tests/test_command_handler.py
+import threading
+import time
+
+import core.command_handler as command_handler
+from conftest import call
+from core.command_executor import ICommand, PRIORITY_URGENT
+
+
+class Blocking(ICommand):
+    """Chặn worker thread tới khi release được set (không hỗ trợ huỷ)."""
+
+    def __init__(self, release, started=None):
+        self.release = release
+        self.started = started
+
+    def execute(self):
+        if self.started:
+            self.started.set()
+        self.release.wait(10)
+        return {"type": "command_result", "status": "success"}
+
+
+class Quick(ICommand):
+    def execute(self):
+        return {"type": "command_result", "status": "success"}
+
+
+def test_unknown_command_type_gets_error_reply(handler, client):
+    result = call(handler, client, {"type": "command", "data": {"type": "no_such_command"}})
+    assert result["status"] == "error"
+    assert "no_such_command" in result["message"]
+
+
+def test_factory_exception_gets_error_reply(handler, client, register):
+    def broken(cmd):
+        raise ValueError("bad params")
+    register("test_broken", broken)
+    result = call(handler, client, {"type": "command", "data": {"type": "test_broken"}})
+    assert result["status"] == "error"
+    assert "bad params" in result["message"]
+
+
+def test_timed_out_command_keeps_slot_until_worker_returns(handler, client, register, monkeypatch):
+    monkeypatch.setattr(command_handler, "TIMEOUT_GRACE", 0.0)
+    release = threading.Event()
+    register("test_block", lambda cmd: Blocking(release), timeout=0.1, concurrency=8)
+    result = call(handler, client, {"type": "command", "data": {"type": "test_block"}})
+    assert result["status"] == "timeout"
+    time.sleep(0.1)
+    assert handler._active == 1                     # thread vẫn đang chạy
+    release.set()
+    deadline = time.monotonic() + 5
+    while handler._active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert handler._active == 0
+
+
+def test_urgent_slot_stays_free_for_urgent_commands(handler, client, register, monkeypatch):
+    monkeypatch.setattr(command_handler, "TIMEOUT_GRACE", 0.0)
+    release = threading.Event()
+    register("test_block", lambda cmd: Blocking(release), timeout=0.1, concurrency=handler.max_workers)
+    register("test_urgent", lambda cmd: Quick(), priority=PRIORITY_URGENT, timeout=5)
+    try:
+        # lấp mọi slot thường bằng lệnh sẽ quá giờ nhưng vẫn chiếm thread
+        for _ in range(handler.max_workers):
+            handler.enqueue_command({"type": "command", "data": {"type": "test_block"}})
+        time.sleep(0.5)
+        assert handler._active == handler.max_workers - command_handler.URGENT_RESERVED_SLOTS
+        started = time.monotonic()
+        result = call(handler, client, {"type": "command", "data": {"type": "test_urgent"}}, timeout=3)
+        assert result is not None and result["status"] == "success"
+        assert time.monotonic() - started < 1.0
+    finally:
+        release.set()
+
+
+class LateEmitter(ICommand):
+    """Trả kết quả ngay, emit thêm một frame sau đó (như stream / subscription)."""
+
+    def __init__(self, done):
+        self.done = done
+
+    def execute(self):
+        def later():
+            time.sleep(0.2)
+            self.emit({"type": "stream_frame", "status": "running"})
+            self.done.set()
+        threading.Thread(target=later, daemon=True).start()
+        return {"type": "command_result", "status": "success"}
+
+
+def test_emit_after_result_reaches_original_sink(handler, client, register):
+    done = threading.Event()
+    register("test_late", lambda cmd: LateEmitter(done))
+    received = []
+    handler.enqueue_command({"type": "command", "data": {"type": "test_late", "command_id": "lan-1"}},
+                            reply=received.append)
+    assert done.wait(5)
+    assert [p["type"] for p in received] == ["command_result", "stream_frame"]
+    assert not any(p.get("type") == "stream_frame" for p in client.sent)
+
+
+class Cancellable(ICommand):
+    def __init__(self, started):
+        self.started = started
+        self.stop = threading.Event()
+        self.cancelled = False
+
+    def execute(self):
+        self.started.set()
+        self.stop.wait(10)
+        status = "cancelled" if self.cancelled else "success"
+        return {"type": "command_result", "status": status}
+
+    def cancel(self):
+        self.cancelled = True
+        self.stop.set()
+        return True
+
+
+def _shared_then_cancel_leader(handler, client, register, leader_data, follower_data):
+    runs = []
+
+    def factory(cmd):
+        started = threading.Event()
+        command = Cancellable(started)
+        runs.append(command)
+        return command
+    register("test_shared", factory, cache_ttl=5, concurrency=4)
+    handler.enqueue_command({"type": "command", "data": {"type": "test_shared", "command_id": "leader", **leader_data}})
+    deadline = time.monotonic() + 5
+    while not runs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runs and runs[0].started.wait(5)
+    handler.enqueue_command({"type": "command", "data": {"type": "test_shared", "command_id": "follower",
+                                                          **follower_data}})
+    time.sleep(0.2)
+    assert len(runs) == 1                           # đang chờ chung với lệnh dẫn
+    handler.enqueue_command({"type": "command", "data": {"type": "cancel_command", "target_id": "leader"}})
+
+    leader = client.wait_for(lambda p: p.get("command_id") == "leader" and p.get("status") != "running")
+    assert leader["status"] == "cancelled"
+    deadline = time.monotonic() + 5
+    while len(runs) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(runs) == 2                           # lệnh chờ chung được chạy lại
+    runs[1].stop.set()
+    follower = client.wait_for(lambda p: p.get("command_id") == "follower" and p.get("status") != "running")
+    assert follower["status"] == "success"
+    assert not follower.get("coalesced") and not follower.get("duplicate")
+
+
+def test_coalesced_follower_reruns_when_leader_cancelled(handler, client, register):
+    _shared_then_cancel_leader(handler, client, register, {"x": 1}, {"x": 1})
+
+
+def test_idempotent_follower_reruns_when_leader_cancelled(handler, client, register):
+    _shared_then_cancel_leader(handler, client, register,
+                               {"idempotency_key": "k1", "x": 1}, {"idempotency_key": "k1", "x": 2})
+
+
+def test_leader_is_not_counted_as_duplicate(handler, client, register):
+    from core.metrics import metrics
+    register("test_quick", lambda cmd: Quick())
+    counter = metrics.counter("agent_command_duplicates_total", type="test_quick")
+    before = counter.value
+    call(handler, client, {"type": "command", "data": {"type": "test_quick", "idempotency_key": "once"}})
+    assert counter.value == before
+    second = call(handler, client, {"type": "command", "data": {"type": "test_quick", "idempotency_key": "once"}})
+    assert second.get("duplicate") and counter.value == before + 1
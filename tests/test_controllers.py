@@ -0,0 +1,57 @@
+# tests/test_controllers.py
+import struct
+import time
+
+import pytest
+
+from core.controllers import ControllerRegistry
+
+
+@pytest.fixture
+def ws_client():
+    from core.websocket_client import WebSocketClient
+    client = WebSocketClient()
+    client.controllers = ControllerRegistry(ttl=60)
+    yield client
+    client.stop()
+
+
+def age(registry, seconds):
+    for info in registry._controllers.values():
+        info["last_seen"] -= seconds
+
+
+def test_idle_controller_expires_without_liveness():
+    registry = ControllerRegistry(ttl=60)
+    registry.add("viewer")
+    age(registry, 120)
+    assert registry.active() == []
+
+
+def test_relay_pong_does_not_refresh_controllers(ws_client):
+    ws_client.controllers.add("viewer")
+    age(ws_client.controllers, 120)
+    ws_client._on_pong(ws_client.ws, struct.pack(">d", time.monotonic()))
+    assert ws_client.controllers.active() == []
+
+
+def test_controller_frame_refreshes_only_its_sender(ws_client):
+    ws_client.controllers.add("viewer")
+    ws_client.controllers.add("other")
+    age(ws_client.controllers, 120)
+    ws_client._on_message(ws_client.ws, '{"type": "ping", "from": "viewer", "ts": 1}')
+    assert ws_client.controllers.active() == ["viewer"]
+
+
+def test_relay_presence_list_syncs_controllers(ws_client):
+    ws_client.controllers.add("gone")
+    ws_client.controllers.add("viewer")
+    age(ws_client.controllers, 120)
+    ws_client._on_message(ws_client.ws, '{"type": "controllers", "controller_ids": ["viewer", "new"]}')
+    assert sorted(ws_client.controllers.active()) == ["new", "viewer"]
+
+
+def test_disconnect_event_removes_controller(ws_client):
+    ws_client.controllers.add("viewer")
+    ws_client._on_message(ws_client.ws, '{"type": "controller_disconnected", "controller_id": "viewer"}')
+    assert ws_client.controllers.active() == []
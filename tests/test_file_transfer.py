@@ -0,0 +1,172 @@
+# tests/test_file_transfer.py
+import hashlib
+import os
+import threading
+
+from conftest import call
+from core.command_executor import ICommand
+from core.protocol import Codec, pack_binary_frame
+
+
+def send_chunk(handler, client, codec, transfer_id, offset, blob, binary_field="chunk"):
+    """Encode chunk như controller (binary frame) rồi decode như agent trước khi enqueue."""
+    frame = {"type": "command",
+             "data": {"type": "file_chunk", "transfer_id": transfer_id, "offset": offset,
+                      "command_id": os.urandom(8).hex()}}
+    if binary_field == "data":
+        # controller đặt blob dưới "data" — trùng tên với dict command
+        encoded = pack_binary_frame({**frame, "binary_field": "data", "size": len(blob)}, blob)
+    else:
+        encoded, _ = codec.encode({**frame, binary_field: blob})
+    decoded = codec.decode(encoded)
+    handler.enqueue_command(decoded)
+    return client.wait_for(lambda p: p.get("command_id") == frame["data"]["command_id"])
+
+
+def test_binary_frame_upload_writes_file(handler, client, tmp_path):
+    data = os.urandom(700_000)
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = str(tmp_path / "upload.bin")
+    codec = Codec("json")
+
+    ready = call(handler, client, {"type": "command", "data": {
+        "type": "file_upload", "path": path, "size": len(data), "sha256": sha256}})
+    assert ready["status"] == "success" and ready["offset"] == 0
+
+    chunk = 256 * 1024
+    for i, offset in enumerate(range(0, len(data), chunk)):
+        ack = send_chunk(handler, client, codec, ready["transfer_id"], offset, data[offset:offset + chunk],
+                         binary_field="data" if i % 2 else "chunk")
+        assert ack["type"] == "file_ack"
+        assert ack["status"] in ("running", "success"), ack
+        assert ack["offset"] == min(offset + chunk, len(data))
+
+    assert ack["status"] == "success" and ack["sha256"] == sha256
+    with open(path, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == sha256
+    assert not os.path.exists(path + ".part")
+
+
+def test_empty_chunk_is_an_error(handler, client, tmp_path):
+    path = str(tmp_path / "empty.bin")
+    ready = call(handler, client, {"type": "command", "data": {"type": "file_upload", "path": path, "size": 10}})
+    ack = call(handler, client, {"type": "command", "data": {
+        "type": "file_chunk", "transfer_id": ready["transfer_id"], "offset": 0}})
+    assert ack["status"] == "error"
+    assert ack["expected_offset"] == 0
+
+
+def test_upload_resumes_from_part_file(handler, client, tmp_path):
+    data = os.urandom(300_000)
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = str(tmp_path / "resume.bin")
+    codec = Codec("json")
+
+    first = call(handler, client, {"type": "command", "data": {
+        "type": "file_upload", "path": path, "size": len(data), "sha256": sha256}})
+    send_chunk(handler, client, codec, first["transfer_id"], 0, data[:100_000])
+
+    # mất kết nối: controller mở lại upload cùng path, agent tiếp tục từ .part
+    again = call(handler, client, {"type": "command", "data": {
+        "type": "file_upload", "path": path, "size": len(data), "sha256": sha256}})
+    assert again["offset"] == 100_000
+    ack = send_chunk(handler, client, codec, again["transfer_id"], 100_000, data[100_000:])
+    assert ack["status"] == "success" and ack["sha256"] == sha256
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_wrong_offset_keeps_session(handler, client, tmp_path):
+    path = str(tmp_path / "offset.bin")
+    codec = Codec("json")
+    ready = call(handler, client, {"type": "command", "data": {"type": "file_upload", "path": path, "size": 8}})
+    ack = send_chunk(handler, client, codec, ready["transfer_id"], 4, b"abcd")
+    assert ack["status"] == "error" and ack["expected_offset"] == 0
+    ack = send_chunk(handler, client, codec, ready["transfer_id"], 0, b"abcdefgh")
+    assert ack["status"] == "success"
+
+
+def _download(handler, client, path, offset, ack_until, transfer_id):
+    """Chạy file_download, ack chunk tới `ack_until` byte rồi ngừng ack (như mất kết nối)."""
+    command_id = os.urandom(8).hex()
+    chunks = {}
+
+    def on_chunk(payload):
+        if payload.get("type") != "file_chunk" or payload.get("command_id") != command_id:
+            return False
+        end = payload["offset"] + len(payload["data"])
+        if payload["offset"] not in chunks:
+            chunks[payload["offset"]] = payload["data"]
+            if end <= ack_until:
+                handler.enqueue_command({"type": "command", "data": {
+                    "type": "file_ack", "transfer_id": transfer_id, "offset": end}})
+        return False
+
+    handler.enqueue_command({"type": "command", "data": {
+        "type": "file_download", "command_id": command_id, "path": path, "offset": offset,
+        "chunk_size": 4096, "window": 2, "transfer_id": transfer_id}})
+    # predicate chạy lại trên mọi payload mỗi khi có frame mới: ack chunk ngay khi tới
+    result = client.wait_for(lambda p: on_chunk(p) or (p.get("command_id") == command_id
+                                                       and p.get("status") != "running"))
+    return result, chunks
+
+
+def test_download_resumes_from_acked_offset(handler, client, tmp_path, monkeypatch):
+    from core import file_transfer
+    monkeypatch.setattr(file_transfer, "ACK_TIMEOUT", 0.3)
+    data = os.urandom(40_000)
+    path = str(tmp_path / "download.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    first, received = _download(handler, client, path, 0, 3 * 4096, "t1")
+    assert first["status"] == "stalled" and first["acked"] == 3 * 4096
+    assert first["size"] == len(data)
+
+    resumed, rest = _download(handler, client, path, first["acked"], len(data), "t2")
+    assert resumed["status"] == "success"
+    assert min(rest) == first["acked"]
+    # sha256 luôn tính trên toàn file, kể cả phần đã gửi trước khi resume
+    assert resumed["sha256"] == hashlib.sha256(data).hexdigest()
+    received = {k: v for k, v in received.items() if k < first["acked"]}
+    assembled = b"".join(v for _, v in sorted({**received, **rest}.items()))
+    assert assembled == data
+
+
+def test_download_offset_past_end_is_an_error(handler, client, tmp_path):
+    path = str(tmp_path / "short.bin")
+    with open(path, "wb") as f:
+        f.write(b"abc")
+    result = call(handler, client, {"type": "command", "data": {"type": "file_download", "path": path, "offset": 10}})
+    assert result["status"] == "error"
+
+
+class Busy(ICommand):
+    def __init__(self, release):
+        self.release = release
+
+    def execute(self):
+        self.release.wait(10)
+        return {"type": "command_result", "status": "success"}
+
+
+def test_download_acks_bypass_busy_worker_slots(handler, client, tmp_path, monkeypatch, register):
+    from core import file_transfer
+    from core.command_handler import URGENT_RESERVED_SLOTS
+    monkeypatch.setattr(file_transfer, "ACK_TIMEOUT", 0.5)
+    data = os.urandom(40_000)
+    path = str(tmp_path / "busy.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    # lệnh chậm chiếm mọi slot không khẩn, chỉ chừa một slot cho chính file_download
+    release = threading.Event()
+    register("test_busy", lambda cmd: Busy(release), timeout=30, concurrency=8)
+    for _ in range(handler.max_workers - URGENT_RESERVED_SLOTS - 1):
+        handler.enqueue_command({"type": "command", "data": {"type": "test_busy"}})
+    try:
+        result, chunks = _download(handler, client, path, 0, len(data), "busy")
+        assert result["status"] == "success", result
+        assert b"".join(v for _, v in sorted(chunks.items())) == data
+    finally:
+        release.set()
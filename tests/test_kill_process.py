@@ -0,0 +1,30 @@
+# tests/test_kill_process.py
+import subprocess
+import sys
+
+import pytest
+
+from core.command_executor import KillProcessCommand
+
+
+@pytest.fixture
+def victim():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def test_invalid_targets_get_their_own_error(victim):
+    result = KillProcessCommand([{"name": "x"}, ["y"], True, victim.pid], dry_run=True).execute()
+    assert result["status"] == "success"
+    assert [bool(r["errors"]) for r in result["results"]] == [True, True, True, False]
+    assert "Invalid target" in result["results"][0]["errors"][0]["error"]
+    assert result["results"][3]["processes"][0]["pid"] == victim.pid
+
+
+def test_process_matching_two_targets_is_reported_for_both(victim):
+    result = KillProcessCommand([victim.pid, str(victim.pid)]).execute()
+    assert victim.wait(5) is not None
+    assert [[p["pid"] for p in r["processes"]] for r in result["results"]] == [[victim.pid], [victim.pid]]
+    assert result["message"].startswith("Killed 1 process(es)")
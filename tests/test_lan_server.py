@@ -0,0 +1,17 @@
+# tests/test_lan_server.py
+from core.config import Config
+from core.lan_server import start_lan_server
+
+
+def test_lan_defaults_to_loopback():
+    assert Config().lan_host == "127.0.0.1"
+
+
+def test_startup_log_does_not_contain_token(handler, capsys, monkeypatch):
+    uvicorn = __import__("pytest").importorskip("uvicorn")
+    monkeypatch.setattr(uvicorn.Server, "run", lambda self: None)
+    server = start_lan_server(handler, 18765)
+    out = capsys.readouterr().out
+    assert server is not None and server.config.host == "127.0.0.1"
+    assert Config().lan_token() not in out
+    assert Config().lan_token_fingerprint() in out
@@ -0,0 +1,124 @@
+# tests/test_main_window.py
+import threading
+
+import pytest
+
+pytest.importorskip("tkinter")
+from ui import main_window  # noqa: E402
+from ui.main_window import MainWindow  # noqa: E402
+
+
+class FakeText:
+    """Thay tk.Text: mỗi phần tử của lines là một dòng (kèm tag); không có tag_config."""
+
+    def __init__(self):
+        self.lines = []
+        self.inserts = 0
+        self.thread = None
+
+    def config(self, **kwargs):
+        pass
+
+    def insert(self, index, text, tag=None):
+        self.thread = threading.current_thread()
+        self.inserts += 1
+        self.lines.append((text.rstrip("\n"), tag))
+
+    def index(self, index):
+        assert index == "end-1c"
+        return f"{len(self.lines) + 1}.0"       # dòng trống sau "\n" cuối như tk.Text
+
+    def delete(self, start, end):
+        assert start == "1.0"
+        del self.lines[:int(end.split(".")[0]) - 1]
+
+    def see(self, index):
+        pass
+
+
+class FakeLabel:
+    def __init__(self):
+        self.configs = []
+
+    def config(self, **kwargs):
+        self.configs.append(kwargs)
+
+
+class FakeSpeech:
+    def __init__(self):
+        self.said = []
+
+    def say(self, text):
+        self.said.append(text)
+
+
+@pytest.fixture
+def window():
+    """MainWindow không tạo Tk thật (không có display): chỉ phần hàng đợi UI."""
+    import queue
+    from types import SimpleNamespace
+    win = MainWindow.__new__(MainWindow)
+    win._ui_queue = queue.Queue()
+    win._connected = False
+    win.chat_box = FakeText()
+    win.status_label = FakeLabel()
+    win.speech = FakeSpeech()
+    win.client = SimpleNamespace(rtt_ms=None)
+    win.scheduled = []
+    win.after = lambda ms, callback: win.scheduled.append((ms, callback))
+    win.state = lambda: "normal"
+    win.lift = win.focus_force = win.deiconify = lambda: None
+    return win
+
+
+def test_callbacks_from_other_threads_only_queue(window):
+    def websocket_thread():
+        for i in range(10):
+            window.display_chat(f"controller: {i}")
+        window.update_status(True)
+        window.update_rtt(42.0)
+    thread = threading.Thread(target=websocket_thread)
+    thread.start()
+    thread.join()
+    assert window.chat_box.inserts == 0 and window.status_label.configs == []
+
+    window._drain_ui_queue()                            # Tk thread
+    assert window.chat_box.thread is threading.current_thread()
+    assert [line for line, _ in window.chat_box.lines] == [f"controller: {i}" for i in range(10)]
+    assert window.status_label.configs == [{"text": "🟢 Connected · 42 ms", "foreground": "green"}]
+    assert window.scheduled == [(main_window.UI_POLL_MS, window._drain_ui_queue)]
+
+
+def test_drain_is_bounded_per_pass(window, monkeypatch):
+    monkeypatch.setattr(main_window, "UI_BATCH_SIZE", 5)
+    for i in range(12):
+        window.display_chat(f"controller: {i}")
+    window._drain_ui_queue()
+    assert len(window.chat_box.lines) == 5
+    window._drain_ui_queue()
+    window._drain_ui_queue()
+    assert len(window.chat_box.lines) == 12 and len(window.scheduled) == 3
+
+
+def test_only_latest_status_is_applied(window):
+    for connected in (True, False, True, False):
+        window.update_status(connected)
+    window._drain_ui_queue()
+    assert window.status_label.configs == [{"text": "🔴 Disconnected", "foreground": "red"}]
+
+
+def test_chat_history_is_capped(window, monkeypatch):
+    monkeypatch.setattr(main_window, "MAX_CHAT_LINES", 20)
+    for i in range(100):
+        window.display_chat(f"controller: {i}")
+    window._drain_ui_queue()
+    lines = [line for line, _ in window.chat_box.lines]
+    assert len(lines) < 20 and lines[-1] == "controller: 99"
+
+
+def test_tags_and_speech(window):
+    window.display_chat("You: xin chào")
+    window.display_chat("controller: chào bạn")
+    window._drain_ui_queue()
+    assert window.chat_box.lines == [("You: xin chào", "selfmsg"), ("controller: chào bạn", "servermsg")]
+    assert window.speech.said == [" chào bạn"]          # chỉ đọc tin từ controller
@@ -0,0 +1,107 @@
+# tests/test_metrics.py
+import random
+import re
+import socket
+import time
+import urllib.request
+
+import pytest
+
+from conftest import call
+from core.metrics import LATENCY_BUCKETS, Histogram, Metrics, metrics, serve_metrics
+
+
+def test_quantile_of_uniform_distribution():
+    hist = Histogram(buckets=(0.25, 0.5, 0.75, 1.0))
+    rng = random.Random(1)
+    for _ in range(20_000):
+        hist.observe(rng.random())
+    # trong mỗi bucket phân bố đều -> nội suy tuyến tính gần như chính xác
+    for q in (0.1, 0.5, 0.9, 0.99):
+        assert hist.quantile(q) == pytest.approx(q, abs=0.01)
+
+
+def test_quantile_stays_inside_the_observed_bucket():
+    hist = Histogram()
+    for _ in range(100):
+        hist.observe(0.003)
+    assert 0.0025 <= hist.quantile(0.5) <= 0.005
+    assert 0.0025 <= hist.quantile(0.99) <= 0.005
+    snapshot = hist.snapshot()
+    assert snapshot["count"] == 100 and snapshot["sum"] == pytest.approx(0.3)
+    assert 2.5 <= snapshot["p50_ms"] <= 5
+
+
+def test_quantile_edge_cases():
+    hist = Histogram()
+    assert hist.quantile(0.5) is None
+    hist.observe(10_000)                       # vượt bucket cuối -> chặn ở mốc lớn nhất
+    assert hist.quantile(0.99) == LATENCY_BUCKETS[-1]
+
+
+def test_prometheus_text_format():
+    registry = Metrics()
+    for value in (0.002, 0.02, 0.2, 2):
+        registry.observe("agent_command_execute_seconds", value, type="shell")
+    registry.inc("agent_commands_total", type="shell")
+    registry.inc("agent_commands_total", 2, type="lock")
+    registry.gauge("agent_ws_rtt_ms", lambda: 12.5)
+    registry.gauge("agent_broken", lambda: 1 / 0)
+    lines = registry.render_prometheus().splitlines()
+
+    buckets = [line for line in lines if line.startswith("agent_command_execute_seconds_bucket")]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1
+    assert buckets[0] == 'agent_command_execute_seconds_bucket{type="shell",le="0.001"} 0'
+    assert buckets[-1] == 'agent_command_execute_seconds_bucket{type="shell",le="+Inf"} 4'
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)            # bucket cộng dồn
+    assert 'agent_command_execute_seconds_count{type="shell"} 4' in lines
+    (total,) = [line for line in lines if line.startswith('agent_command_execute_seconds_sum{type="shell"} ')]
+    assert float(total.rsplit(" ", 1)[1]) == pytest.approx(2.222)
+    assert 'agent_commands_total{type="lock"} 2' in lines
+    assert 'agent_commands_total{type="shell"} 1' in lines
+    assert "agent_ws_rtt_ms 12.5" in lines
+    assert not any(line.startswith("agent_broken") for line in lines)   # gauge lỗi bị bỏ qua
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? \S+$')
+    assert all(sample.match(line) for line in lines)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    pytest.importorskip("fastapi")
+    pytest.importorskip("uvicorn")
+    metrics.inc("agent_test_scrapes_total")
+    port = free_port()
+    server = serve_metrics(port)
+    try:
+        deadline = time.monotonic() + 10
+        while not server.started and time.monotonic() < deadline:
+            time.sleep(0.02)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain")
+            body = response.read().decode("utf-8")
+    finally:
+        server.should_exit = True
+    assert "agent_test_scrapes_total 1" in body.splitlines()
+
+
+def test_metrics_endpoint_disabled_on_port_zero():
+    assert serve_metrics(0) is None
+
+
+def test_agent_stats_command(handler, client):
+    call(handler, client, {"type": "command", "data": {"type": "get_agent_stats"}})
+    result = call(handler, client, {"type": "command", "data": {"type": "get_agent_stats"}})
+    assert result["type"] == "agent_stats" and result["status"] == "success"
+    stats = result["metrics"]
+    assert stats["uptime_s"] >= 0
+    assert stats["counters"]["agent_commands_total"]["type=get_agent_stats"] >= 2
+    execute = stats["histograms"]["agent_command_execute_seconds"]["type=get_agent_stats"]
+    assert execute["count"] >= 1 and execute["p50_ms"] is not None
+    assert isinstance(stats["gauges"], dict)
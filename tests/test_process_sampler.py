@@ -0,0 +1,51 @@
+# tests/test_process_sampler.py
+import time
+
+from core.process_sampler import ProcessSampler, ProcessSubscription
+
+
+def _row(pid, cpu, memory=1.0, name="app"):
+    return {"pid": pid, "name": name, "user": "u", "cpu": cpu, "memory": memory}
+
+
+def _sampler(table):
+    sampler = ProcessSampler(interval=1.0)
+    sampler.table = table
+    return sampler
+
+
+def test_slow_drift_is_reported_against_last_sent_value():
+    sent = []
+    sub = ProcessSubscription("s1", lambda diff: sent.append(diff) or True, 60)
+    sub.sent = {1: _row(1, 1.0)}
+    sampler = _sampler({1: _row(1, 1.3)})
+    sampler._push(sub)                  # 0.3 so với lần đã gửi: chưa đủ
+    sampler.table = {1: _row(1, 1.6)}
+    sampler._push(sub)                  # 0.6 so với lần đã gửi (dù chỉ 0.3 so với lần quét trước)
+    assert [d["changed"] for d in sent] == [[_row(1, 1.6)]]
+    assert sub.sent[1]["cpu"] == 1.6
+
+
+def test_failed_push_is_resent():
+    results = [False, True]
+    sent = []
+    sub = ProcessSubscription("s1", lambda diff: sent.append(diff) or results.pop(0), 60)
+    sampler = _sampler({1: _row(1, 5.0), 2: _row(2, 0.0)})
+    sub.sent = {1: _row(1, 5.0), 3: _row(3, 0.0)}
+    sampler._push(sub)
+    sampler._push(sub)
+    assert sent[0] == sent[1] == {"added": [_row(2, 0.0)], "removed": [3], "changed": []}
+    assert set(sub.sent) == {1, 2}
+
+
+def test_subscription_lease_and_renewal(monkeypatch):
+    sampler = ProcessSampler(interval=1.0)
+    monkeypatch.setattr(sampler, "ensure_running", lambda: None)
+    sub = sampler.subscribe("s1", lambda diff: True, lease=30, baseline=[_row(1, 0.0)])
+    assert 25 < sub.expires - time.monotonic() <= 30
+    assert set(sub.sent) == {1}
+    renewed = sampler.subscribe("s1", lambda diff: True, lease=120, baseline=[_row(2, 0.0)])
+    assert renewed is sub and sub.expires - time.monotonic() > 100
+    assert set(sub.sent) == {2}     # snapshot mới là baseline mới
+    sampler.subscribe("s2", lambda diff: True, lease=10 ** 9)
+    assert sampler._subscribers["s2"].expires - time.monotonic() <= 3600
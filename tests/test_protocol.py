@@ -0,0 +1,72 @@
+# tests/test_protocol.py
+import pytest
+
+from core.protocol import (BINARY_FIELD, COMPRESS_THRESHOLD, FLAG_DEFLATE, OPCODE_BINARY, OPCODE_TEXT, Codec,
+                           msgpack, pack_binary_frame)
+
+needs_msgpack = pytest.mark.skipif(msgpack is None, reason="msgpack not installed")
+
+
+def test_json_text_round_trip():
+    payload = {"type": "command_result", "status": "success", "data": {"n": [1, 2, 3]}, "text": "xin chào"}
+    data, opcode = Codec("json").encode(payload)
+    assert opcode == OPCODE_TEXT and isinstance(data, str)
+    assert Codec("json").decode(data) == payload
+
+
+def test_json_binary_frame_round_trip():
+    blob = bytes(range(256)) * 10
+    payload = {"type": "file_chunk", "status": "running", "offset": 4096, "data": blob}
+    data, opcode = Codec("json").encode(payload)
+    assert opcode == OPCODE_BINARY and blob in data       # bytes thô, không base64
+    assert Codec("json").decode(data) == payload
+
+
+def test_binary_field_colliding_with_header_key_is_kept_apart():
+    frame = pack_binary_frame({"type": "command", "data": {"type": "file_chunk"},
+                               "binary_field": "data", "size": 3}, b"abc")
+    decoded = Codec("json").decode(frame)
+    assert decoded["data"] == {"type": "file_chunk"}
+    assert decoded[BINARY_FIELD] == b"abc"
+
+
+@needs_msgpack
+def test_msgpack_round_trip_with_nested_bytes():
+    payload = {"type": "screen_frame", "tiles": [{"x": 0, "data": b"\x00\x01"}, {"x": 8, "data": b"\xff"}],
+               "data": b"blob", "n": 1.5, "none": None}
+    data, opcode = Codec("msgpack").encode(payload)
+    assert opcode == OPCODE_BINARY
+    assert Codec("msgpack").decode(data) == payload
+
+
+@needs_msgpack
+def test_msgpack_deflate_only_above_threshold():
+    codec = Codec("msgpack", compress=True)
+    small = {"type": "pong", "ts": 1}
+    data, _ = codec.encode(small)
+    assert data[0] & FLAG_DEFLATE == 0
+    large = {"type": "command_result", "output": "lorem ipsum " * COMPRESS_THRESHOLD}
+    data, _ = codec.encode(large)
+    assert data[0] & FLAG_DEFLATE
+    assert len(data) < len(large["output"])
+    assert codec.decode(data) == large
+
+
+@pytest.mark.parametrize("name", ["json", pytest.param("msgpack", marks=needs_msgpack)])
+@pytest.mark.parametrize("payload", [
+    {"type": "command_result", "status": "success"},
+    {"type": "file_chunk", "offset": 0, "data": b"\x00" * 2048},
+    {},
+])
+def test_fanout_adds_envelope_per_recipient(name, payload):
+    codec = Codec(name, compress=True)
+    envelopes = [{"to": "a", "client_id": "a"}, {"to": "b", "client_id": "b"}]
+    frames = list(codec.encode_fanout(payload, envelopes))
+    assert len(frames) == 2
+    for (data, _), env in zip(frames, envelopes):
+        assert codec.decode(data) == {**env, **payload}
+
+
+def test_fanout_payload_keys_win_over_envelope():
+    data, _ = next(Codec("json").encode_fanout({"to": "payload"}, [{"to": "env", "agent_id": "x"}]))
+    assert Codec("json").decode(data) == {"to": "payload", "agent_id": "x"}
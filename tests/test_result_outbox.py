@@ -0,0 +1,282 @@
+# tests/test_result_outbox.py
+import threading
+import time
+
+import pytest
+
+from conftest import call
+from core.result_outbox import ResultOutbox, RECORD
+
+
+@pytest.fixture
+def outbox_path(tmp_path):
+    return str(tmp_path / "outbox.log")
+
+
+def payloads(outbox, after=0):
+    return [(seq, payload["i"]) for seq, payload in outbox.pending(after)]
+
+
+def test_append_assigns_increasing_seq(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    seqs = [outbox.append({"type": "command_result", "i": i})[0] for i in range(3)]
+    assert seqs == [1, 2, 3]
+    _, payload = outbox.append({"type": "command_result", "i": 3})
+    assert payload["result_seq"] == 4
+    assert payloads(outbox) == [(1, 0), (2, 1), (3, 2), (4, 3)]
+    assert payloads(outbox, after=2) == [(3, 2), (4, 3)]
+
+
+def test_ack_is_cumulative(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    for i in range(5):
+        outbox.append({"type": "command_result", "i": i})
+    outbox.ack(3)
+    assert payloads(outbox) == [(4, 3), (5, 4)]
+    outbox.ack(2)                       # ack cũ tới muộn không làm gì
+    assert len(outbox) == 2
+    outbox.ack(5)
+    assert len(outbox) == 0
+
+
+def test_unacked_results_survive_restart(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    for i in range(4):
+        outbox.append({"type": "command_result", "i": i})
+    outbox.ack(1)
+    outbox._file.close()
+
+    reopened = ResultOutbox(outbox_path)
+    assert payloads(reopened) == [(2, 1), (3, 2), (4, 3)]
+    # seq tiếp tục tăng, không dùng lại seq đã cấp
+    assert reopened.append({"type": "command_result", "i": 4})[0] == 5
+
+
+def test_seq_continues_after_full_ack_and_restart(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    for i in range(3):
+        outbox.append({"type": "command_result", "i": i})
+    outbox.ack(3)                       # file được compact về chỉ còn mốc seq
+    outbox._file.close()
+    reopened = ResultOutbox(outbox_path)
+    assert len(reopened) == 0
+    assert reopened.append({"type": "command_result", "i": 0})[0] == 4
+
+
+def test_torn_tail_record_is_ignored(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    outbox.append({"type": "command_result", "i": 0})
+    outbox.append({"type": "command_result", "i": 1})
+    outbox._file.close()
+    with open(outbox_path, "r+b") as f:
+        f.seek(0, 2)
+        f.truncate(f.tell() - 3)        # tắt máy giữa lúc ghi record cuối
+    reopened = ResultOutbox(outbox_path)
+    assert payloads(reopened) == [(1, 0)]
+
+
+def test_binary_payload_round_trip(outbox_path):
+    outbox = ResultOutbox(outbox_path)
+    blob = bytes(range(256)) * 10
+    outbox.append({"type": "show_screenshot", "i": 0, "file": blob})
+    outbox._file.close()
+    (seq, payload), = ResultOutbox(outbox_path).pending()
+    assert seq == 1 and payload["file"] == blob and payload["type"] == "show_screenshot"
+
+
+def test_size_limit_drops_oldest(outbox_path):
+    outbox = ResultOutbox(outbox_path, max_bytes=RECORD.size * 20)
+    for i in range(50):
+        outbox.append({"type": "command_result", "i": i, "pad": "x" * 40})
+    kept = [i for _, i in payloads(outbox)]
+    assert kept == list(range(50 - len(kept), 50))
+    assert outbox.dropped == 50 - len(kept)
+
+
+# ----- WebSocketClient: outbox chỉ dùng khi relay báo hỗ trợ ack -----
+
+class FakeSocket:
+    sock = None
+
+
+@pytest.fixture
+def ws_client(tmp_path):
+    from core.websocket_client import WebSocketClient
+    client = WebSocketClient()
+    client.outbox = ResultOutbox(str(tmp_path / "client_outbox.log"))
+    client.controllers.add("test")
+    sent = []
+    client._send = lambda payload, label=None, ws=None: sent.append(payload) or True
+    client.sent = sent
+    yield client
+    client.handler.stop()
+
+
+def test_durable_result_skips_outbox_without_relay_acks(ws_client):
+    ws_client.ws = FakeSocket()
+    ws_client.send_result({"type": "command_result", "i": 0}, durable=True)
+    assert len(ws_client.outbox) == 0
+    assert ws_client.sent == [{"type": "command_result", "i": 0}]
+
+
+def start_sender(client, ws, start_seq=0):
+    """Chạy _outbox_sender của kết nối `ws` như _on_open (frame protocol đã tới)."""
+    ready = threading.Event()
+    ready.set()
+    thread = threading.Thread(target=client._outbox_sender, args=(ws, ready, start_seq), daemon=True)
+    thread.start()
+    return thread
+
+
+def stop_sender(client, thread):
+    with client._outbox_cond:
+        client.ws = None
+        client._outbox_cond.notify_all()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def wait_sent(client, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while len(client.sent) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return client.sent
+
+
+def test_durable_result_uses_outbox_with_relay_acks(ws_client):
+    ws = ws_client.ws = FakeSocket()
+    ws_client._on_message(ws, '{"type": "protocol", "codec": "json", "acks": true}')
+    sender = start_sender(ws_client, ws)
+    assert ws_client.send_result({"type": "command_result", "i": 0}, durable=True)
+    assert wait_sent(ws_client, 1)[0]["result_seq"] == 1
+    assert len(ws_client.outbox) == 1
+    ws_client._on_message(ws, '{"type": "ack", "result_seq": 1}')
+    assert len(ws_client.outbox) == 0
+    stop_sender(ws_client, sender)
+
+
+def test_replay_in_order_when_relay_acks(ws_client):
+    for i in range(3):
+        ws_client.outbox.append({"type": "command_result", "i": i})
+    ws_client.outbox.ack(1)
+    ws = ws_client.ws = FakeSocket()
+    ws_client._relay_acks = True
+    sender = start_sender(ws_client, ws, start_seq=ws_client.outbox.last_seq)
+    # kết quả mới xếp sau phần chưa ack của kết nối trước
+    ws_client.send_result({"type": "command_result", "i": 3}, durable=True)
+    sent = wait_sent(ws_client, 3)
+    assert [(p["result_seq"], p["i"]) for p in sent] == [(2, 1), (3, 2), (4, 3)]
+    stop_sender(ws_client, sender)
+
+
+def test_durable_result_is_only_sent_by_connection_sender(ws_client):
+    ws_client._relay_acks = True
+    ws_client.outbox.append({"type": "command_result", "i": 0})      # chưa ack từ kết nối cũ
+    # kết nối mới chưa replay: kết quả mới gửi thẳng sẽ được ack cộng dồn
+    # trước khi seq 1 kịp gửi lại
+    ws_client.ws = FakeSocket()
+    assert ws_client.send_result({"type": "command_result", "i": 1}, durable=True)
+    assert ws_client.sent == [] and len(ws_client.outbox) == 2
+
+
+def test_ack_not_blocked_by_slow_send(ws_client):
+    gate = threading.Event()
+    ws_client._send = lambda payload, label=None, ws=None: gate.wait(5) or True
+    ws = ws_client.ws = FakeSocket()
+    ws_client._relay_acks = True
+    sender = start_sender(ws_client, ws)
+    ws_client.send_result({"type": "command_result", "i": 0}, durable=True)
+    time.sleep(0.05)                                                 # sender đang kẹt trong lần gửi
+    started = time.monotonic()
+    ws_client.send_result({"type": "command_result", "i": 1}, durable=True)
+    ws_client._on_message(ws, '{"type": "ack", "result_seq": 1}')
+    assert time.monotonic() - started < 1.0
+    assert len(ws_client.outbox) == 1
+    gate.set()
+    stop_sender(ws_client, sender)
+
+
+def test_stale_results_dropped_when_relay_does_not_ack(ws_client, monkeypatch):
+    import core.websocket_client as wc
+    monkeypatch.setattr(wc, "PROTOCOL_WAIT", 0.05)
+    ws_client.outbox.append({"type": "command_result", "i": 0})      # từ lần chạy trước
+    start_seq = ws_client.outbox.last_seq
+    ws_client.outbox.append({"type": "command_result", "i": 1})      # giữ lại lúc chờ frame protocol
+    ws = ws_client.ws = FakeSocket()
+    ws_client._relay_acks = True
+    ws_client._outbox_sender(ws, threading.Event(), start_seq)       # không có frame protocol
+    assert ws_client.sent == [{"type": "command_result", "i": 1}]
+    assert len(ws_client.outbox) == 0 and not ws_client._relay_acks
+
+
+# ----- CommandHandler: bản sao từ cache / lệnh chạy chung không durable -----
+
+def test_cached_replies_are_not_durable(handler, client, monkeypatch):
+    from core.command_executor import CommandExecutor
+    # TTL mặc định 0.5s có thể hết giữa hai lệnh trên máy chậm
+    monkeypatch.setattr(CommandExecutor.spec("get_list_process"), "cache_ttl", 60)
+    # lệnh thứ hai có thể tới trước khi lệnh đầu kịp lưu cache -> chạy chung (coalesced)
+    first = call(handler, client, {"type": "command", "data": {"type": "get_list_process", "top": 1, "limit": 1}})
+    second = call(handler, client, {"type": "command", "data": {"type": "get_list_process", "top": 1, "limit": 1}})
+    assert first["status"] == "success" and (second.get("cached") or second.get("coalesced"))
+    assert client.durable[first["command_id"]] is True
+    assert client.durable[second["command_id"]] is False
+
+
+def test_bulk_results_are_not_durable(handler, client, register):
+    from core.command_executor import CommandExecutor, ICommand
+
+    class Photo(ICommand):
+        def execute(self):
+            return {"type": "command_result", "status": "success", "image": b"\xff" * 1024}
+
+    register("test_photo", lambda cmd: Photo(), durable=False)
+    result = call(handler, client, {"type": "command", "data": {"type": "test_photo"}})
+    assert result["status"] == "success"
+    assert client.durable[result["command_id"]] is False
+    # ảnh lớn hỏi lại được -> không chiếm chỗ của kết quả nhỏ (kill, lock...) trong outbox
+    assert not CommandExecutor.spec("screenshot").durable and not CommandExecutor.spec("get_capture").durable
+    assert CommandExecutor.spec("kill_process").durable
+
+
+# ----- End-to-end: relay giả lập cắt kết nối ngẫu nhiên -----
+
+def test_results_survive_flaky_relay(tmp_path, monkeypatch):
+    import core.websocket_client as wc
+    from bench.stubs import FlakyAckRelay
+    from core.config import Config
+
+    relay = FlakyAckRelay(drop_rate=0.1, seed=7).start()
+    monkeypatch.setattr(Config(), "server_url", relay.url)
+    monkeypatch.setattr(wc, "RECONNECT_BASE_DELAY", 0.05)
+    monkeypatch.setattr(wc, "RECONNECT_MAX_DELAY", 0.2)
+    client = wc.WebSocketClient()
+    client.outbox = ResultOutbox(str(tmp_path / "flaky_outbox.log"))
+    client.controllers.add("test")
+    try:
+        client.connect()
+        deadline = time.monotonic() + 5     # _on_open thay _protocol_ready cho mỗi kết nối
+        while not client._protocol_ready.is_set() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client._protocol_ready.is_set()
+        count = 60
+        for i in range(count):
+            client.send_result({"type": "command_result", "status": "success", "i": i}, durable=True)
+            time.sleep(0.002)
+
+        expected = set(range(1, count + 1))
+        deadline = time.monotonic() + 20
+        while not (expected <= relay.delivered() and len(client.outbox) == 0) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert relay.drops > 0
+        assert relay.delivered() == expected
+        assert len(client.outbox) == 0
+        # replay chỉ gửi lại từ seq chưa ack cũ nhất: không bao giờ nhảy cóc qua seq chưa tới
+        highest = 0
+        for seq in relay.received:
+            assert seq <= highest + 1, relay.received
+            highest = max(highest, seq)
+    finally:
+        client.stop()
+        client.outbox._file.close()
+        relay.stop()
@@ -0,0 +1,63 @@
+# tests/test_screen_stream.py
+import threading
+
+import pytest
+
+from core.protocol import Codec, OPCODE_BINARY
+
+
+def test_binary_screen_frame_round_trips_through_json_codec():
+    tiles = [b"\xff\xd8tile-one", b"\xff\xd8tile-two!"]
+    frame = {
+        "type": "screen_frame", "status": "running", "frame": 1,
+        "tiles": [{"x": 0, "y": 0, "w": 8, "h": 8, "offset": 0, "size": len(tiles[0])},
+                  {"x": 8, "y": 0, "w": 8, "h": 8, "offset": len(tiles[0]), "size": len(tiles[1])}],
+        "data": b"".join(tiles),
+    }
+    data, opcode = Codec("json").encode(frame)
+    assert opcode == OPCODE_BINARY
+    decoded = Codec("json").decode(data)
+    blob = decoded["data"]
+    assert [blob[t["offset"]:t["offset"] + t["size"]] for t in decoded["tiles"]] == tiles
+
+
+def test_relay_reports_failure_without_controllers():
+    from core.websocket_client import WebSocketClient
+    client = WebSocketClient()
+    try:
+        client.ws = object()
+        client._send = lambda payload, label=None: True
+        assert client.send_result({"type": "screen_frame", "status": "running"}) is False
+        client.controllers.add("viewer")
+        assert client.send_result({"type": "screen_frame", "status": "running"}) is True
+    finally:
+        client.handler.stop()
+
+
+def test_stream_stops_when_emit_fails():
+    screen_stream = pytest.importorskip("core.screen_stream")
+    from PIL import Image
+    results = [True, False]
+    done = threading.Event()
+
+    def emit(frame):
+        ok = results.pop(0)
+        if not ok:
+            done.set()
+        return ok
+
+    streamer = screen_stream.ScreenStreamer(emit, fps=20)
+    streamer._grab = lambda: Image.new("RGB", (32, 32), (len(results) * 40, 0, 0))
+    streamer.start()
+    assert done.wait(5)
+    assert streamer._stop.wait(2)
+
+
+def test_start_command_defers_screen_stream_import(monkeypatch):
+    import sys
+    from core.command_executor import CommandExecutor
+    # factory chạy trên dispatch loop: không được kéo pyautogui/PIL vào lúc đó
+    monkeypatch.delitem(sys.modules, "core.screen_stream", raising=False)
+    command = CommandExecutor.create({"type": "start_screen_stream", "fps": 5, "binary": False})
+    assert "core.screen_stream" not in sys.modules
+    assert command.options == {"fps": 5, "binary": False}
@@ -0,0 +1,128 @@
+# tests/test_speech_scheduler.py
+import threading
+import time
+
+import pytest
+
+from core import tts_service
+from core.speech_scheduler import SpeechScheduler
+
+
+class FakeTTS:
+    """Thay tts_service: câu phát dạng stream bị giữ tới khi release được set."""
+
+    def __init__(self, monkeypatch):
+        self.calls = []
+        self.playing = threading.Event()
+        self.release = threading.Event()
+        self._cond = threading.Condition()
+        monkeypatch.setattr(tts_service, "synthesize_and_play", self.stream)
+        monkeypatch.setattr(tts_service, "synthesize", self.synthesize)
+        monkeypatch.setattr(tts_service, "play_file", self.play_file)
+
+    def _record(self, call):
+        with self._cond:
+            self.calls.append(call)
+            self._cond.notify_all()
+
+    def stream(self, text, voice_gender="FEMALE"):
+        self._record(("stream", text))
+        self.playing.set()
+        self.release.wait(10)
+
+    def synthesize(self, text, voice_gender="FEMALE"):
+        self._record(("synthesize", text))
+        return f"{text}.mp3"
+
+    def play_file(self, path):
+        self._record(("play", path))
+
+    def wait_for(self, call, timeout=5.0):
+        with self._cond:
+            return self._cond.wait_for(lambda: call in self.calls, timeout)
+
+
+@pytest.fixture
+def tts(monkeypatch):
+    return FakeTTS(monkeypatch)
+
+
+@pytest.fixture
+def make_scheduler(tts):
+    """Tạo SpeechScheduler; khi xong bỏ hàng đợi và chờ worker rảnh trước khi gỡ FakeTTS."""
+    created = []
+
+    def _make(**kwargs):
+        created.append(SpeechScheduler(**kwargs))
+        return created[-1]
+
+    yield _make
+    for scheduler in created:
+        with scheduler._cond:
+            scheduler._cancel_all()
+    tts.release.set()
+    deadline = time.monotonic() + 5
+    while any(s._playing for s in created) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def texts(scheduler):
+    with scheduler._cond:
+        return [item["text"] for item in scheduler._items]
+
+
+def start_playing(tts, scheduler):
+    scheduler.say("đang phát")
+    assert tts.playing.wait(5)
+
+
+def test_item_queued_during_playback_is_prefetched(tts, make_scheduler):
+    scheduler = make_scheduler(max_queue=3, policy="drop_oldest")
+    start_playing(tts, scheduler)
+    scheduler.say("câu sau")
+    # tổng hợp trước trong lúc câu đầu vẫn đang phát
+    assert tts.wait_for(("synthesize", "câu sau"))
+    assert not tts.release.is_set()
+    tts.release.set()
+    assert tts.wait_for(("play", "câu sau.mp3"))
+    assert ("stream", "câu sau") not in tts.calls
+
+
+def test_idle_item_is_streamed_without_prefetch(tts, make_scheduler):
+    tts.release.set()
+    scheduler = make_scheduler(max_queue=3, policy="drop_oldest")
+    scheduler.say("một câu")
+    assert tts.wait_for(("stream", "một câu"))
+    time.sleep(0.05)
+    assert ("synthesize", "một câu") not in tts.calls
+
+
+def test_drop_oldest_policy(tts, make_scheduler):
+    scheduler = make_scheduler(max_queue=2, policy="drop_oldest")
+    start_playing(tts, scheduler)
+    for text in ("a", "b", "c"):
+        scheduler.say(text)
+    assert texts(scheduler) == ["b", "c"]
+    assert scheduler.dropped == 1
+
+
+def test_merge_policy(tts, make_scheduler):
+    scheduler = make_scheduler(max_queue=2, policy="merge")
+    start_playing(tts, scheduler)
+    for text in ("a", "b", "c"):
+        scheduler.say(text)
+    assert texts(scheduler) == ["a. b. c"]
+    assert scheduler.dropped == 0
+
+
+def test_skip_policy(tts, make_scheduler):
+    scheduler = make_scheduler(max_queue=2, policy="skip")
+    start_playing(tts, scheduler)
+    for text in ("a", "b", "c"):
+        scheduler.say(text)
+    assert texts(scheduler) == ["a", "b"]
+    assert scheduler.dropped == 1
+
+
+def test_unknown_policy_falls_back_to_drop_oldest(make_scheduler):
+    assert make_scheduler(max_queue=2, policy="nope").policy == "drop_oldest"
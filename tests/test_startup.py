@@ -0,0 +1,56 @@
+# tests/test_startup.py
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# chỉ được import khi lệnh / dịch vụ dùng tới chúng chạy lần đầu
+HEAVY_MODULES = ("pyautogui", "psutil", "PIL", "pystray", "requests", "playsound")
+
+
+def loaded_modules(script, tmp_path):
+    """Chạy script trong process riêng (test khác cùng process có thể đã import sẵn)."""
+    script += f"\nprint('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    env = {**os.environ, "HOME": str(tmp_path), "USERPROFILE": str(tmp_path)}
+    result = subprocess.run([sys.executable, "-c", "import sys\n" + script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    line = next(line for line in result.stdout.splitlines() if line.startswith("loaded:"))
+    return [m for m in line[len("loaded:"):].split(",") if m]
+
+
+def test_entry_point_imports_no_heavy_dependencies(tmp_path):
+    pytest.importorskip("tkinter")
+    assert loaded_modules("import ui.main_window", tmp_path) == []
+
+
+def test_client_startup_imports_no_heavy_dependencies(tmp_path):
+    script = (
+        "import core.websocket_client as wc\n"
+        "client = wc.WebSocketClient()\n"
+        "client.telegram.send_message('chưa cấu hình -> không tạo outbox')\n"
+    )
+    assert loaded_modules(script, tmp_path) == []
+
+
+def test_heavy_dependency_loads_with_its_command(tmp_path):
+    pytest.importorskip("psutil")
+    script = (
+        "from core.command_executor import CommandExecutor\n"
+        "assert 'psutil' not in sys.modules\n"
+        "result = CommandExecutor.create({'type': 'get_list_process', 'top': 1, 'limit': 1}).execute()\n"
+        "assert result['status'] == 'success', result\n"
+    )
+    assert "psutil" in loaded_modules(script, tmp_path)
+
+
+def test_startup_benchmark_reports_import_and_connect_time():
+    from bench import bench_startup
+    imported = bench_startup.import_time("core.websocket_client", runs=1)
+    assert imported["module"] == "core.websocket_client" and imported["total_ms"] > 0
+    assert imported["heaviest"] and all(entry["ms"] >= 0 for entry in imported["heaviest"])
+    connected = bench_startup.time_to_connected(runs=1)
+    assert connected.get("runs") == 1, connected
+    assert connected["median_ms"] > 0
@@ -0,0 +1,98 @@
+# tests/test_telegram_outbox.py
+import json
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+from bench.stubs import TelegramStub  # noqa: E402
+from core import telegram_service  # noqa: E402
+from core.config import Config  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fast_outbox(monkeypatch):
+    monkeypatch.setattr(telegram_service, "MIN_INTERVAL", 0.0)
+    monkeypatch.setattr(telegram_service, "COALESCE_WINDOW", 0.2)
+    monkeypatch.setattr(telegram_service, "BACKOFF_BASE", 0.05)
+
+
+@pytest.fixture
+def telegram(monkeypatch):
+    stub = TelegramStub().start()
+    cfg = Config()
+    monkeypatch.setattr(cfg, "telegram_token", "token")
+    monkeypatch.setattr(cfg, "telegram_chat_id", "chat")
+    monkeypatch.setattr(cfg, "telegram_api_base", stub.url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def make_outbox(tmp_path, telegram):
+    """Outbox gửi qua session thật tới TelegramStub; thread gửi chạy ngay trong __init__."""
+    def make(responses=()):
+        telegram.responses.extend(responses)
+        return telegram_service.TelegramOutbox(outbox_path=str(tmp_path / "outbox.json"),
+                                               spool_dir=str(tmp_path / "spool"))
+    return make
+
+
+def sent_texts(telegram):
+    return [json.loads(body)["text"] for _, method, _, body in telegram.requests if method == "sendMessage"]
+
+
+def test_short_messages_are_coalesced(make_outbox, telegram):
+    outbox = make_outbox()
+    for text in ("one", "two", "three"):
+        outbox.put_text(text)
+    assert outbox.flush(5)
+    assert sent_texts(telegram) == ["one\ntwo\nthree"]
+    assert outbox.sent == 3
+
+
+def test_rate_limit_waits_retry_after_then_delivers(make_outbox, telegram):
+    outbox = make_outbox([(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.3}})])
+    outbox.put_text("hello")
+    assert outbox.flush(5)
+    (first, *_), (second, *_) = telegram.requests
+    assert second - first >= 0.3                 # retry_after đọc từ body JSON của 429
+    assert sent_texts(telegram) == ["hello", "hello"]
+    assert outbox.sent == 1 and outbox.failed == 0
+
+
+def test_server_errors_are_retried_with_backoff(make_outbox, telegram):
+    outbox = make_outbox([(502, {"ok": False}), (503, {"ok": False})])
+    outbox.put_text("hello")
+    assert outbox.flush(5)
+    assert len(telegram.requests) == 3 and outbox.sent == 1
+
+
+def test_rejected_message_is_not_retried(make_outbox, telegram):
+    outbox = make_outbox([(400, {"ok": False, "description": "Bad Request: chat not found"})])
+    outbox.put_text("hello")
+    assert outbox.flush(5)
+    assert len(telegram.requests) == 1 and outbox.failed == 1
+
+
+def test_photo_bytes_are_uploaded_as_multipart(make_outbox, telegram, tmp_path):
+    outbox = make_outbox()
+    photo = b"\xff\xd8\xff" + bytes(2048)
+    outbox.put_photo(photo)
+    assert outbox.flush(5)
+    (_, method, content_type, body), = telegram.requests
+    assert method == "sendPhoto"
+    assert content_type.startswith("multipart/form-data; boundary=")
+    assert b'name="chat_id"\r\n\r\nchat\r\n' in body
+    assert b'name="photo"' in body and photo in body
+    assert outbox.sent == 1
+    assert list((tmp_path / "spool").iterdir()) == []    # file spool bị xoá sau khi gửi
+
+
+def test_pending_items_survive_restart(make_outbox, telegram, tmp_path):
+    pending = [{"kind": "text", "text": "queued before restart", "created": time.time() - 5, "attempts": 1}]
+    (tmp_path / "outbox.json").write_text(json.dumps(pending), encoding="utf-8")
+    outbox = make_outbox()
+    assert outbox.flush(5)
+    assert sent_texts(telegram) == ["queued before restart"]
+    assert json.loads((tmp_path / "outbox.json").read_text(encoding="utf-8")) == []
@@ -0,0 +1,36 @@
+# tests/test_telemetry.py
+from core.telemetry import Subscription, TelemetrySampler
+
+
+def _subscription(results):
+    sent = []
+
+    def emit(payload):
+        sent.append(payload)
+        return results.pop(0)
+    return Subscription("s1", emit, ("cpu",), 1.0, {}, 60), sent
+
+
+def test_failed_send_keeps_baseline():
+    sampler = TelemetrySampler()
+    sub, sent = _subscription([True, False, True])
+    sampler._deliver(sub, {"seq": 1}, {"cpu.percent": 10.0}, True, 100.0)
+    assert sub.sent == {"cpu.percent": 10.0}
+
+    # gửi hỏng: controller vẫn đang thấy 10.0
+    sampler._deliver(sub, {"seq": 2}, {"cpu.percent": 50.0}, False, 101.0)
+    assert sub.sent == {"cpu.percent": 10.0}
+    assert sub.dropped == 1 and not sub.sending
+
+    # nên lần sau vẫn thấy thay đổi dù sample giống lần hỏng
+    assert sub.delta({"cpu.percent": 50.0}, 102.0) == (False, {"cpu.percent": 50.0})
+    sampler._deliver(sub, {"seq": 3}, {"cpu.percent": 50.0}, False, 102.0)
+    assert sub.sent == {"cpu.percent": 50.0}
+    assert sub.delta({"cpu.percent": 50.0}, 103.0) is None
+
+
+def test_reply_reports_send_failure(handler, client, monkeypatch):
+    monkeypatch.setattr(client, "send_result", lambda *a, **k: False)
+    assert handler._reply("c1", {"type": "metrics_update"}) is False
+    assert handler._reply("c2", {"type": "metrics_update"}, sink=lambda p: False) is False
+    assert handler._reply("c3", {"type": "metrics_update"}, sink=lambda p: None) is True
@@ -0,0 +1,83 @@
+# tests/test_tts_service.py
+import io
+import os
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from bench.stubs import TTSStub  # noqa: E402
+from core import tts_service  # noqa: E402
+from core.config import Config  # noqa: E402
+
+
+@pytest.fixture
+def tts(tmp_path, monkeypatch):
+    stub = TTSStub().start()
+    monkeypatch.setattr(Config(), "tts_base_url", stub.url)
+    monkeypatch.setattr(tts_service, "cache", tts_service.TTSCache(str(tmp_path / "tts_cache")))
+    yield stub
+    stub.stop()
+
+
+class FakePlayer:
+    """Thay process player đọc mp3 từ stdin."""
+
+    def __init__(self):
+        self.stdin = io.BytesIO()
+        self.stdin.close = lambda: None     # giữ nội dung để kiểm tra sau khi "đóng"
+        self.waited = False
+
+    def wait(self):
+        self.waited = True
+
+
+def test_cache_miss_then_hit_requests_upstream_once(tts):
+    first = tts_service.synthesize("xin chào")
+    second = tts_service.synthesize("<speak>xin chào</speak>")     # tag SSML bị bỏ trước khi tạo khoá
+    assert first == second
+    with open(first, "rb") as f:
+        assert f.read() == TTSStub.AUDIO
+    assert tts.counts == {"xin chào": 1}
+    cache = tts_service.cache
+    assert (cache.hits, cache.misses) == (1, 1) and cache.hit_rate() == 0.5
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith(".part")]
+
+
+def test_evicts_least_recently_used_over_budget(tts):
+    cache = tts_service.cache
+    cache.budget_bytes = int(len(TTSStub.AUDIO) * 2.5)       # chứa được hai file
+    a = tts_service.synthesize("a")
+    b = tts_service.synthesize("b")
+    now = time.time()
+    os.utime(a, (now - 20, now - 20))
+    os.utime(b, (now - 10, now - 10))
+    assert tts_service.synthesize("a") == a                  # hit: a thành mới dùng gần nhất
+    c = tts_service.synthesize("c")
+    assert os.path.exists(a) and os.path.exists(c)
+    assert not os.path.exists(b)
+    assert tts.counts == {"a": 1, "b": 1, "c": 1}
+
+
+def test_stream_plays_while_downloading_and_caches(tts, monkeypatch):
+    player = FakePlayer()
+    played = []
+    monkeypatch.setattr(tts_service, "_open_stream_player", lambda: player)
+    monkeypatch.setattr(tts_service, "play_file", played.append)
+    tts_service.synthesize_and_play("đọc ngay")
+    assert player.stdin.getvalue() == TTSStub.AUDIO and player.waited
+    assert played == []                                      # player stream đã phát, không phát lại file
+
+    tts_service.synthesize_and_play("đọc ngay")              # lần sau: phát từ cache
+    assert len(played) == 1 and tts.counts == {"đọc ngay": 1}
+
+
+def test_without_stream_player_plays_downloaded_file(tts, monkeypatch):
+    played = []
+    monkeypatch.setattr(tts_service, "_open_stream_player", lambda: None)
+    monkeypatch.setattr(tts_service, "play_file", played.append)
+    tts_service.synthesize_and_play("không có player")
+    assert len(played) == 1
+    with open(played[0], "rb") as f:
+        assert f.read() == TTSStub.AUDIO
@@ -0,0 +1,125 @@
+# tests/test_websocket_client.py
+import threading
+import time
+
+import pytest
+
+import core.websocket_client as wc
+from core.config import Config
+
+
+@pytest.fixture
+def ws_client():
+    client = wc.WebSocketClient()
+    yield client
+    client.stop()
+
+
+class FakeSock:
+    def __init__(self, on_ping=None):
+        self.connected = True
+        self.pings = 0
+        self.aborted = threading.Event()
+        self.on_ping = on_ping
+
+    def ping(self, payload):
+        self.pings += 1
+        if self.on_ping:
+            self.on_ping()
+
+    def abort(self):
+        self.connected = False
+        self.aborted.set()
+
+
+class FakeApp:
+    """Thay WebSocketApp: run_forever mất kết nối ngay, bắn cả on_error lẫn on_close."""
+
+    instances = []
+    client = None
+    limit = 3           # tới socket thứ `limit` thì client ngừng kết nối lại
+
+    def __init__(self, url, on_open=None, on_message=None, on_close=None, on_error=None, on_pong=None):
+        self.on_close, self.on_error = on_close, on_error
+        self.sock = None
+        FakeApp.instances.append(self)
+
+    def run_forever(self):
+        if len(FakeApp.instances) >= FakeApp.limit:
+            FakeApp.client._should_reconnect = False
+        self.on_error(self, ConnectionResetError("reset by peer"))
+        self.on_close(self, 1006, "abnormal closure")
+
+    def close(self):
+        pass
+
+
+def test_error_and_close_on_same_socket_reconnect_once(ws_client, monkeypatch):
+    monkeypatch.setattr(wc, "WebSocketApp", FakeApp)
+    monkeypatch.setattr(ws_client, "_next_delay", lambda: 0.0)
+    FakeApp.instances, FakeApp.client = [], ws_client
+    ws_client.connect()
+    ws_client.connect()                 # gọi lại không mở thêm vòng kết nối thứ hai
+    ws_client._supervisor.join(2)
+    time.sleep(0.1)
+    # mỗi socket chết (on_error + on_close) chỉ sinh đúng một lần kết nối lại
+    assert len(FakeApp.instances) == FakeApp.limit
+    assert ws_client._failures == FakeApp.limit - 1
+
+
+def test_backoff_is_jittered_within_bounds(ws_client):
+    for failures in range(12):
+        ws_client._failures = failures
+        delays = [ws_client._next_delay() for _ in range(200)]
+        if failures == 0:
+            low, high = 0.0, wc.FIRST_RETRY_JITTER
+        else:
+            high = min(wc.RECONNECT_MAX_DELAY, wc.RECONNECT_BASE_DELAY * 2 ** (failures - 1))
+            low = high / 2
+        assert all(low <= d <= high for d in delays), (failures, min(delays), max(delays))
+        assert len(set(delays)) > 1     # có jitter: các agent không kết nối lại cùng lúc
+
+
+def test_backoff_resets_after_successful_connect(ws_client, monkeypatch):
+    from bench.stubs import ConnectRecorder
+    server = ConnectRecorder().start()
+    monkeypatch.setattr(Config(), "server_url", server.url)
+    try:
+        ws_client._failures = 6
+        ws_client.connect()
+        assert server.connected.wait(5)
+        deadline = time.monotonic() + 5
+        while ws_client._failures and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ws_client._failures == 0
+        assert ws_client._next_delay() <= wc.FIRST_RETRY_JITTER
+    finally:
+        ws_client.stop()
+        server.stop()
+
+
+def test_heartbeat_drops_connection_without_pong(ws_client, monkeypatch):
+    monkeypatch.setattr(Config(), "heartbeat_interval", 0.05)
+    monkeypatch.setattr(Config(), "heartbeat_timeout", 0.2)
+    ws = FakeApp("ws://relay")
+    ws.sock = FakeSock()
+    ws_client.ws = ws
+    ws_client._last_pong = time.monotonic()
+    threading.Thread(target=ws_client._heartbeat_loop, args=(ws,), daemon=True).start()
+    assert ws.sock.aborted.wait(2)
+    assert ws.sock.pings >= 1           # vẫn ping cho tới khi quá heartbeat_timeout
+
+
+def test_heartbeat_keeps_connection_while_pongs_arrive(ws_client, monkeypatch):
+    monkeypatch.setattr(Config(), "heartbeat_interval", 0.05)
+    monkeypatch.setattr(Config(), "heartbeat_timeout", 0.2)
+    ws = FakeApp("ws://relay")
+    ws.sock = FakeSock(on_ping=lambda: setattr(ws_client, "_last_pong", time.monotonic()))
+    ws_client.ws = ws
+    ws_client._last_pong = time.monotonic()
+    thread = threading.Thread(target=ws_client._heartbeat_loop, args=(ws,), daemon=True)
+    thread.start()
+    assert not ws.sock.aborted.wait(0.5)
+    ws_client.ws = None                 # kết nối được thay -> heartbeat của kết nối cũ thoát
+    thread.join(1)
+    assert not thread.is_alive()
@@ -3,12 +3,11 @@ import sys
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
+import queue
 import ctypes
-from PIL import Image, ImageDraw
-import pystray
 
 from core.telegram_service import TelegramService
-from core.tts_service import synthesize_and_play
+from core.speech_scheduler import SpeechScheduler
 if sys.platform == "win32":
     import winreg
 else:
@@ -17,6 +16,10 @@ else:
 from core.config import Config
 from core.websocket_client import WebSocketClient
 
+UI_POLL_MS = 50          # chu kỳ Tk thread lấy update từ hàng đợi
+UI_BATCH_SIZE = 200      # tối đa số update xử lý mỗi lần
+MAX_CHAT_LINES = 500     # quá số dòng này thì xoá dòng cũ nhất
+
 
 def remove_from_startup():
     try:
@@ -38,6 +41,7 @@ class MainWindow(tk.Tk):
         self.minsize(520, 500)
         self.configure(bg="#f5f6fa")
         self.telegram = TelegramService()
+        self.speech = SpeechScheduler(voice_gender="FEMALE")
         # ===== Style =====
         style = ttk.Style(self)
         style.theme_use("clam")
@@ -92,6 +96,8 @@ class MainWindow(tk.Tk):
                                 bg="#1e1e1e", fg="#e0e0e0", font=("Consolas", 10),
                                 relief=tk.FLAT, padx=10, pady=6, state=tk.DISABLED)
         self.chat_box.pack(fill=tk.BOTH, expand=True, pady=(5, 2))
+        self.chat_box.tag_config("selfmsg", foreground="#00aaff")
+        self.chat_box.tag_config("servermsg", foreground="#90ee90")
 
         # Input row (fixed bottom)
         input_row = ttk.Frame(chat_frame)
@@ -102,10 +108,16 @@ class MainWindow(tk.Tk):
         self.msg_entry.bind("<Return>", self._on_enter)
 
         # ===== WebSocket =====
+        # callback chạy trên thread websocket -> chỉ đẩy vào hàng đợi,
+        # Tk thread sẽ lấy ra theo lô trong _drain_ui_queue
+        self._ui_queue = queue.Queue()
+        self._connected = False
         self.client = WebSocketClient(
             on_chat_callback=self.display_chat,
-            on_status_callback=self.update_status
+            on_status_callback=self.update_status,
+            on_rtt_callback=self.update_rtt
         )
+        self.after(UI_POLL_MS, self._drain_ui_queue)
         threading.Thread(target=self.run_ws, daemon=True).start()
 
         # ===== Tray =====
@@ -133,29 +145,68 @@ class MainWindow(tk.Tk):
         os.execl(python, python, *sys.argv)
 
     def update_status(self, connected: bool):
-        self.status_label.config(
-            text="🟢 Connected" if connected else "🔴 Disconnected",
-            foreground="green" if connected else "red"
-        )
+        """An toàn khi gọi từ bất kỳ thread nào."""
+        self._ui_queue.put(("status", connected))
+
+    def update_rtt(self, rtt_ms: float):
+        """An toàn khi gọi từ bất kỳ thread nào."""
+        self._ui_queue.put(("rtt", rtt_ms))
+
+    def _apply_status(self, connected: bool, rtt_ms=None):
+        text = "🟢 Connected" if connected else "🔴 Disconnected"
+        if connected and rtt_ms is not None:
+            text += f" · {rtt_ms:.0f} ms"
+        self.status_label.config(text=text, foreground="green" if connected else "red")
+
+    def _drain_ui_queue(self):
+        chat_lines, status, rtt = [], None, None
+        try:
+            for _ in range(UI_BATCH_SIZE):
+                kind, value = self._ui_queue.get_nowait()
+                if kind == "chat":
+                    chat_lines.append(value)
+                elif kind == "status":
+                    status = value
+                elif kind == "rtt":
+                    rtt = value
+        except queue.Empty:
+            pass
+
+        if status is not None:
+            self._connected = status
+        if status is not None or rtt is not None:
+            self._apply_status(self._connected, rtt if rtt is not None else self.client.rtt_ms)
+        if chat_lines:
+            self._render_chat(chat_lines)
+        self.after(UI_POLL_MS, self._drain_ui_queue)
 
     # ========== Chat Logic ==========
 
     def display_chat(self, msg: str):
+        """An toàn khi gọi từ bất kỳ thread nào."""
+        self._ui_queue.put(("chat", msg))
+
+    def _render_chat(self, lines):
         self.chat_box.config(state=tk.NORMAL)
-        tag = "selfmsg" if msg.startswith("You:") else "servermsg"
-        self.chat_box.insert(tk.END, msg + "\n", tag)
-        self.chat_box.tag_config("selfmsg", foreground="#00aaff")
-        self.chat_box.tag_config("servermsg", foreground="#90ee90")
+        for msg in lines:
+            tag = "selfmsg" if msg.startswith("You:") else "servermsg"
+            self.chat_box.insert(tk.END, msg + "\n", tag)
+
+        # giới hạn lịch sử chat để Text widget không phình mãi
+        line_count = int(self.chat_box.index("end-1c").split(".")[0])
+        if line_count > MAX_CHAT_LINES:
+            self.chat_box.delete("1.0", f"{line_count - MAX_CHAT_LINES + 1}.0")
         self.chat_box.config(state=tk.DISABLED)
         self.chat_box.see(tk.END)
 
+        incoming = [msg for msg in lines if not msg.startswith("You:")]
+        if not incoming:
+            return
+
         # Khi có tin nhắn mới từ server → đọc bằng TTS
-        if not msg.startswith("You:"):
+        for msg in incoming:
             text_to_speak = msg.split(":", 1)[1]
-            threading.Thread(
-                target=lambda: synthesize_and_play(text_to_speak, voice_gender="FEMALE"),
-                daemon=True
-            ).start()
+            self.speech.say(text_to_speak)
 
         try:
             if self.state() == 'iconic':
@@ -194,6 +245,8 @@ class MainWindow(tk.Tk):
             self.create_tray_icon()
 
     def create_tray_icon(self):
+        from PIL import Image, ImageDraw
+        import pystray
         image = Image.new('RGB', (64, 64), color='white')
         draw = ImageDraw.Draw(image)
         draw.rectangle((0, 0, 63, 63), fill=(30, 144, 255))